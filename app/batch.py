@@ -0,0 +1,304 @@
+"""
+Headless batch mode: answer the questions of a JSONL file with the app pipeline, e.g. for reports or to warm caches up.
+
+Each line of the input is an object with a `question`, and optionally an `id` (its line number otherwise). Answers are
+appended to the output JSONL file as they are computed, which is also the checkpoint of the run: an interrupted run
+resumes where it stopped, the questions which failed are retried. With a `.parquet` output, the answers are appended
+to `<output>.partial.jsonl`, converted to Parquet at the end of the run.
+
+Run from the repo's root with: `python -m app.batch questions.jsonl answers.jsonl`
+The LLM APIs are the configured ones (`.env`), e.g. a stub endpoint through `HEAVY_LLM_BASE_URL`/`LIGHT_LLM_BASE_URL`.
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from app.configuration import get_config
+from app.llm import get_llm_client_registry
+from app.logic.pipeline import aclean_question_and_generate_sql_query, aexecute_sql_query, asummarize_result
+from app.tracing import start_trace
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+DEFAULT_MAX_RESULT_ROWS = 100
+
+BATCH_ANSWERS_SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("question", pa.string()),
+        ("clean_question", pa.string()),
+        ("sql_query", pa.string()),
+        ("sql_source", pa.string()),
+        ("num_rows", pa.int64()),
+        ("result", pa.string()),
+        ("response_md", pa.string()),
+        ("error", pa.string()),
+        ("duration_seconds", pa.float64()),
+    ]
+)
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class BatchQuestion(BaseModel):
+    id: str
+    question: str
+
+
+class BatchAnswer(BaseModel):
+    """Answer to a question of a batch, or the error which prevented it."""
+
+    id: str
+    question: str
+    clean_question: Optional[str] = None
+    sql_query: Optional[str] = None
+    sql_source: Optional[str] = None
+    num_rows: Optional[int] = None
+    result: Optional[str] = None  # JSON list of the first rows of the result
+    response_md: Optional[str] = None
+    error: Optional[str] = None
+    duration_seconds: float = 0.0
+
+
+class BatchConcurrency(BaseModel):
+    """Maximum number of questions at each stage of the pipeline at the same time."""
+
+    generation: int = Field(default=8, gt=0)  # NER and SQL generation, LLM bound
+    execution: int = Field(default=4, gt=0)  # SQL execution, database bound
+    summary: int = Field(default=8, gt=0)  # Summary of the result, LLM bound
+
+
+class BatchStats(BaseModel):
+    num_questions: int = 0
+    num_unique_questions: int = 0  # Identical questions are only answered once
+    num_resumed: int = 0  # Questions already answered by a previous run
+    num_answered: int = 0
+    num_failed: int = 0
+    duration_seconds: float = 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def load_batch_questions(input_path: Path) -> list[BatchQuestion]:
+    """Load the questions of a JSONL file. Questions without an id are identified by their line number."""
+    batch_questions = []
+    with input_path.open("r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            batch_questions.append(
+                BatchQuestion(id=str(entry.get("id", line_number)), question=entry["question"].strip())
+            )
+    return batch_questions
+
+
+def get_checkpoint_path(output_path: Path) -> Path:
+    """Get the JSONL file where the answers are appended as they are computed."""
+    if output_path.suffix == ".parquet":
+        return output_path.with_name(f"{output_path.name}.partial.jsonl")
+    return output_path
+
+
+def load_checkpoint(checkpoint_path: Path) -> dict[str, BatchAnswer]:
+    """Load the answers of a previous run, the last answer of an id replacing the previous ones."""
+    batch_answers: dict[str, BatchAnswer] = {}
+    if not checkpoint_path.exists():
+        return batch_answers
+    with checkpoint_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                batch_answer = BatchAnswer.model_validate_json(line)
+            except ValueError:
+                logger.warning(f"Skipping a truncated line of {checkpoint_path}, written by an interrupted run")
+                continue
+            batch_answers[batch_answer.id] = batch_answer
+    return batch_answers
+
+
+def load_output(output_path: Path) -> dict[str, BatchAnswer]:
+    """
+    Load the answers of a finished run, written to a Parquet output whose checkpoint was deleted. A JSONL output is its
+    own checkpoint, see `load_checkpoint`.
+    """
+    if output_path.suffix != ".parquet" or not output_path.exists():
+        return {}
+    return {row["id"]: BatchAnswer.model_validate(row) for row in pq.read_table(output_path).to_pylist()}
+
+
+def end_truncated_line(checkpoint_path: Path) -> None:
+    """End the last line of a checkpoint truncated by an interrupted run, so that the next answers start a new line."""
+    if not checkpoint_path.exists() or checkpoint_path.stat().st_size == 0:
+        return
+    with checkpoint_path.open("rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def serialize_result(result: pa.Table, max_result_rows: int) -> str:
+    return json.dumps(result.slice(0, max_result_rows).to_pylist(), default=str)
+
+
+async def answer_batch_question(
+    question: str, semaphores: dict[str, asyncio.Semaphore], thinking_mode: bool, max_result_rows: int
+) -> BatchAnswer:
+    """
+    Answer a question, each stage of the pipeline waiting for a slot of its own. Errors are part of the answer. Each
+    question is traced on its own, see `app.tracing`.
+    """
+    batch_answer = BatchAnswer(id="", question=question)
+    start_time = time.perf_counter()
+    with start_trace("batch_question", {"question": question}):
+        try:
+            async with semaphores["generation"]:
+                clean_question, sql_generation = await aclean_question_and_generate_sql_query(
+                    question, thinking_mode, speculative=get_config().speculative_sql_generation_enabled
+                )
+            batch_answer.clean_question = clean_question
+            batch_answer.sql_query, batch_answer.sql_source = sql_generation.sql_query, sql_generation.source
+
+            async with semaphores["execution"]:
+                result = await aexecute_sql_query(clean_question, sql_generation)
+            batch_answer.num_rows, batch_answer.result = result.num_rows, serialize_result(result, max_result_rows)
+
+            async with semaphores["summary"]:
+                batch_answer.response_md, _ = await asummarize_result(clean_question, result)
+        except Exception as e:  # noqa: BLE001
+            # A failed question must not stop the batch, it is retried by the next run
+            batch_answer.error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Failed to answer question {question!r}: {batch_answer.error}")
+    batch_answer.duration_seconds = time.perf_counter() - start_time
+    return batch_answer
+
+
+async def arun_batch(
+    input_path: Path,
+    output_path: Path,
+    concurrency: Optional[BatchConcurrency] = None,
+    thinking_mode: bool = False,
+    max_result_rows: int = DEFAULT_MAX_RESULT_ROWS,
+) -> BatchStats:
+    """
+    Answer the questions of a JSONL file and write the answers to a JSONL or Parquet file, resuming a previous run.
+
+    Identical questions are answered once. Answers are appended to the checkpoint file as soon as they are computed, in
+    completion order.
+    """
+    concurrency = concurrency or BatchConcurrency()
+    start_time = time.perf_counter()
+    batch_questions = load_batch_questions(input_path)
+    checkpoint_path = get_checkpoint_path(output_path)
+    # The answers of the checkpoint are more recent than those of the output
+    previous_answers = load_output(output_path) | load_checkpoint(checkpoint_path)
+
+    ids_by_question: dict[str, list[str]] = defaultdict(list)
+    for batch_question in batch_questions:
+        previous_answer = previous_answers.get(batch_question.id)
+        if previous_answer is None or previous_answer.error is not None:
+            ids_by_question[batch_question.question].append(batch_question.id)
+    stats = BatchStats(
+        num_questions=len(batch_questions),
+        num_unique_questions=len({batch_question.question for batch_question in batch_questions}),
+        num_resumed=len(batch_questions) - sum(len(ids) for ids in ids_by_question.values()),
+    )
+    logger.info(
+        f"Answering {len(ids_by_question)} unique questions, {stats.num_resumed}/{stats.num_questions} questions "
+        f"already answered by a previous run"
+    )
+
+    semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in concurrency.model_dump().items()}
+    tasks = [
+        asyncio.create_task(answer_batch_question(question, semaphores, thinking_mode, max_result_rows))
+        for question in ids_by_question
+    ]
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    end_truncated_line(checkpoint_path)
+    with checkpoint_path.open("a", encoding="utf-8") as f:
+        for task in asyncio.as_completed(tasks):
+            batch_answer = await task
+            stats.num_answered += batch_answer.error is None
+            stats.num_failed += batch_answer.error is not None
+            for question_id in ids_by_question[batch_answer.question]:
+                f.write(batch_answer.model_copy(update={"id": question_id}).model_dump_json() + "\n")
+            f.flush()
+            logger.info(f"Answered {stats.num_answered + stats.num_failed}/{len(tasks)} unique questions")
+
+    if output_path != checkpoint_path:
+        batch_answers = list((load_output(output_path) | load_checkpoint(checkpoint_path)).values())
+        rows = [batch_answer.model_dump() for batch_answer in batch_answers]
+        pq.write_table(pa.Table.from_pylist(rows, schema=BATCH_ANSWERS_SCHEMA), output_path)
+        checkpoint_path.unlink()
+
+    stats.duration_seconds = time.perf_counter() - start_time
+    logger.info(
+        f"Batch done in {stats.duration_seconds:.1f}s: {stats.num_answered} questions answered, {stats.num_failed} "
+        f"failed, {stats.num_resumed} resumed"
+    )
+    return stats
+
+
+def run_batch(
+    input_path: Path,
+    output_path: Path,
+    concurrency: Optional[BatchConcurrency] = None,
+    thinking_mode: bool = False,
+    max_result_rows: int = DEFAULT_MAX_RESULT_ROWS,
+) -> BatchStats:
+    """Sync version of `arun_batch`."""
+
+    async def arun_batch_on_own_loop() -> BatchStats:
+        try:
+            return await arun_batch(input_path, output_path, concurrency, thinking_mode, max_result_rows)
+        finally:
+            # The async LLM clients are bound to the loop of the batch, which stops with it
+            await get_llm_client_registry().aclose()
+
+    return asyncio.run(arun_batch_on_own_loop())
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_path", type=Path, help="JSONL file of the questions.")
+    parser.add_argument("output_path", type=Path, help="JSONL or Parquet file of the answers.")
+    parser.add_argument("--generation-concurrency", type=int, default=BatchConcurrency().generation)
+    parser.add_argument("--execution-concurrency", type=int, default=BatchConcurrency().execution)
+    parser.add_argument("--summary-concurrency", type=int, default=BatchConcurrency().summary)
+    parser.add_argument("--thinking-mode", action="store_true", help="Generate the SQL queries in thinking mode.")
+    parser.add_argument(
+        "--max-result-rows", type=int, default=DEFAULT_MAX_RESULT_ROWS, help="Number of rows of each result written."
+    )
+    args = parser.parse_args()
+
+    run_batch(
+        input_path=args.input_path,
+        output_path=args.output_path,
+        concurrency=BatchConcurrency(
+            generation=args.generation_concurrency,
+            execution=args.execution_concurrency,
+            summary=args.summary_concurrency,
+        ),
+        thinking_mode=args.thinking_mode,
+        max_result_rows=args.max_result_rows,
+    )
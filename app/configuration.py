@@ -1,3 +1,7 @@
+import functools
+from pathlib import Path
+from typing import Optional
+
 from pydantic import Field, SecretStr
 from pydantic_settings import BaseSettings
 
@@ -29,5 +33,221 @@ class Config(BaseSettings):
         default="meta-llama/llama-3.3-70b-instruct:free",
     )
 
+    llm_pool_max_connections: int = Field(
+        description="Maximum number of HTTP connections opened by each LLM client.",
+        default=20,
+        gt=0,
+    )
+    llm_pool_max_keepalive_connections: int = Field(
+        description="Maximum number of idle HTTP connections kept alive by each LLM client.",
+        default=10,
+        ge=0,
+    )
+    llm_pool_keepalive_expiry_seconds: float = Field(
+        description="Time after which an idle HTTP connection to a LLM API is closed.",
+        default=60.0,
+        gt=0,
+    )
+    llm_max_concurrent_requests_per_endpoint: int = Field(
+        description="Maximum number of requests sent at the same time to a given LLM API base URL.",
+        default=8,
+        gt=0,
+    )
+
+    llm_cache_enabled: bool = Field(
+        description="Whether LLM responses are cached, to skip the LLM call when the same query is sent again.",
+        default=True,
+    )
+    llm_cache_path: Path = Field(
+        description="Path of the SQLite file persisting the LLM responses cache.",
+        default=Path("data") / "cache" / "llm_cache.sqlite",
+    )
+    llm_cache_ttl_seconds: float = Field(
+        description="Time after which a cached LLM response expires.",
+        default=7 * 24 * 3600,
+        gt=0,
+    )
+    llm_cache_max_memory_entries: int = Field(
+        description="Maximum number of LLM responses kept in memory.",
+        default=1024,
+        ge=0,
+    )
+    llm_cache_max_disk_size_mb: float = Field(
+        description="Maximum size of the LLM responses persisted on disk.",
+        default=256,
+        ge=0,
+    )
+    llm_cache_max_temperature: float = Field(
+        description="LLM responses are only cached for queries with a temperature up to this value.",
+        default=0.0,
+        ge=0,
+    )
+
+    llm_retry_base_delay_seconds: float = Field(
+        description="Base delay of the exponential backoff between two attempts of a failed LLM query.",
+        default=1.0,
+        ge=0,
+    )
+    llm_retry_max_delay_seconds: float = Field(
+        description="Maximum delay between two attempts of a failed LLM query. Longer Retry-After are not waited.",
+        default=30.0,
+        ge=0,
+    )
+    llm_rate_limit_requests_per_minute: Optional[float] = Field(
+        description="Maximum average number of requests per minute sent to a given LLM API base URL. None to disable.",
+        default=None,
+        gt=0,
+    )
+    llm_rate_limit_burst: int = Field(
+        description="Number of requests which can be sent at once to a LLM API before the rate limit applies.",
+        default=5,
+        gt=0,
+    )
+    llm_circuit_breaker_failure_threshold: int = Field(
+        description="Number of consecutive failed requests to a LLM API after which requests fail fast.",
+        default=5,
+        gt=0,
+    )
+    llm_circuit_breaker_reset_timeout_seconds: float = Field(
+        description="Time during which requests to a failing LLM API fail fast, before a new trial request.",
+        default=30.0,
+        ge=0,
+    )
+    db_pool_size: int = Field(
+        description="Maximum number of queries run at the same time on the database, the others wait for a cursor.",
+        default=4,
+        gt=0,
+    )
+    duckdb_threads: Optional[int] = Field(
+        description="Number of threads used by DuckDB to run queries. None for DuckDB default (number of cores).",
+        default=None,
+        gt=0,
+    )
+    duckdb_memory_limit: Optional[str] = Field(
+        description="Maximum memory used by DuckDB, e.g. '2GB'. None for DuckDB default (80% of the RAM).",
+        default=None,
+    )
+    duckdb_temp_directory: Optional[Path] = Field(
+        description="Directory where DuckDB spills data which doesn't fit in memory. None for DuckDB default.",
+        default=None,
+    )
+    sql_timeout_seconds: float = Field(
+        description="Time after which a SQL query generated by the LLM is interrupted.",
+        default=30.0,
+        gt=0,
+    )
+    sql_max_estimated_cardinality: int = Field(
+        description="SQL queries with a step estimated to process more rows than this are rejected before execution.",
+        default=1_000_000_000,
+        gt=0,
+    )
+    sql_auto_limit_rows: int = Field(
+        description="SQL queries whose result is estimated to have more rows than this are run with this LIMIT.",
+        default=100_000,
+        gt=0,
+    )
+    sql_max_result_rows: int = Field(
+        description="Maximum number of rows fetched from the result of a SQL query, the next ones are dropped.",
+        default=1_000_000,
+        gt=0,
+    )
+    sql_result_cache_enabled: bool = Field(
+        description="Whether the results of SQL queries are cached, to skip their execution when they are run again.",
+        default=True,
+    )
+    sql_result_cache_path: Path = Field(
+        description="Directory of the Parquet files where SQL results are spilled when they don't fit in memory.",
+        default=Path("data") / "cache" / "sql_results",
+    )
+    sql_result_cache_max_memory_mb: float = Field(
+        description="Maximum size of the SQL results kept in memory, as Arrow tables.",
+        default=256,
+        ge=0,
+    )
+    sql_result_cache_max_disk_size_mb: float = Field(
+        description="Maximum size of the SQL results spilled on disk, as Parquet files.",
+        default=1024,
+        ge=0,
+    )
+    warmup_enabled: bool = Field(
+        description="Whether the database and the indexes are warmed up once per process, when the app first renders.",
+        default=False,
+    )
+    warmup_hot_columns: list[str] = Field(
+        description="Tables (e.g. 'player') or columns (e.g. 'player.player_name') read by the warm-up.",
+        default=["game_boxscore", "game_summary", "player"],
+    )
+    warmup_queries_path: Optional[Path] = Field(
+        description="JSON list of objects with a 'sql_query', representative queries run by the warm-up. None to skip.",
+        default=Path("data") / "benchmark" / "test_dataset" / "dataset_request_to_sql.json",
+    )
+    warmup_ready_path: Optional[Path] = Field(
+        description="File where the warm-up report is written once the process is warm, e.g. for a readiness probe.",
+        default=None,
+    )
+    ner_gazetteer_enabled: bool = Field(
+        description="Whether players and teams names are first searched in the db names, to skip the LLM NER call.",
+        default=True,
+    )
+    sql_schema_pruning_enabled: bool = Field(
+        description="Whether only the tables and columns relevant to a question are described in the SQL prompt.",
+        default=True,
+    )
+    result_summary_llm_enabled: bool = Field(
+        description="Whether tiny results are always summarized by the light LLM, instead of a template when possible.",
+        default=False,
+    )
+    large_result_summary_enabled: bool = Field(
+        description="Whether large results are summarized by the light LLM, from a digest of their statistics.",
+        default=True,
+    )
+    result_digest_max_tokens: int = Field(
+        description="Maximum number of tokens of the digest of a large result given to the LLM to summarize it.",
+        default=1000,
+        gt=0,
+    )
+    speculative_sql_generation_enabled: bool = Field(
+        description="Whether the SQL query is generated during the NER, used if the NER leaves the question as is.",
+        default=False,
+    )
+    sql_templates_enabled: bool = Field(
+        description="Whether questions of frequent shapes get their SQL from vetted templates, skipping the LLM call.",
+        default=True,
+    )
+    sql_model_routing_enabled: bool = Field(
+        description="Whether simple questions get their SQL from the light LLM, escalated to the heavy LLM if invalid.",
+        default=False,
+    )
+    sql_routing_max_light_complexity: int = Field(
+        description="Maximum complexity score of a question routed to the light LLM, see `app.logic.model_routing`.",
+        default=2,
+        ge=0,
+    )
+    sql_cache_enabled: bool = Field(
+        description="Whether validated SQL queries are cached, to skip the LLM call when a similar question is asked.",
+        default=True,
+    )
+    sql_cache_path: Path = Field(
+        description="Path of the SQLite file persisting the SQL queries cache.",
+        default=Path("data") / "cache" / "sql_cache.sqlite",
+    )
+    sql_cache_min_similarity: float = Field(
+        description="Minimum Jaccard similarity of the words of a question with a cached one to reuse its SQL query.",
+        default=0.8,
+        gt=0,
+        le=1,
+    )
+    single_flight_enabled: bool = Field(
+        description="Whether identical concurrent LLM queries, SQL queries and questions share a single execution.",
+        default=True,
+    )
+    trace_export_path: Optional[Path] = Field(
+        description="JSONL file where the spans of each request are appended, in the OTLP JSON format. None to skip.",
+        default=None,
+    )
+
 
-config = Config(_env_file=".env")
+@functools.cache
+def get_config() -> Config:
+    """Load the configuration from the environment and the .env file, on first use."""
+    return Config(_env_file=".env")
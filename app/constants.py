@@ -6,3 +6,12 @@ DEFAULT_LLM_TEMPERATURE = 0.0
 DEFAULT_LLM_MAX_RETRIES = 3
 
 MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD = 20
+
+# Digest of the results too large to be given as is to the LLM
+RESULT_DIGEST_MAX_COLUMNS = 20
+RESULT_DIGEST_MAX_LEADING_ROWS = 10
+RESULT_DIGEST_MAX_VALUE_CHARS = 40
+RESULT_DIGEST_TOP_K = 5
+
+SQL_RESULT_BATCH_NUM_ROWS = 100_000
+SQL_RESULT_PAGE_NUM_ROWS = 1000
@@ -1,6 +1,164 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import functools
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Optional
+
 import duckdb
+from loguru import logger
+from pydantic import BaseModel
 
+from app.configuration import get_config
 from app.constants import DB_PATH
 
-# TODO: Encapsulate
-con = duckdb.connect(database=DB_PATH, read_only=True)
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class DBPoolStats(BaseModel):
+    """Counters describing how long queries wait for a database cursor, and how well cursors are reused."""
+
+    cursors_created: int = 0
+    reopens: int = 0  # Database instances reopened because the database file was replaced
+    checkouts: int = 0
+    waits: int = 0  # Checkouts which waited for another query to release a cursor
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    @property
+    def avg_wait_seconds(self) -> float:
+        return self.total_wait_seconds / self.checkouts if self.checkouts else 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Pool
+
+
+class DBConnectionPool:
+    """
+    Bounded pool of cursors over a single DuckDB database instance, opened on first use.
+
+    A DuckDB connection must not be used by several threads at once, but its cursors are independent connections to
+    the same database instance, sharing its buffer manager and catalog. Each query checks out a cursor for its own use,
+    so queries from different threads (e.g. Streamlit sessions) run concurrently. At most `pool_size` cursors are
+    checked out at once, the other queries wait for one to be released. Released cursors are reused.
+
+    The database instance is tied to the fingerprint of the file it was opened from. When the file is modified or
+    replaced, the next checkout waits for the cursors in use to be released, then closes the instance and opens the new
+    file: DuckDB would otherwise keep serving the old one, even to a new connection to the same path.
+    """
+
+    def __init__(self, database: Path, pool_size: int, settings: Optional[dict[str, Any]] = None) -> None:
+        self.database = database
+        self.pool_size = pool_size
+        self.settings = settings or {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._released = threading.Condition(self._lock)
+        self._connection: Optional[duckdb.DuckDBPyConnection] = None
+        self._idle_cursors: list[duckdb.DuckDBPyConnection] = []
+        self._num_checked_out = 0
+        self.fingerprint: Optional[str] = None  # Fingerprint of the file the database instance was opened from
+        self.stats = DBPoolStats()
+
+    @contextmanager
+    def cursor(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """Check out a cursor until the end of the context. A cursor which raised an error is closed, not reused."""
+        start_time = time.perf_counter()
+        waited = not self._slots.acquire(blocking=False)
+        if waited:
+            self._slots.acquire()
+            logger.debug(f"Waited {time.perf_counter() - start_time:.3f}s for a database cursor")
+        wait_seconds = time.perf_counter() - start_time
+
+        try:
+            with self._lock:
+                self.stats.checkouts += 1
+                self.stats.waits += waited
+                self.stats.total_wait_seconds += wait_seconds
+                self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, wait_seconds)
+                self._close_if_replaced()
+                cursor = self._idle_cursors.pop() if self._idle_cursors else self._create_cursor()
+                self._num_checked_out += 1
+
+            is_reusable = False
+            try:
+                yield cursor
+                is_reusable = True
+            finally:
+                with self._lock:
+                    if is_reusable:
+                        self._idle_cursors.append(cursor)
+                    else:
+                        cursor.close()
+                    self._num_checked_out -= 1
+                    self._released.notify_all()
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Close the idle cursors and the database instance. Checked out cursors are closed along with the latter."""
+        with self._lock:
+            self._close_connection()
+
+    def _close_connection(self) -> None:
+        for cursor in self._idle_cursors:
+            cursor.close()
+        self._idle_cursors.clear()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _close_if_replaced(self) -> None:
+        """Close the database instance if its file was replaced, once its cursors in use are released."""
+        if self._connection is None or compute_db_fingerprint(self.database) == self.fingerprint:
+            return
+        logger.info(f"Database {self.database} was replaced, reopening it once its cursors in use are released")
+        self._released.wait_for(lambda: self._num_checked_out == 0)
+        if self._connection is not None:  # Another checkout may have closed it while this one waited
+            self._close_connection()
+            self.stats.reopens += 1
+
+    def _create_cursor(self) -> duckdb.DuckDBPyConnection:
+        if self._connection is None:
+            self.fingerprint = compute_db_fingerprint(self.database)
+            self._connection = duckdb.connect(database=self.database, read_only=True, config=self.settings)
+            logger.debug(f"Opened database {self.database} with settings {self.settings}")
+        self.stats.cursors_created += 1
+        return self._connection.cursor()
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+@functools.cache
+def get_db_pool() -> DBConnectionPool:
+    """Retrieve the process-wide pool of database cursors."""
+    config = get_config()
+    settings = {
+        "threads": config.duckdb_threads,
+        "memory_limit": config.duckdb_memory_limit,
+        "temp_directory": str(config.duckdb_temp_directory) if config.duckdb_temp_directory is not None else None,
+    }
+    return DBConnectionPool(
+        database=DB_PATH,
+        pool_size=config.db_pool_size,
+        settings={name: value for name, value in settings.items() if value is not None},
+    )
+
+
+def compute_db_fingerprint(database: Path) -> str:
+    """Fingerprint of a database file, which changes when the file is modified or replaced."""
+    stat = database.stat()
+    return f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def get_db_fingerprint() -> str:
+    """Fingerprint of the database file, which changes when the file is modified or replaced."""
+    return compute_db_fingerprint(DB_PATH)
@@ -1,37 +1,189 @@
-import pandas as pd
+import functools
+from typing import TYPE_CHECKING, Optional
 
-from app.db.connection import con
+import pyarrow as pa
+from loguru import logger
+
+from app.configuration import get_config
+from app.constants import SQL_RESULT_BATCH_NUM_ROWS
+from app.db.connection import get_db_fingerprint, get_db_pool
+from app.db.query_guard import guard_sql_query, limit_sql_query, query_deadline
+from app.db.result_cache import ResultCache, make_result_cache_key
+from app.singleflight import SingleFlight
+from app.tracing import set_span_attributes, traced
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Schema metadata flagging a result limited to `sql_auto_limit_rows` rows, its query being estimated to return more
+AUTO_LIMITED_METADATA_KEY = b"auto_limited"
+
+# Each function checks out its own cursor from the pool: a cursor must not be shared between threads.
 
 
 def get_players_names() -> list[str]:
     """Retrieve list of player names available in the database."""
-    return [e[0] for e in con.sql("select distinct player_name from player").fetchall()]
+    with get_db_pool().cursor() as cursor:
+        return [e[0] for e in cursor.sql("select distinct player_name from player").fetchall()]
 
 
 def get_teams_names() -> list[str]:
     """Retrieve list of team names available in the database."""
-    return [e[0] for e in con.sql("select distinct team_name from team").fetchall()]
+    with get_db_pool().cursor() as cursor:
+        return [e[0] for e in cursor.sql("select distinct team_name from team").fetchall()]
 
 
-def get_table_columns(table_name: str) -> list[str, str]:
-    """Retrieve list of columns name and type for a given table."""
-    return [
-        e
-        for e in con.sql(
-            f"select column_name, data_type from information_schema.columns where table_name = '{table_name}'"
+def get_tables_columns() -> dict[str, list[tuple[str, str]]]:
+    """Retrieve the columns name and type of all the tables available in the database, with a single query."""
+    with get_db_pool().cursor() as cursor:
+        rows = cursor.sql(
+            "select table_name, column_name, data_type from information_schema.columns "
+            "where not starts_with(table_name, 'base_') "  # These tables should not be in the final db
+            "order by table_name, ordinal_position"
         ).fetchall()
-    ]
+
+    tables_columns: dict[str, list[tuple[str, str]]] = {}
+    for table_name, column_name, data_type in rows:
+        tables_columns.setdefault(table_name, []).append((column_name, data_type))
+    return tables_columns
 
 
 def get_tables() -> list[str]:
     """Retrieve list of tables available in the database."""
-    return [
-        e[0]
-        for e in con.sql("select table_name from information_schema.tables").fetchall()
-        if not e[0].startswith("base_")  # These tables should not be in the final db
-    ]
+    with get_db_pool().cursor() as cursor:
+        return [
+            e[0]
+            for e in cursor.sql("select table_name from information_schema.tables").fetchall()
+            if not e[0].startswith("base_")  # These tables should not be in the final db
+        ]
+
+
+def scan_table(table_name: str, column_names: list[str]) -> int:
+    """Read all the values of some columns of a table, to load their pages in memory. Returns its number of rows."""
+    columns = ", ".join(f'"{column_name}"' for column_name in column_names)
+    with get_db_pool().cursor() as cursor:
+        return cursor.sql(f'select count(*), sum(hash({columns})) from "{table_name}"').fetchone()[0]
+
+
+@functools.cache
+def get_result_cache() -> Optional[ResultCache]:
+    """Retrieve the process-wide cache of SQL results, None if caching is disabled."""
+    config = get_config()
+    if not config.sql_result_cache_enabled:
+        return None
+    return ResultCache(
+        path=config.sql_result_cache_path,
+        max_memory_size_bytes=int(config.sql_result_cache_max_memory_mb * 1024 * 1024),
+        max_disk_size_bytes=int(config.sql_result_cache_max_disk_size_mb * 1024 * 1024),
+    )
+
+
+@functools.cache
+def get_sql_single_flight() -> Optional[SingleFlight]:
+    """Retrieve the process-wide group deduplicating identical SQL queries in flight, None if disabled."""
+    if not get_config().single_flight_enabled:
+        return None
+    return SingleFlight(name="SQL queries")
+
+
+def execute_sql_query(sql_query: str) -> pa.Table:
+    """Execute a SQL query, checked and interrupted as described in `sql_to_arrow`, without caching its result."""
+    config = get_config()
+    with get_db_pool().cursor() as cursor:
+        guarded_sql_query = guard_sql_query(
+            cursor,
+            sql_query,
+            max_estimated_cardinality=config.sql_max_estimated_cardinality,
+            max_estimated_rows=config.sql_auto_limit_rows,
+        )
+        with (
+            query_deadline(cursor, sql_query, timeout_seconds=config.sql_timeout_seconds),
+            cursor.sql(guarded_sql_query).fetch_arrow_reader(batch_size=SQL_RESULT_BATCH_NUM_ROWS) as reader,
+        ):
+            batches = []
+            num_rows = 0
+            for batch in reader:
+                batches.append(batch)
+                num_rows += batch.num_rows
+                if num_rows >= config.sql_max_result_rows:
+                    logger.warning(f"SQL query result capped to {config.sql_max_result_rows:,} rows")
+                    break
+            result = pa.Table.from_batches(batches, schema=reader.schema).slice(0, config.sql_max_result_rows)
+
+    if guarded_sql_query != sql_query:
+        result = result.replace_schema_metadata({**(result.schema.metadata or {}), AUTO_LIMITED_METADATA_KEY: b"true"})
+    return result
+
+
+def is_auto_limited(result: pa.Table) -> bool:
+    """Check if a result was limited to `sql_auto_limit_rows` rows, its query being estimated to return more."""
+    return AUTO_LIMITED_METADATA_KEY in (result.schema.metadata or {})
+
+
+@traced("db.validate")
+def validate_sql_query(sql_query: str) -> None:
+    """Check a SQL query with `EXPLAIN` without running it. Raise a `SqlExecutionError` if invalid or too costly."""
+    config = get_config()
+    with get_db_pool().cursor() as cursor:
+        guard_sql_query(
+            cursor,
+            sql_query,
+            max_estimated_cardinality=config.sql_max_estimated_cardinality,
+            max_estimated_rows=config.sql_auto_limit_rows,
+        )
+
+
+@traced("db.execute")
+def sql_to_arrow(sql_query: str) -> pa.Table:
+    """
+    Execute a SQL query and return the result as an Arrow table.
+
+    Results are cached, keyed on the normalized query and the fingerprint of the database. The query is checked with
+    `EXPLAIN` first, and interrupted if it runs past its deadline. Raise a `SqlExecutionError` if it is invalid, too
+    expensive or too long. A query estimated to return too many rows is limited, see `is_auto_limited`. The result is
+    fetched in record batches, and capped to the configured maximum number of rows so that a huge result doesn't
+    exhaust the memory. Identical queries in flight at the same time share a single
+    execution.
+    """
+    config = get_config()
+    db_fingerprint = get_db_fingerprint()
+    key = make_result_cache_key(
+        sql_query,
+        db_fingerprint,
+        max_rows=config.sql_auto_limit_rows,
+        max_result_rows=config.sql_max_result_rows,
+    )
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        result = result_cache.get(key)
+        if result is not None:
+            set_span_attributes({"db.cache_hit": True, "db.num_rows": result.num_rows})
+            return result
+
+    def run_query() -> pa.Table:
+        result = execute_sql_query(sql_query)
+        # A result computed on a database replaced since the key was built must not be cached under that key
+        if result_cache is not None and get_db_fingerprint() == db_fingerprint:
+            result_cache.set(key, result, db_fingerprint)
+        return result
+
+    single_flight = get_sql_single_flight()
+    result = run_query() if single_flight is None else single_flight.call(key, run_query)
+    set_span_attributes({"db.cache_hit": False, "db.num_rows": result.num_rows})
+    return result
+
+
+def get_sql_result_page(sql_query: str, offset: int, num_rows: int) -> pa.Table:
+    """
+    Get `num_rows` rows of the result of a SQL query, starting from the `offset`-th one, e.g. to display a large result.
+
+    The page is a zero-copy slice of the cached result. When caching is disabled, the page is queried with LIMIT/OFFSET.
+    """
+    if get_result_cache() is None:
+        return sql_to_arrow(limit_sql_query(sql_query, num_rows, offset=offset))
+    return sql_to_arrow(sql_query).slice(offset, num_rows)
 
 
-def sql_to_df(sql_query: str) -> pd.DataFrame:
-    """Execute a SQL query and return the result as a pandas DataFrame."""
-    return con.sql(sql_query).df()
+def sql_to_df(sql_query: str) -> "pd.DataFrame":
+    """Execute a SQL query and return the result as a pandas DataFrame. See `sql_to_arrow`."""
+    return sql_to_arrow(sql_query).to_pandas(date_as_object=False)
@@ -0,0 +1,150 @@
+"""Guards of the SQL queries generated by the LLM: cost estimation before execution and deadline during execution."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import json
+import math
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import duckdb
+from loguru import logger
+from pydantic import BaseModel
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+# Join operators comparing all the pairs of rows of their inputs
+NESTED_LOOP_JOIN_OPERATORS = {"CROSS_PRODUCT", "BLOCKWISE_NL_JOIN", "NESTED_LOOP_JOIN"}
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Custom Exceptions
+
+
+class SqlExecutionError(Exception):
+    """Exception raised when a SQL query can't be executed. Its message is meant to be shown to the user."""
+
+    def __init__(self, message: str, sql_query: str) -> None:
+        super().__init__(message)
+        self.sql_query = sql_query
+
+
+class SqlTimeoutError(SqlExecutionError):
+    """Exception raised when a SQL query is interrupted because it ran past its deadline."""
+
+    pass
+
+
+class SqlCostError(SqlExecutionError):
+    """Exception raised when a SQL query is rejected before execution because its plan is estimated too expensive."""
+
+    pass
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class PlanEstimate(BaseModel):
+    """Numbers of rows estimated from the plan of a SQL query."""
+
+    num_rows: int  # Rows of the result
+    max_num_rows: int  # Rows output by the operator outputting the most
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def estimate_plan(plan_node: dict) -> PlanEstimate:
+    """
+    Estimate the cardinalities of a plan given by `EXPLAIN (FORMAT JSON)`, from the estimates of its operators.
+
+    DuckDB doesn't give an estimate for all the operators. Nested loop joins (e.g. cross products) are estimated to
+    output the product of their inputs, aggregates without groups a single row, and the others as many rows as their
+    largest input.
+    """
+    children_estimates = [estimate_plan(child) for child in plan_node.get("children", [])]
+    children_num_rows = [estimate.num_rows for estimate in children_estimates]
+    extra_info = plan_node.get("extra_info", {})
+    operator = plan_node.get("name", "").strip()
+
+    if "Estimated Cardinality" in extra_info:
+        num_rows = int(extra_info["Estimated Cardinality"])
+    elif operator in NESTED_LOOP_JOIN_OPERATORS:
+        num_rows = math.prod(children_num_rows)
+    elif operator == "UNGROUPED_AGGREGATE":
+        num_rows = 1
+    elif operator == "UNION":
+        num_rows = sum(children_num_rows)
+    else:
+        num_rows = max(children_num_rows, default=0)
+
+    max_num_rows = max([num_rows, *(estimate.max_num_rows for estimate in children_estimates)])
+    return PlanEstimate(num_rows=num_rows, max_num_rows=max_num_rows)
+
+
+def limit_sql_query(sql_query: str, max_rows: int, offset: int = 0) -> str:
+    """Wrap a SQL query so that at most `max_rows` rows are returned, from the `offset`-th one, keeping its order."""
+    limited_sql_query = f"select * from (\n{sql_query.strip().rstrip(';')}\n) limit {max_rows}"
+    return f"{limited_sql_query} offset {offset}" if offset else limited_sql_query
+
+
+def guard_sql_query(
+    cursor: duckdb.DuckDBPyConnection, sql_query: str, max_estimated_cardinality: int, max_estimated_rows: int
+) -> str:
+    """
+    Check the plan of a SQL query with `EXPLAIN` before its execution, without running it.
+
+    The query is rejected if any step of its plan is estimated to process more than `max_estimated_cardinality` rows
+    (e.g. a cross join of large tables). It is limited to `max_estimated_rows` rows if its result is estimated larger.
+    """
+    try:
+        plan = json.loads(cursor.sql(f"explain (format json) {sql_query}").fetchone()[1])
+    except duckdb.Error as e:
+        error_msg = f"The SQL query is invalid: {e}"
+        raise SqlExecutionError(error_msg, sql_query) from e
+
+    plan_estimate = estimate_plan({"children": plan})
+    if plan_estimate.max_num_rows > max_estimated_cardinality:
+        error_msg = (
+            f"The SQL query was not run: a step is estimated to process {plan_estimate.max_num_rows:,} rows, above "
+            f"the limit of {max_estimated_cardinality:,}. Try a more specific question."
+        )
+        raise SqlCostError(error_msg, sql_query)
+
+    if plan_estimate.num_rows > max_estimated_rows:
+        logger.warning(f"SQL query estimated to return {plan_estimate.num_rows:,} rows, limited")
+        return limit_sql_query(sql_query, max_estimated_rows)
+    return sql_query
+
+
+@contextmanager
+def query_deadline(cursor: duckdb.DuckDBPyConnection, sql_query: str, timeout_seconds: float) -> Iterator[None]:
+    """
+    Interrupt the query run by a cursor within the context if it lasts more than `timeout_seconds`.
+
+    A watchdog timer interrupts the cursor, so that the query stops using the DuckDB threads. Interrupting a cursor
+    which is not running a query has no effect.
+    """
+    timed_out = threading.Event()
+
+    def interrupt() -> None:
+        timed_out.set()
+        cursor.interrupt()
+
+    watchdog = threading.Timer(timeout_seconds, interrupt)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        yield
+    except duckdb.Error as e:
+        if timed_out.is_set():
+            error_msg = f"The SQL query was interrupted after running for more than {timeout_seconds:g}s."
+            raise SqlTimeoutError(error_msg, sql_query) from e
+        error_msg = f"The SQL query failed: {e}"
+        raise SqlExecutionError(error_msg, sql_query) from e
+    finally:
+        watchdog.cancel()
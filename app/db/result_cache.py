@@ -0,0 +1,196 @@
+"""Two-tier cache of SQL query results: Arrow tables in memory, spilled to Parquet files on disk."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from pydantic import BaseModel
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+# String literals and quoted identifiers, which are kept as is, and comments, which are dropped
+SQL_QUOTED_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+SQL_LEXEME_PATTERN = re.compile(rf"{SQL_QUOTED_PATTERN.pattern}|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class ResultCacheStats(BaseModel):
+    """Hit and miss counters of the SQL results cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    spills: int = 0  # Results moved from memory to disk
+    evictions: int = 0  # Results deleted from disk
+    invalidations: int = 0  # Results deleted because the database changed
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def normalize_sql_query(sql_query: str) -> str:
+    """Normalize a SQL query so that queries only differing by whitespaces, case or comments are equal."""
+    sql_query = SQL_LEXEME_PATTERN.sub(lambda match: match.group(1) or " ", sql_query)
+
+    # Splitting on the quoted parts alternates unquoted and quoted parts, only the former are normalized
+    parts = SQL_QUOTED_PATTERN.split(sql_query)
+    sql_query = "".join(part if i % 2 else re.sub(r"\s+", " ", part.lower()) for i, part in enumerate(parts))
+    return sql_query.strip().rstrip(";").strip()
+
+
+def make_result_cache_key(sql_query: str, db_fingerprint: str, max_rows: int, max_result_rows: int) -> str:
+    """
+    Build the cache key of the result of a SQL query, which changes with the database or the rows limits: `max_rows`
+    added to queries returning too many rows, and `max_result_rows` capping the result.
+    """
+    key_content = f"{db_fingerprint}\n{max_rows}\n{max_result_rows}\n{normalize_sql_query(sql_query)}"
+    return hashlib.sha256(key_content.encode()).hexdigest()
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Cache
+
+
+class ResultCache:
+    """
+    Cache of SQL query results, bounded by their size in bytes.
+
+    Results are kept as Arrow tables in an in-memory LRU. When the memory budget is exceeded, the least recently used
+    results are spilled to Parquet files, themselves deleted in LRU order when the disk budget is exceeded. A result
+    read from disk moves back to memory, unless it is larger than the memory budget.
+
+    Keys must include a fingerprint of the database: when a result is stored for a new fingerprint, the results of the
+    previous ones are deleted, so that stale results are never served once the database is replaced.
+    """
+
+    def __init__(self, path: Optional[Path], max_memory_size_bytes: int, max_disk_size_bytes: int) -> None:
+        self.path = path
+        self.max_memory_size_bytes = max_memory_size_bytes
+        self.max_disk_size_bytes = max_disk_size_bytes
+        self.stats = ResultCacheStats()
+
+        self._lock = threading.Lock()
+        self._db_fingerprint: Optional[str] = None
+        self._memory: OrderedDict[str, pa.Table] = OrderedDict()
+        self._memory_size_bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()  # key -> file size, files of previous runs included
+        if path is not None:
+            path.mkdir(parents=True, exist_ok=True)
+            for file in sorted(path.glob("*.parquet"), key=lambda f: f.stat().st_mtime):
+                self._disk[file.stem] = file.stat().st_size
+
+    @property
+    def memory_size_bytes(self) -> int:
+        return self._memory_size_bytes
+
+    @property
+    def disk_size_bytes(self) -> int:
+        return sum(self._disk.values())
+
+    def get(self, key: str) -> Optional[pa.Table]:
+        """Retrieve a result from the cache, None if it is missing."""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return result
+
+            if key in self._disk:
+                try:
+                    result = pq.read_table(self._get_file_path(key))
+                except OSError as e:
+                    logger.warning(f"Failed to read cached SQL result {key}: {e}")
+                    self._delete_from_disk(key)
+                else:
+                    self.stats.disk_hits += 1
+                    if result.nbytes > self.max_memory_size_bytes:
+                        self._disk.move_to_end(key)
+                    else:
+                        self._delete_from_disk(key)
+                        self._set_in_memory(key, result)
+                    return result
+
+            self.stats.misses += 1
+            return None
+
+    def set(self, key: str, result: pa.Table, db_fingerprint: str) -> None:
+        """Store the result of a SQL query run on the database with the given fingerprint."""
+        with self._lock:
+            if db_fingerprint != self._db_fingerprint:
+                if self._db_fingerprint is not None:
+                    self._invalidate()
+                self._db_fingerprint = db_fingerprint
+            self._set_in_memory(key, result)
+
+    def clear(self) -> None:
+        """Remove all the entries of the cache."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_size_bytes = 0
+            for key in list(self._disk):
+                self._delete_from_disk(key)
+
+    def _set_in_memory(self, key: str, result: pa.Table) -> None:
+        if key in self._memory:
+            self._memory_size_bytes -= self._memory.pop(key).nbytes
+        if result.nbytes > self.max_memory_size_bytes:
+            self._spill_to_disk(key, result)
+            return
+        self._memory[key] = result
+        self._memory_size_bytes += result.nbytes
+        while self._memory_size_bytes > self.max_memory_size_bytes:
+            spilled_key, spilled_result = self._memory.popitem(last=False)
+            self._memory_size_bytes -= spilled_result.nbytes
+            self._spill_to_disk(spilled_key, spilled_result)
+
+    def _spill_to_disk(self, key: str, result: pa.Table) -> None:
+        if self.path is None or self.max_disk_size_bytes <= 0:
+            return
+        file_path = self._get_file_path(key)
+        try:
+            pq.write_table(result, file_path)
+        except (OSError, pa.ArrowException) as e:
+            logger.warning(f"Failed to spill SQL result {key} to disk: {e}")
+            file_path.unlink(missing_ok=True)
+            return
+        self._disk[key] = file_path.stat().st_size
+        self.stats.spills += 1
+
+        while self._disk and self.disk_size_bytes > self.max_disk_size_bytes:
+            self._delete_from_disk(next(iter(self._disk)))
+            self.stats.evictions += 1
+
+    def _delete_from_disk(self, key: str) -> None:
+        self._disk.pop(key, None)
+        self._get_file_path(key).unlink(missing_ok=True)
+
+    def _invalidate(self) -> None:
+        """Delete all the results, which were computed on a previous version of the database."""
+        self.stats.invalidations += len(self._memory) + len(self._disk)
+        self._memory.clear()
+        self._memory_size_bytes = 0
+        for key in list(self._disk):
+            self._delete_from_disk(key)
+        logger.debug("Invalidated the SQL results cache, the database changed")
+
+    def _get_file_path(self, key: str) -> Path:
+        return self.path / f"{key}.parquet"
@@ -3,17 +3,101 @@
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
 
+import math
+import time
+from typing import TYPE_CHECKING, NoReturn
+
 import streamlit as st
 
-from app.constants import MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD
-from app.db.dao import sql_to_df
-from app.logic.ner_retrieval import replace_names_in_text
-from app.logic.question_to_sql import generate_sql_query
-from app.logic.results_display import generate_question_response_md
+from app.configuration import get_config
+from app.constants import MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD, SQL_RESULT_PAGE_NUM_ROWS
+
+if TYPE_CHECKING:
+    from streamlit.delta_generator import DeltaGenerator
+
+    from app.tracing import Trace
+
+# The pipeline modules (database, LLM clients, NER) are only imported once a question is asked, so that the first
+# render of the app doesn't wait for them. They stay imported across reruns.
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+@st.fragment
+def display_sql_query_result(sql_query: str, num_rows: int, auto_limited: bool, key: str) -> None:
+    """Display the result of a SQL query page by page. Changing page only reruns this function, not the whole app."""
+    from app.db.dao import get_sql_result_page  # noqa: PLC0415
+
+    config = get_config()
+    num_pages = max(1, math.ceil(num_rows / SQL_RESULT_PAGE_NUM_ROWS))
+    page = 1
+    if num_pages > 1:
+        page = st.number_input("Page", min_value=1, max_value=num_pages, value=1, key=f"{key}_page")
+    offset = (page - 1) * SQL_RESULT_PAGE_NUM_ROWS
+    st.dataframe(get_sql_result_page(sql_query, offset=offset, num_rows=SQL_RESULT_PAGE_NUM_ROWS))
+    if num_pages > 1:
+        st.caption(f"Rows {offset + 1:,} to {min(offset + SQL_RESULT_PAGE_NUM_ROWS, num_rows):,} of {num_rows:,}")
+    if num_rows >= config.sql_max_result_rows:
+        st.caption(f"The result was capped to its first {config.sql_max_result_rows:,} rows")
+    elif auto_limited:
+        st.caption(get_auto_limit_caption())
+
+
+def get_auto_limit_caption() -> str:
+    """Caption of a result limited because its query was estimated to return too many rows, see `is_auto_limited`."""
+    sql_auto_limit_rows = get_config().sql_auto_limit_rows
+    return (
+        f"The query was estimated to return more than {sql_auto_limit_rows:,} rows: the result was limited to its "
+        f"first {sql_auto_limit_rows:,} rows"
+    )
+
+
+def stop_on_error(error: Exception, *containers: "DeltaGenerator") -> NoReturn:
+    """Display an error in each container, e.g. tab, and stop the run of the app."""
+    for container in containers:
+        container.error(str(error))
+    st.stop()
+
+
+def display_trace_waterfall(trace: "Trace") -> None:
+    """Display the latency waterfall of a request: a bar per span, from its start to its end, nested stages indented."""
+    waterfall_rows = trace.to_waterfall_rows()
+    st.vega_lite_chart(
+        waterfall_rows,
+        {
+            "mark": {"type": "bar"},
+            "encoding": {
+                "y": {"field": "label", "type": "nominal", "sort": None, "title": None, "axis": {"labelLimit": 400}},
+                "x": {"field": "start_ms", "type": "quantitative", "title": "Time since the question (ms)"},
+                "x2": {"field": "end_ms"},
+                "color": {
+                    "field": "status",
+                    "type": "nominal",
+                    "scale": {"domain": ["ok", "error"], "range": ["#4c78a8", "#e45756"]},
+                    "legend": None,
+                },
+                "tooltip": [
+                    {"field": "label", "title": "Stage"},
+                    {"field": "duration_ms", "type": "quantitative", "title": "Duration (ms)", "format": ".1f"},
+                    {"field": "attributes", "title": "Attributes"},
+                ],
+            },
+            "height": {"step": 22},
+        },
+        use_container_width=True,
+    )
+    st.caption(f"Request traced in {trace.root.duration_seconds:.2f}s, {len(waterfall_rows)} spans")
+
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Layout
 
+config = get_config()
+if config.warmup_enabled:
+    from app.warmup import start_warmup
+
+    start_warmup()  # Once per process, in the background
 input_question = st.text_area(
     "Insights question",
     value="",
@@ -21,25 +105,146 @@ input_question = st.text_area(
 )
 
 thinking_mode = st.toggle("Thinking mode enabled", value=False, help="Improve performances but increases latency")
+speculative_mode = st.toggle(
+    "Speculative SQL generation enabled",
+    value=config.speculative_sql_generation_enabled,
+    help="Generate the SQL query while the names are resolved. Reduces latency when names are typed exactly",
+)
 input_trigger = st.button("Get an answer")
 tab_result, tab_inspection = st.tabs(["Result", "Inspection"])
 
 if input_trigger:
-    clean_question = replace_names_in_text(input_question)
-    tab_inspection.markdown("**Question cleaned by NER and retrieval pipeline**")
-    tab_inspection.write(clean_question)
-
-    sql_query = generate_sql_query(clean_question, thinking_mode)
-    tab_inspection.markdown("**SQL query generated by the text-to-SQL pipeline**")
-    tab_inspection.code(sql_query, language="sql")
-
-    tab_inspection.markdown("**SQL query result**")
-    sql_query_result = sql_to_df(sql_query)
-    tab_inspection.dataframe(sql_query_result)
-
-    num_values = sql_query_result.shape[0] * sql_query_result.shape[1]
-    if num_values < MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD:
-        response_md = generate_question_response_md(question=clean_question, result=sql_query_result)
-        tab_result.markdown(response_md)
-    else:
-        tab_result.dataframe(sql_query_result)
+    from app.db.dao import get_sql_single_flight, is_auto_limited, sql_to_arrow
+    from app.db.query_guard import SqlExecutionError
+    from app.llm import get_llm_single_flight
+    from app.logic.model_routing import get_routing_stats
+    from app.logic.ner_retrieval import replace_names_in_text
+    from app.logic.pipeline import (
+        aclean_question_and_generate_sql_query,
+        get_speculation_stats,
+        run_in_background_loop,
+    )
+    from app.logic.question_to_sql import (
+        SqlGeneration,
+        cache_sql_query,
+        extract_sql_query,
+        get_local_sql_generation,
+        stream_sql_query_generation,
+    )
+    from app.logic.results_display import (
+        get_response_stats,
+        render_question_response_md,
+        stream_question_response_md,
+    )
+    from app.logic.sql_templates import get_sql_template_stats
+    from app.tracing import start_trace
+
+    with start_trace("question", {"question": input_question}) as trace:
+        if speculative_mode:
+            # The SQL query isn't streamed: it is generated concurrently with the NER
+            clean_question, sql_generation = run_in_background_loop(
+                aclean_question_and_generate_sql_query(input_question, thinking_mode, speculative=True)
+            )
+        else:
+            clean_question = replace_names_in_text(input_question)
+            sql_generation = get_local_sql_generation(clean_question)
+        tab_inspection.markdown("**Question cleaned by NER and retrieval pipeline**")
+        tab_inspection.write(clean_question)
+
+        if sql_generation is None:
+            tab_inspection.markdown("**Response of the text-to-SQL pipeline**")
+            llm_response = tab_inspection.write_stream(stream_sql_query_generation(clean_question, thinking_mode))
+            sql_generation = SqlGeneration(sql_query=extract_sql_query(llm_response), source="llm")
+        sql_query = sql_generation.sql_query
+        tab_inspection.markdown("**SQL query generated by the text-to-SQL pipeline**")
+        if sql_generation.source == "template":
+            sql_template_stats = get_sql_template_stats()
+            tab_inspection.caption(
+                f"Source: vetted SQL template '{sql_generation.template_intent}', without LLM call "
+                f"(template hit rate in this process: {sql_template_stats.hit_rate:.0%})"
+            )
+        elif sql_generation.source == "cache":
+            tab_inspection.caption("Source: cache of validated SQL queries (similar question)")
+        else:
+            tab_inspection.caption("Source: LLM")
+        if config.sql_model_routing_enabled:
+            routing_stats = get_routing_stats()
+            saved_latency = f"~{routing_stats.saved_seconds:.1f}s" if routing_stats.saved_seconds is not None else "n/a"
+            tab_inspection.caption(
+                f"Model routing in this process: {routing_stats.routed_light} questions routed to the light LLM "
+                f"({routing_stats.escalations} escalated to the heavy LLM), {routing_stats.routed_heavy} to the heavy "
+                f"LLM, latency saved: {saved_latency}"
+            )
+        if speculative_mode:
+            speculation_stats = get_speculation_stats()
+            tab_inspection.caption(
+                f"Speculative SQL generation {'hit' if clean_question == input_question else 'miss'}, "
+                f"hit rate: {speculation_stats.hit_rate:.0%} ({speculation_stats.hits} hits, "
+                f"{speculation_stats.misses} misses)"
+            )
+        tab_inspection.code(sql_query, language="sql")
+
+        tab_inspection.markdown("**SQL query result**")
+        try:
+            sql_query_result = sql_to_arrow(sql_query)
+        except SqlExecutionError as e:
+            if sql_generation.source != "cache":
+                stop_on_error(e, tab_inspection, tab_result)
+            # The query of a similar question may not fit this one: it is generated by the LLM
+            tab_inspection.warning(f"The cached SQL query failed, generating it with the LLM: {e}")
+            llm_response = tab_inspection.write_stream(stream_sql_query_generation(clean_question, thinking_mode))
+            sql_generation = SqlGeneration(sql_query=extract_sql_query(llm_response), source="llm")
+            sql_query = sql_generation.sql_query
+            tab_inspection.code(sql_query, language="sql")
+            try:
+                sql_query_result = sql_to_arrow(sql_query)
+            except SqlExecutionError as e:
+                stop_on_error(e, tab_inspection, tab_result)
+        with tab_inspection:
+            display_sql_query_result(
+                sql_query, sql_query_result.num_rows, is_auto_limited(sql_query_result), key="inspection"
+            )
+        if sql_generation.source == "llm":
+            cache_sql_query(clean_question, sql_query)
+
+        num_values = sql_query_result.num_rows * sql_query_result.num_columns
+        if num_values < MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD:
+            response_md, start_time = None, time.perf_counter()
+            if not config.result_summary_llm_enabled:
+                response_md = render_question_response_md(sql_query_result)
+            template_seconds = time.perf_counter() - start_time
+            if response_md is None:
+                tab_result.write_stream(stream_question_response_md(question=clean_question, result=sql_query_result))
+            else:
+                tab_result.markdown(response_md)
+                avg_llm_seconds = get_response_stats().avg_llm_seconds
+                saved_latency = (
+                    f"~{avg_llm_seconds - template_seconds:.2f}s (average LLM summary latency in this process)"
+                    if avg_llm_seconds is not None
+                    else "a LLM summary call"
+                )
+                tab_inspection.caption(
+                    f"Answer rendered from a template in {template_seconds * 1e6:.0f}µs, saving {saved_latency}"
+                )
+            if is_auto_limited(sql_query_result):
+                tab_result.caption(get_auto_limit_caption())
+        else:
+            if config.large_result_summary_enabled:
+                tab_result.write_stream(stream_question_response_md(question=clean_question, result=sql_query_result))
+            with tab_result:
+                display_sql_query_result(
+                    sql_query, sql_query_result.num_rows, is_auto_limited(sql_query_result), key="result"
+                )
+
+    tab_inspection.markdown("**Latency waterfall of the stages of the request**")
+    with tab_inspection:
+        display_trace_waterfall(trace)
+    coalesced_calls = [
+        f"{single_flight.stats.coalesced}/{single_flight.stats.calls} {single_flight.name}"
+        for single_flight in (get_llm_single_flight(), get_sql_single_flight())
+        if single_flight is not None
+    ]
+    if coalesced_calls:
+        tab_inspection.caption(
+            f"Calls coalesced with an identical call in flight, in this process: {', '.join(coalesced_calls)}"
+        )
@@ -1,12 +1,28 @@
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
-from typing import Any, Literal, Optional
+import asyncio
+import functools
+import threading
+import time
+import weakref
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, closing, contextmanager
+from typing import TYPE_CHECKING, Any, Literal, Optional
 
 from loguru import logger
-from openai import OpenAI
+from pydantic import BaseModel, ConfigDict, SecretStr
 
-from app.configuration import config
+from app.configuration import get_config
 from app.constants import DEFAULT_LLM_MAX_RETRIES, DEFAULT_LLM_TEMPERATURE
+from app.llm_cache import LLMResponseCache, make_llm_cache_key
+from app.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, RetryScheduler, TokenBucket
+from app.singleflight import SingleFlight
+from app.tracing import increment_span_attribute, set_span_attributes, span, traced
+
+# The OpenAI SDK (and httpx) take about a second to import, they are only imported once the first client is created
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
 
 
 # -------------------------------------------------------------------------------------------------------------------- #
@@ -18,27 +34,226 @@ class LLMQueryError(Exception):
 
 
 # -------------------------------------------------------------------------------------------------------------------- #
-# Models
-def query_llm(
-    prompt: str,
-    model_kind: Literal["heavy", "light"],
-    structured_output: Optional[Any] = None,
-    temperature: float = DEFAULT_LLM_TEMPERATURE,
-    max_retries: int = DEFAULT_LLM_MAX_RETRIES,
-) -> Any:
+# Clients
+
+
+class LLMEndpoint(BaseModel):
+    """Connection settings of a LLM: the API to reach and the model to use."""
+
+    model_config = ConfigDict(frozen=True)
+
+    base_url: str
+    model: str
+    api_key: SecretStr
+
+
+class LLMClientPoolStats(BaseModel):
+    """Counters describing how well the LLM clients and their HTTP connections are reused."""
+
+    clients_created: int = 0
+    client_reuses: int = 0
+    connections_opened: int = 0
+    requests_sent: int = 0
+
+
+class LLMClientRegistry:
     """
-    Query the LLM with a prompt, using either the light or heavy model.
+    Long-lived OpenAI clients, one per API endpoint.
+
+    Each client owns a pool of keep-alive HTTP connections, so consecutive requests (and Streamlit reruns, as the
+    module stays imported) skip the connection and TLS setup. The number of requests sent at the same time to a given
+    base URL is capped by a semaphore.
+
+    Async clients and semaphores are bound to the event loop they were created in, so they are kept per running loop.
+    The owner of a loop closes its clients with `aclose` before stopping it.
     """
-    # Get configuration based on model kind
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        max_concurrent_requests_per_endpoint: int,
+    ) -> None:
+        import httpx  # noqa: PLC0415
+
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._max_concurrent_requests_per_endpoint = max_concurrent_requests_per_endpoint
+        self._lock = threading.Lock()
+        self._clients: dict[tuple[str, str], "OpenAI"] = {}
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str], "AsyncOpenAI"]]
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]]
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self.stats = LLMClientPoolStats()
+
+    def get_client(self, endpoint: LLMEndpoint) -> "OpenAI":
+        """Retrieve the client of an endpoint, creating it on first use."""
+        from openai import DefaultHttpxClient, OpenAI  # noqa: PLC0415
+
+        key = (endpoint.base_url, endpoint.api_key.get_secret_value())
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.stats.client_reuses += 1
+                return client
+
+            http_client = DefaultHttpxClient(limits=self._limits, event_hooks={"request": [self._trace_request]})
+            # Retries are handled by the retry scheduler of the endpoint, not by the SDK
+            client = OpenAI(base_url=endpoint.base_url, api_key=key[1], http_client=http_client, max_retries=0)
+            self._clients[key] = client
+            self.stats.clients_created += 1
+            logger.debug(f"Created LLM client for {endpoint.base_url}")
+            return client
+
+    def get_async_client(self, endpoint: LLMEndpoint) -> "AsyncOpenAI":
+        """Retrieve the async client of an endpoint for the running event loop, creating it on first use."""
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient  # noqa: PLC0415
+
+        key = (endpoint.base_url, endpoint.api_key.get_secret_value())
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.setdefault(loop, {})
+            client = loop_clients.get(key)
+            if client is not None:
+                self.stats.client_reuses += 1
+                return client
+
+            http_client = DefaultAsyncHttpxClient(limits=self._limits, event_hooks={"request": [self._atrace_request]})
+            client = AsyncOpenAI(base_url=endpoint.base_url, api_key=key[1], http_client=http_client, max_retries=0)
+            loop_clients[key] = client
+            self.stats.clients_created += 1
+            logger.debug(f"Created async LLM client for {endpoint.base_url}")
+            return client
+
+    @contextmanager
+    def concurrency_slot(self, endpoint: LLMEndpoint) -> Iterator[None]:
+        """Wait until the number of in-flight requests to the endpoint is below the configured cap."""
+        with self._lock:
+            semaphore = self._semaphores.setdefault(
+                endpoint.base_url, threading.BoundedSemaphore(self._max_concurrent_requests_per_endpoint)
+            )
+        with semaphore:
+            yield
+
+    @asynccontextmanager
+    async def async_concurrency_slot(self, endpoint: LLMEndpoint) -> AsyncIterator[None]:
+        """Async counterpart of `concurrency_slot`, the cap being shared by the coroutines of the running loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._async_semaphores.setdefault(loop, {}).setdefault(
+                endpoint.base_url, asyncio.Semaphore(self._max_concurrent_requests_per_endpoint)
+            )
+        async with semaphore:
+            yield
+
+    def close(self) -> None:
+        """
+        Close all clients and their HTTP connections. Async clients are closed on their loop if it is still running,
+        those of a loop which stopped must have been closed by its owner with `aclose`.
+        """
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            loops = list(self._async_clients)
+        for loop in loops:
+            if loop.is_running() and not loop.is_closed():
+                closing_future = asyncio.run_coroutine_threadsafe(self._aclose_loop_clients(loop), loop)
+                if loop is not get_running_loop_or_none():  # Waiting from the loop itself would block it
+                    closing_future.result()
+
+    async def aclose(self) -> None:
+        """Close the async clients of the running loop, to be called by the owner of a loop before it stops."""
+        await self._aclose_loop_clients(asyncio.get_running_loop())
+
+    async def _aclose_loop_clients(self, loop: asyncio.AbstractEventLoop) -> None:
+        with self._lock:
+            loop_clients = self._async_clients.pop(loop, {})
+            self._async_semaphores.pop(loop, None)
+        for client in loop_clients.values():
+            await client.close()
+
+    def _trace_request(self, request: "httpx.Request") -> None:
+        """Hook run before each HTTP request, counting requests and the connections opened to serve them."""
+        with self._lock:
+            self.stats.requests_sent += 1
+        request.extensions["trace"] = self._trace_connection
+
+    def _trace_connection(self, event_name: str, _info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.stats.connections_opened += 1
+
+    async def _atrace_request(self, request: "httpx.Request") -> None:
+        with self._lock:
+            self.stats.requests_sent += 1
+        request.extensions["trace"] = self._atrace_connection
+
+    async def _atrace_connection(self, event_name: str, info: dict) -> None:
+        self._trace_connection(event_name, info)
+
+
+def get_running_loop_or_none() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+@functools.cache
+def get_llm_client_registry() -> LLMClientRegistry:
+    """Retrieve the process-wide registry of LLM clients."""
+    config = get_config()
+    return LLMClientRegistry(
+        max_connections=config.llm_pool_max_connections,
+        max_keepalive_connections=config.llm_pool_max_keepalive_connections,
+        keepalive_expiry=config.llm_pool_keepalive_expiry_seconds,
+        max_concurrent_requests_per_endpoint=config.llm_max_concurrent_requests_per_endpoint,
+    )
+
+
+@functools.cache
+def get_llm_retry_scheduler(base_url: str) -> RetryScheduler:
+    """Retrieve the retry scheduler shared by all the queries to a LLM API base URL."""
+    config = get_config()
+    token_bucket = None
+    if config.llm_rate_limit_requests_per_minute is not None:
+        token_bucket = TokenBucket(
+            rate_per_second=config.llm_rate_limit_requests_per_minute / 60, capacity=config.llm_rate_limit_burst
+        )
+    logger.debug(f"Created retry scheduler for {base_url}")
+    return RetryScheduler(
+        policy=RetryPolicy(
+            max_attempts=DEFAULT_LLM_MAX_RETRIES,
+            base_delay_seconds=config.llm_retry_base_delay_seconds,
+            max_delay_seconds=config.llm_retry_max_delay_seconds,
+        ),
+        token_bucket=token_bucket,
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=config.llm_circuit_breaker_failure_threshold,
+            reset_timeout_seconds=config.llm_circuit_breaker_reset_timeout_seconds,
+        ),
+    )
+
+
+def get_llm_endpoint(model_kind: Literal["heavy", "light"]) -> LLMEndpoint:
+    """Get the endpoint configured for a model kind."""
+    config = get_config()
     try:
         if model_kind == "heavy":
-            url = config.heavy_llm_base_url
-            model = config.heavy_llm_model
-            api_key = config.heavy_llm_api_key.get_secret_value()
+            return LLMEndpoint(
+                base_url=config.heavy_llm_base_url, model=config.heavy_llm_model, api_key=config.heavy_llm_api_key
+            )
         elif model_kind == "light":
-            url = config.light_llm_base_url
-            model = config.light_llm_model
-            api_key = config.light_llm_api_key.get_secret_value()
+            return LLMEndpoint(
+                base_url=config.light_llm_base_url, model=config.light_llm_model, api_key=config.light_llm_api_key
+            )
         else:
             error_msg = f"Unknown model kind: {model_kind}"
             raise ValueError(error_msg)  # noqa: TRY301
@@ -48,36 +263,308 @@ def query_llm(
         error_msg = f"Failed to get configuration for {model_kind} model"
         raise LLMQueryError(error_msg) from e
 
-    # Initialize client
-    client = OpenAI(base_url=url, api_key=api_key)
 
-    # Retry logic for transient errors
-    for attempt in range(max_retries):
+@functools.cache
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    """Retrieve the process-wide cache of LLM responses, None if caching is disabled."""
+    config = get_config()
+    if not config.llm_cache_enabled:
+        return None
+    return LLMResponseCache(
+        path=config.llm_cache_path,
+        ttl_seconds=config.llm_cache_ttl_seconds,
+        max_memory_entries=config.llm_cache_max_memory_entries,
+        max_disk_size_bytes=int(config.llm_cache_max_disk_size_mb * 1024 * 1024),
+    )
+
+
+@functools.cache
+def get_llm_single_flight() -> Optional[SingleFlight]:
+    """Retrieve the process-wide group deduplicating identical LLM queries in flight, None if disabled."""
+    if not get_config().single_flight_enabled:
+        return None
+    return SingleFlight(name="LLM queries")
+
+
+def get_llm_cache_key(
+    endpoint: LLMEndpoint,
+    prompt: str,
+    temperature: float,
+    structured_output: Optional[Any],
+    stop_condition: Optional[str] = None,
+) -> Optional[str]:
+    """Get the cache key of a LLM query, None if its response must not be cached."""
+    config = get_config()
+    if get_llm_response_cache() is None or temperature > config.llm_cache_max_temperature:
+        return None
+    return make_llm_cache_key(
+        model=endpoint.model,
+        base_url=endpoint.base_url,
+        prompt=prompt,
+        temperature=temperature,
+        structured_output=structured_output,
+        stop_condition=stop_condition,
+    )
+
+
+def get_cached_llm_response(cache_key: Optional[str], structured_output: Optional[Any] = None) -> Optional[Any]:
+    """Retrieve the cached response of a LLM query, None if it isn't cached or must not be."""
+    if cache_key is None:
+        return None
+    cached_response = get_llm_response_cache().get(cache_key, structured_output)
+    if cached_response is not None:
+        set_span_attributes({"llm.cache_hit": True})
+    return cached_response
+
+
+def cache_llm_response(cache_key: Optional[str], llm_response: Any) -> None:
+    """Cache the response of a LLM query, unless it is empty or must not be cached."""
+    if cache_key is not None and llm_response:
+        get_llm_response_cache().set(cache_key, llm_response)
+
+
+def get_llm_single_flight_key(
+    endpoint: LLMEndpoint, prompt: str, temperature: float, structured_output: Optional[Any]
+) -> str:
+    """Get the key of a LLM query identifying the identical queries in flight, whatever its temperature."""
+    return make_llm_cache_key(
+        model=endpoint.model,
+        base_url=endpoint.base_url,
+        prompt=prompt,
+        temperature=temperature,
+        structured_output=structured_output,
+    )
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+def record_llm_usage(response: Any) -> None:
+    """Record the prompt and completion tokens of a LLM response in the current span, when the API returns them."""
+    if getattr(response, "usage", None) is not None:
+        set_span_attributes(
+            {
+                "llm.prompt_tokens": response.usage.prompt_tokens,
+                "llm.completion_tokens": response.usage.completion_tokens,
+            }
+        )
+
+
+def send_llm_request(
+    client: "OpenAI", model: str, prompt: str, structured_output: Optional[Any], temperature: float
+) -> Any:
+    """Send a single request to the LLM, returning the parsed structured output or the text response."""
+    if structured_output is not None:
+        # Structured output request
+        response = client.beta.chat.completions.parse(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            response_format=structured_output,
+        )
+        record_llm_usage(response)
+        return response.choices[0].message.parsed
+
+    # Regular text request
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+    )
+    record_llm_usage(response)
+    return response.choices[0].message.content
+
+
+def stream_llm_request(client: "OpenAI", model: str, prompt: str, temperature: float) -> Iterator[str]:
+    """Send a single streaming request to the LLM, yielding the tokens of the text response."""
+    with client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        stream=True,
+    ) as stream:
+        for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                yield token
+
+
+async def asend_llm_request(
+    client: "AsyncOpenAI", model: str, prompt: str, structured_output: Optional[Any], temperature: float
+) -> Any:
+    """Async version of `send_llm_request`."""
+    if structured_output is not None:
+        # Structured output request
+        response = await client.beta.chat.completions.parse(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            response_format=structured_output,
+        )
+        record_llm_usage(response)
+        return response.choices[0].message.parsed
+
+    # Regular text request
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+    )
+    record_llm_usage(response)
+    return response.choices[0].message.content
+
+
+@traced("llm.query")
+def query_llm(
+    prompt: str,
+    model_kind: Literal["heavy", "light"],
+    structured_output: Optional[Any] = None,
+    temperature: float = DEFAULT_LLM_TEMPERATURE,
+    max_retries: int = DEFAULT_LLM_MAX_RETRIES,
+) -> Any:
+    """
+    Query the LLM with a prompt, using either the light or heavy model.
+
+    Transient errors are retried by the retry scheduler of the LLM API, with backoff and rate limiting.
+    """
+    endpoint = get_llm_endpoint(model_kind)
+    set_span_attributes({"llm.model_kind": model_kind, "llm.model": endpoint.model, "llm.cache_hit": False})
+    cache_key = get_llm_cache_key(endpoint, prompt, temperature, structured_output)
+    cached_response = get_cached_llm_response(cache_key, structured_output)
+    if cached_response is not None:
+        return cached_response
+
+    registry = get_llm_client_registry()
+    client = registry.get_client(endpoint)
+
+    def send_request() -> Any:
+        increment_span_attribute("llm.attempts")  # Retries are the attempts after the first one
+        with registry.concurrency_slot(endpoint):
+            return send_llm_request(client, endpoint.model, prompt, structured_output, temperature)
+
+    def run_query() -> Any:
         try:
-            if structured_output is not None:
-                # Structured output request
-                response = client.beta.chat.completions.parse(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=temperature,
-                    response_format=structured_output,
-                )
-                return response.choices[0].message.parsed
+            llm_response = get_llm_retry_scheduler(endpoint.base_url).call(send_request, max_attempts=max_retries)
+        except Exception as e:
+            logger.error(f"LLM query failed for {model_kind} model: {str(e)}")
+            error_msg = f"Failed to query {model_kind} LLM"
+            raise LLMQueryError(error_msg) from e
+
+        cache_llm_response(cache_key, llm_response)
+        return llm_response
+
+    single_flight = get_llm_single_flight()
+    if single_flight is None:
+        return run_query()
+    return single_flight.call(get_llm_single_flight_key(endpoint, prompt, temperature, structured_output), run_query)
+
+
+def stream_query_llm(
+    prompt: str,
+    model_kind: Literal["heavy", "light"],
+    temperature: float = DEFAULT_LLM_TEMPERATURE,
+    max_retries: int = DEFAULT_LLM_MAX_RETRIES,
+    is_complete: Optional[Callable[[str], bool]] = None,
+) -> Iterator[str]:
+    """
+    Streaming version of `query_llm` for text responses, yielding the tokens as soon as they are generated.
+
+    An attempt is retried only if it failed before yielding any token. The stream stops as soon as `is_complete` holds
+    for the tokens received so far, the rest of the response not being generated. The response is cached once the
+    stream is exhausted, separately from the full responses if it was streamed until `is_complete`: closing the
+    generator early also closes the HTTP stream without caching a partial response.
+    """
+    endpoint = get_llm_endpoint(model_kind)
+    with span("llm.stream", {"llm.model_kind": model_kind, "llm.model": endpoint.model, "llm.cache_hit": False}):
+        # A response stopped by `is_complete` may be cut short: it must not be served to `query_llm`
+        stop_condition = is_complete.__qualname__ if is_complete is not None else None
+        cache_key = get_llm_cache_key(endpoint, prompt, temperature, None, stop_condition=stop_condition)
+        cached_response = get_cached_llm_response(cache_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        registry = get_llm_client_registry()
+        client = registry.get_client(endpoint)
+        scheduler = get_llm_retry_scheduler(endpoint.base_url)
+        error_msg = f"Failed to stream {model_kind} LLM response"
+
+        llm_response = ""
+        for attempt in range(max_retries):
+            set_span_attributes({"llm.attempts": attempt + 1})
+            try:
+                time.sleep(scheduler.acquire_attempt(attempt))
+            except CircuitOpenError as e:
+                raise LLMQueryError(error_msg) from e
+
+            try:
+                with (
+                    registry.concurrency_slot(endpoint),
+                    closing(stream_llm_request(client, endpoint.model, prompt, temperature)) as tokens,
+                ):
+                    for token in tokens:
+                        llm_response += token
+                        yield token
+                        if is_complete is not None and is_complete(llm_response):
+                            break
+
+            except Exception as e:
+                delay = scheduler.record_failure(e, attempt, max_retries)
+                if llm_response or delay is None:  # Tokens already yielded can't be taken back
+                    logger.error(f"LLM streaming failed for {model_kind} model: {str(e)}")
+                    raise LLMQueryError(error_msg) from e
+                time.sleep(delay)
+
+            except BaseException:  # E.g. the generator is closed before the end of the response
+                scheduler.release_attempt()
+                raise
+
             else:
-                # Regular text request
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=temperature,
-                )
-                return response.choices[0].message.content
+                scheduler.record_success()
+                cache_llm_response(cache_key, llm_response)
+                return
 
+
+@traced("llm.query")
+async def aquery_llm(
+    prompt: str,
+    model_kind: Literal["heavy", "light"],
+    structured_output: Optional[Any] = None,
+    temperature: float = DEFAULT_LLM_TEMPERATURE,
+    max_retries: int = DEFAULT_LLM_MAX_RETRIES,
+) -> Any:
+    """
+    Async version of `query_llm`, the event loop being free to run other work while waiting for the LLM.
+    """
+    endpoint = get_llm_endpoint(model_kind)
+    set_span_attributes({"llm.model_kind": model_kind, "llm.model": endpoint.model, "llm.cache_hit": False})
+    cache_key = get_llm_cache_key(endpoint, prompt, temperature, structured_output)
+    cached_response = get_cached_llm_response(cache_key, structured_output)
+    if cached_response is not None:
+        return cached_response
+
+    registry = get_llm_client_registry()
+    client = registry.get_async_client(endpoint)
+
+    async def send_request() -> Any:
+        increment_span_attribute("llm.attempts")  # Retries are the attempts after the first one
+        async with registry.async_concurrency_slot(endpoint):
+            return await asend_llm_request(client, endpoint.model, prompt, structured_output, temperature)
+
+    async def run_query() -> Any:
+        try:
+            llm_response = await get_llm_retry_scheduler(endpoint.base_url).acall(
+                send_request, max_attempts=max_retries
+            )
         except Exception as e:
-            logger.warning(f"LLM query attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-            if attempt == max_retries - 1:
-                logger.error(f"All {max_retries} LLM query attempts failed for {model_kind} model")
-                error_msg = f"Failed to query {model_kind} LLM after {max_retries} attempts"
-                raise LLMQueryError(error_msg) from e
+            logger.error(f"LLM query failed for {model_kind} model: {str(e)}")
+            error_msg = f"Failed to query {model_kind} LLM"
+            raise LLMQueryError(error_msg) from e
+
+        cache_llm_response(cache_key, llm_response)
+        return llm_response
 
-    # This should never be reached due to the exception in the last retry attempt
-    return None
+    single_flight = get_llm_single_flight()
+    if single_flight is None:
+        return await run_query()
+    single_flight_key = get_llm_single_flight_key(endpoint, prompt, temperature, structured_output)
+    return await single_flight.acall(single_flight_key, run_query)
@@ -0,0 +1,186 @@
+"""Two-tier cache of LLM responses: an in-memory LRU in front of a persistent SQLite file."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class LLMCacheStats(BaseModel):
+    """Hit and miss counters of the LLM response cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def make_llm_cache_key(
+    model: str,
+    base_url: str,
+    prompt: str,
+    temperature: float,
+    structured_output: Optional[type[BaseModel]],
+    stop_condition: Optional[str] = None,
+) -> str:
+    """
+    Build the cache key of a LLM query. The structured output is identified by its JSON schema. A response streamed
+    until a stop condition, hence possibly cut short, is only served to the queries with the same condition.
+    """
+    schema = structured_output.model_json_schema() if structured_output is not None else None
+    key_content = {
+        "model": model,
+        "base_url": base_url,
+        "prompt_hash": hashlib.sha256(prompt.encode()).hexdigest(),
+        "temperature": temperature,
+        "schema": schema,
+    }
+    if stop_condition is not None:
+        key_content["stop_condition"] = stop_condition
+    return hashlib.sha256(json.dumps(key_content, sort_keys=True).encode()).hexdigest()
+
+
+def serialize_llm_response(response: Any) -> str:
+    """Serialize a LLM response, either a text or a structured output, to JSON."""
+    if isinstance(response, BaseModel):
+        return json.dumps({"kind": "structured", "value": response.model_dump(mode="json")})
+    return json.dumps({"kind": "text", "value": response})
+
+
+def deserialize_llm_response(serialized_response: str, structured_output: Optional[type[BaseModel]]) -> Any:
+    """Deserialize a LLM response serialized with `serialize_llm_response`."""
+    content = json.loads(serialized_response)
+    if content["kind"] == "structured":
+        return structured_output.model_validate(content["value"])
+    return content["value"]
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Cache
+
+
+class LLMResponseCache:
+    """
+    Cache of LLM responses with a TTL.
+
+    Entries are kept in an in-memory LRU of bounded length, and persisted in a SQLite file so they survive restarts.
+    When the file grows above its size limit, the least recently used entries are deleted.
+    """
+
+    def __init__(
+        self, path: Optional[Path], ttl_seconds: float, max_memory_entries: int, max_disk_size_bytes: int
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_size_bytes = max_disk_size_bytes
+        self.stats = LLMCacheStats()
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()  # key -> (created_at, value)
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "create table if not exists llm_response ("
+                "key text primary key, value text not null, created_at real not null, last_access real not null)"
+            )
+            self._db.execute("create index if not exists llm_response_last_access on llm_response(last_access)")
+            self._db.commit()
+
+    def get(self, key: str, structured_output: Optional[type[BaseModel]] = None) -> Optional[Any]:
+        """Retrieve a response from the cache, None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return deserialize_llm_response(entry[1], structured_output)
+            self._memory.pop(key, None)
+
+            if self._db is not None:
+                row = self._db.execute("select value, created_at from llm_response where key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    self._db.execute("update llm_response set last_access = ? where key = ?", (now, key))
+                    self._db.commit()
+                    self._set_in_memory(key, row[1], row[0])
+                    self.stats.disk_hits += 1
+                    return deserialize_llm_response(row[0], structured_output)
+                if row is not None:
+                    self._db.execute("delete from llm_response where key = ?", (key,))
+                    self._db.commit()
+
+            self.stats.misses += 1
+            return None
+
+    def set(self, key: str, response: Any) -> None:
+        """Store a response in the cache."""
+        now = time.time()
+        value = serialize_llm_response(response)
+        with self._lock:
+            self._set_in_memory(key, now, value)
+            if self._db is not None:
+                self._db.execute("insert or replace into llm_response values (?, ?, ?, ?)", (key, value, now, now))
+                self._evict_from_disk(now)
+                self._db.commit()
+
+    def clear(self) -> None:
+        """Remove all the entries of the cache."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("delete from llm_response")
+                self._db.commit()
+
+    def _set_in_memory(self, key: str, created_at: float, value: str) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _evict_from_disk(self, now: float) -> None:
+        """Delete expired entries, then the least recently used ones until the size limit is respected."""
+        self._db.execute("delete from llm_response where created_at < ?", (now - self.ttl_seconds,))
+        disk_size = self._db.execute(
+            "select coalesce(sum(length(key) + length(value)), 0) from llm_response"
+        ).fetchone()
+        excess_size = disk_size[0] - self.max_disk_size_bytes
+        if excess_size <= 0:
+            return
+
+        rows = self._db.execute(
+            "select key, length(key) + length(value) from llm_response order by last_access"
+        ).fetchall()
+        evicted_keys = []
+        for key, size in rows:
+            if excess_size <= 0:
+                break
+            evicted_keys.append((key,))
+            excess_size -= size
+        self._db.executemany("delete from llm_response where key = ?", evicted_keys)
+        self.stats.evictions += len(evicted_keys)
+        logger.debug(f"Evicted {len(evicted_keys)} LLM responses from the disk cache")
@@ -0,0 +1,167 @@
+"""Index of entity names (e.g. players or teams) to find the closest names to mentions quickly."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import difflib
+import heapq
+
+import numpy as np
+from pydantic import BaseModel
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+NGRAM_SIZE = 3
+MAX_CANDIDATES = 50
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class EntityMatch(BaseModel):
+    """A name matching a mention, with its similarity score between 0 and 1."""
+
+    name: str
+    score: float
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name for a case insensitive comparison."""
+    return name.lower()
+
+
+def get_ngrams(text: str, ngram_size: int = NGRAM_SIZE) -> set[str]:
+    """Get the character n-grams of a text, padded with spaces so that the start and end of words count."""
+    padded_text = f" {text} "
+    return {padded_text[i : i + ngram_size] for i in range(len(padded_text) - ngram_size + 1)}
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Index
+
+
+class EntityIndex:
+    """
+    Index of entity names, built once, to find the closest names to mentions.
+
+    Names are encoded as a sparse matrix of character n-grams, stored as an inverted index in CSR format. The n-gram
+    similarity (Dice coefficient) between a batch of mentions and the names is computed in a single vectorized
+    operation, over the postings of the n-grams of the mentions only: its cost depends on the number of names sharing
+    n-grams with the mentions, not on the size of the index. Only the short list of the most similar names is then
+    rescored with `difflib`, in the same way as `difflib.get_close_matches`. Hence the result is the one of a full
+    `difflib` scan, as long as the best match is among the candidates sharing the most n-grams.
+    """
+
+    def __init__(self, names: list[str], max_candidates: int = MAX_CANDIDATES) -> None:
+        self.max_candidates = max_candidates
+
+        # Case insensitive search: a normalized name is mapped back to the last original name matching it
+        self.normalized_to_original_name = {normalize_name(name): name for name in names}
+        self.normalized_names = list(self.normalized_to_original_name)
+
+        self.ngram_to_id: dict[str, int] = {}
+        names_ngrams_ids = [
+            [self.ngram_to_id.setdefault(ngram, len(self.ngram_to_id)) for ngram in get_ngrams(normalized_name)]
+            for normalized_name in self.normalized_names
+        ]
+        self.names_num_ngrams = np.array([len(ngrams_ids) for ngrams_ids in names_ngrams_ids], dtype=np.int32)
+
+        # Inverted index in CSR format: names containing the n-gram i are postings_names_ids[indptr[i]:indptr[i + 1]]
+        ngrams_ids = np.fromiter((i for ids in names_ngrams_ids for i in ids), dtype=np.int64)
+        names_ids = np.repeat(np.arange(len(self.normalized_names), dtype=np.int64), self.names_num_ngrams)
+        self.postings_names_ids = names_ids[np.argsort(ngrams_ids, kind="stable")]
+        self.postings_indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(ngrams_ids, minlength=len(self.ngram_to_id))))
+        )
+
+    def __len__(self) -> int:
+        return len(self.normalized_names)
+
+    def score_ngrams(self, normalized_mentions: list[str]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Compute the n-gram Dice coefficients between mentions and the names sharing n-grams with them: for each mention,
+        the ids of those names and their scores.
+        """
+        num_mentions, num_names = len(normalized_mentions), len(self.normalized_names)
+        mentions_ngrams = [get_ngrams(mention) for mention in normalized_mentions]
+        mentions_num_ngrams = np.array([len(ngrams) for ngrams in mentions_ngrams])
+        mentions_known_ngrams_ids = [
+            [self.ngram_to_id[ngram] for ngram in ngrams if ngram in self.ngram_to_id] for ngrams in mentions_ngrams
+        ]
+
+        # Concatenate the postings of all the n-grams of all the mentions
+        ngrams_ids = np.fromiter((i for ids in mentions_known_ngrams_ids for i in ids), dtype=np.int64)
+        ngrams_mentions_ids = np.repeat(np.arange(num_mentions), [len(ids) for ids in mentions_known_ngrams_ids])
+        postings_starts = self.postings_indptr[ngrams_ids]
+        postings_lengths = self.postings_indptr[ngrams_ids + 1] - postings_starts
+        postings_offsets = np.repeat(postings_starts - np.cumsum(postings_lengths) + postings_lengths, postings_lengths)
+        names_ids = self.postings_names_ids[postings_offsets + np.arange(postings_lengths.sum())]
+        mentions_ids = np.repeat(ngrams_mentions_ids, postings_lengths)
+
+        # Count the n-grams shared by each (mention, name) pair found in the postings, sorted by mention
+        pairs, shared_ngrams_counts = np.unique(mentions_ids * num_names + names_ids, return_counts=True)
+        pairs_mentions_ids, pairs_names_ids = np.divmod(pairs, max(1, num_names))
+        scores = (
+            2
+            * shared_ngrams_counts
+            / (mentions_num_ngrams[pairs_mentions_ids] + self.names_num_ngrams[pairs_names_ids])
+        )
+        bounds = np.searchsorted(pairs_mentions_ids, np.arange(num_mentions + 1))
+        return [
+            (pairs_names_ids[start:end], scores[start:end]) for start, end in zip(bounds[:-1], bounds[1:], strict=True)
+        ]
+
+    def get_candidates_ids(self, names_ids: np.ndarray, ngrams_scores: np.ndarray) -> np.ndarray:
+        """
+        Get the ids of the names the most similar to a mention, from its n-gram scores with the names sharing n-grams.
+
+        Names tied with the last candidate are kept. All the names are returned if none shares any n-gram.
+        """
+        if len(self.normalized_names) <= self.max_candidates or not len(names_ids):
+            return np.arange(len(self.normalized_names))
+        if len(names_ids) <= self.max_candidates:
+            return names_ids
+        min_score = np.partition(ngrams_scores, -self.max_candidates)[-self.max_candidates]
+        return names_ids[ngrams_scores >= min_score]
+
+    def get_candidates(self, normalized_mention: str) -> list[str]:
+        """Get the normalized names the most similar to a mention, by Dice coefficient over their n-grams."""
+        candidates_ids = self.get_candidates_ids(*self.score_ngrams([normalized_mention])[0])
+        return [self.normalized_names[name_id] for name_id in candidates_ids]
+
+    def match_batch(self, mentions: list[str], k: int = 1) -> list[list[EntityMatch]]:
+        """
+        Find the `k` closest names to each mention, sorted by decreasing `difflib` similarity.
+
+        All the mentions are scored against the index at once. Several close scores show an ambiguous mention.
+        """
+        normalized_mentions = [normalize_name(mention) for mention in mentions]
+        return [
+            self.rescore(normalized_mention, self.get_candidates_ids(names_ids, ngrams_scores), k)
+            for normalized_mention, (names_ids, ngrams_scores) in zip(
+                normalized_mentions, self.score_ngrams(normalized_mentions), strict=True
+            )
+        ]
+
+    def rescore(self, normalized_mention: str, candidates_ids: np.ndarray, k: int) -> list[EntityMatch]:
+        """Rescore candidate names with the same scoring and tie-breaking as `difflib.get_close_matches(cutoff=0)`."""
+        sequence_matcher = difflib.SequenceMatcher()
+        sequence_matcher.set_seq2(normalized_mention)
+        scored_candidates = []
+        for name_id in candidates_ids:
+            sequence_matcher.set_seq1(self.normalized_names[name_id])
+            scored_candidates.append((sequence_matcher.ratio(), self.normalized_names[name_id]))
+
+        return [
+            EntityMatch(name=self.normalized_to_original_name[normalized_name], score=score)
+            for score, normalized_name in heapq.nlargest(k, scored_candidates)
+        ]
+
+    def find_closest(self, mention: str) -> str:
+        """Find the closest name to a mention."""
+        return self.match_batch([mention], k=1)[0][0].name
@@ -0,0 +1,254 @@
+"""Gazetteer of the players and teams names, to find them in a text without querying a LLM."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import re
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from typing import Literal
+
+from pydantic import BaseModel
+
+from app.logic.entity_index import EntityIndex
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+MIN_ALIAS_LENGTH = 4
+MIN_UNRESOLVED_WORD_SIMILARITY = 0.8
+NAME_SUFFIXES = {"jr", "jr.", "sr", "sr.", "ii", "iii", "iv"}
+
+# Normalized nicknames of teams made of several words, the other nicknames being the last word of the team name
+MULTI_WORD_TEAM_NICKNAMES = {"trail blazers"}
+
+# Words of the questions which are never names: they can't be aliases and don't make a question ambiguous
+COMMON_WORDS = {
+    *("a", "about", "above", "after", "against", "all", "an", "and", "any", "are", "as", "at", "average", "be"),
+    *("before", "best", "between", "both", "by", "can", "could", "did", "do", "does", "during", "each", "ever"),
+    *("every", "for", "from", "give", "had", "has", "have", "he", "her", "his", "how", "i", "in", "is", "it", "its"),
+    *("last", "least", "list", "many", "me", "most", "much", "my", "not", "of", "on", "or", "our", "per", "played"),
+    *("show", "since", "than", "that", "the", "their", "them", "they", "this", "those", "to", "top", "under", "was"),
+    *("we", "were", "what", "when", "where", "which", "while", "who", "whom", "whose", "why", "with", "without"),
+    *("won", "would", "you", "your", "first", "second", "third", "total", "number", "highest", "lowest", "more"),
+    *("less", "fewer", "home", "away", "win", "wins", "loss", "losses", "lost", "record", "score", "scored"),
+    *("scoring", "point", "points", "rebound", "rebounds", "assist", "assists", "steal", "steals", "block"),
+    *("blocks", "minute", "minutes", "three", "threes", "pointers", "shot", "shots", "attempt", "attempts"),
+    *("game", "games", "match", "matches", "season", "seasons", "regular", "playoff", "playoffs", "final", "finals"),
+    *("career", "year", "years", "team", "teams", "player", "players", "nba", "mvp", "league", "versus", "vs"),
+    *("compare", "compared", "ratio", "percentage", "mean", "max", "min", "sum", "count", "rank"),
+    *("big", "early", "late", "better", "worse", "only", "same", "other", "also", "just", "into"),
+}
+# Surnames which are also common words: they can't be aliases, but make a question ambiguous when capitalized (e.g.
+# "Rose" for Derrick Rose), in which case the question goes through the LLM NER
+NAME_LIKE_COMMON_WORDS = {
+    *("love", "green", "brown", "rose", "white", "black", "young", "king", "price", "miller", "little", "hill"),
+    *("wall", "long"),
+}
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:['.-][^\W\d_]+)*")
+SENTENCE_END_PATTERN = re.compile(r"[.?!]\s*$")
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class NameSpan(BaseModel):
+    """A span of a text, from `start` to `end` excluded, referring to a player or a team of the database."""
+
+    start: int
+    end: int
+    kind: Literal["player", "team"]
+    name: str
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase a text, keeping the characters whose lowercase is longer so that the offsets are preserved."""
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def is_word_boundary(text: str, index: int) -> bool:
+    """Check if there is a word boundary before the character at `index`."""
+    return index <= 0 or index >= len(text) or not (text[index - 1].isalnum() and text[index].isalnum())
+
+
+def is_sentence_start(text: str, index: int) -> bool:
+    """Check if the word starting at `index` is the first one of a sentence."""
+    return not text[:index].strip() or SENTENCE_END_PATTERN.search(text[:index]) is not None
+
+
+def select_non_overlapping_spans(spans: list[NameSpan]) -> list[NameSpan]:
+    """Keep the leftmost, then longest, spans which don't overlap. Spans given first win ties."""
+    selected_spans: list[NameSpan] = []
+    for span in sorted(spans, key=lambda s: (s.start, s.start - s.end)):
+        if not selected_spans or span.start >= selected_spans[-1].end:
+            selected_spans.append(span)
+    return selected_spans
+
+
+def rewrite_spans(text: str, spans: list[NameSpan]) -> str:
+    """Replace non-overlapping spans of a text with their names, in a single pass."""
+    parts = []
+    position = 0
+    for span in sorted(spans, key=lambda s: s.start):
+        parts.extend((text[position : span.start], span.name))
+        position = span.end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def get_aliases(name: str, kind: Literal["player", "team"]) -> set[str]:
+    """
+    Get the normalized aliases of a name, including the name itself.
+
+    Teams are also called by their nickname (e.g. "Lakers", "Trail Blazers") or their city (e.g. "Boston"). Players
+    are also called by their surname (e.g. "Pierce").
+    """
+    words = normalize_text(name).split()
+    aliases = {" ".join(words)}
+    if kind == "team":
+        aliases.update(" ".join(words[i:]) for i in range(1, len(words)))
+        nickname_start = next(
+            (i for i in range(len(words)) if " ".join(words[i:]) in MULTI_WORD_TEAM_NICKNAMES), len(words) - 1
+        )
+        aliases.add(" ".join(words[:nickname_start]))  # City
+    else:
+        surnames = [word for word in words[1:] if word not in NAME_SUFFIXES]
+        if surnames:
+            aliases.add(surnames[-1])
+    return {
+        alias
+        for alias in aliases
+        if len(alias) >= MIN_ALIAS_LENGTH and alias not in COMMON_WORDS and alias not in NAME_LIKE_COMMON_WORDS
+    }
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Automaton
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton, finding all the occurrences of a set of patterns in a text in a single pass."""
+
+    def __init__(self, patterns: list[str]) -> None:
+        self.patterns_lengths = [len(pattern) for pattern in patterns]
+        self.transitions: list[dict[str, int]] = [{}]
+        self.fail_links = [0]
+        self.outputs: list[list[int]] = [[]]
+
+        for pattern_id, pattern in enumerate(patterns):
+            node = 0
+            for char in pattern:
+                if char not in self.transitions[node]:
+                    self.transitions[node][char] = len(self.transitions)
+                    self.transitions.append({})
+                    self.fail_links.append(0)
+                    self.outputs.append([])
+                node = self.transitions[node][char]
+            self.outputs[node].append(pattern_id)
+
+        # Breadth first, so that the fail link of a node is set before the ones of its children
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                queue.append(child)
+                fail_link = self.fail_links[node]
+                while fail_link and char not in self.transitions[fail_link]:
+                    fail_link = self.fail_links[fail_link]
+                self.fail_links[child] = self.transitions[fail_link].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail_links[child]]
+
+    def find_all(self, text: str) -> Iterator[tuple[int, int, int]]:
+        """Find all the occurrences of the patterns in a text, as (start, end, pattern id), overlapping ones too."""
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self.transitions[node]:
+                node = self.fail_links[node]
+            node = self.transitions[node].get(char, 0)
+            for pattern_id in self.outputs[node]:
+                yield i + 1 - self.patterns_lengths[pattern_id], i + 1, pattern_id
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Gazetteer
+
+
+class Gazetteer:
+    """
+    Find the players and teams names of the database in a text, along with their unambiguous aliases.
+
+    An alias shared by several names (e.g. "Los Angeles" or "Nets") is dropped, as are surnames which are also first
+    names. The words of a text not covered by a name but looking like one are reported as unresolved, in which case
+    the text must go through the LLM NER.
+    """
+
+    def __init__(self, players_names: list[str], teams_names: list[str]) -> None:
+        alias_to_entities: dict[str, set[tuple[str, str]]] = defaultdict(set)
+        for kind, names in (("player", players_names), ("team", teams_names)):
+            for name in names:
+                for alias in get_aliases(name, kind):
+                    alias_to_entities[alias].add((kind, name))
+
+        # A surname must not be the first name of another player, e.g. "James" for LeBron James and James Harden
+        first_names = {normalize_text(name).split()[0] for name in players_names}
+        self.alias_to_entity: dict[str, tuple[str, str]] = {}
+        for alias, entities in alias_to_entities.items():
+            kind, name = next(iter(entities))
+            if len(entities) == 1 and (alias not in first_names or alias == normalize_text(name)):
+                self.alias_to_entity[alias] = (kind, name)
+
+        self.aliases = list(self.alias_to_entity)
+        self.automaton = AhoCorasick(self.aliases)
+        self.names_words = {
+            word for names in (players_names, teams_names) for n in names for word in normalize_text(n).split()
+        }
+        self.names_words_index = EntityIndex(sorted(self.names_words - COMMON_WORDS - NAME_LIKE_COMMON_WORDS))
+
+    def find_spans(self, text: str) -> list[NameSpan]:
+        """Find the names of the gazetteer in a text, keeping the longest match when several overlap."""
+        normalized_text = normalize_text(text)
+        spans = []
+        for start, end, alias_id in self.automaton.find_all(normalized_text):
+            if is_word_boundary(normalized_text, start) and is_word_boundary(normalized_text, end):
+                kind, name = self.alias_to_entity[self.aliases[alias_id]]
+                spans.append(NameSpan(start=start, end=end, kind=kind, name=name))
+        return select_non_overlapping_spans(spans)
+
+    def find_unresolved_words(self, text: str, spans: list[NameSpan]) -> list[str]:
+        """
+        Find the words of a text, outside of the given spans, which may be names unknown to the gazetteer.
+
+        These are capitalized words in the middle of a sentence, words close to a word of a name (e.g. a typo), and
+        capitalized common words which are words of a name, anywhere (e.g. "Rose").
+        """
+        unresolved_words = []
+        candidate_words = []
+        for match in WORD_PATTERN.finditer(text):
+            word = match.group()
+            normalized_word = normalize_text(word)
+            if any(s.start < match.end() and match.start() < s.end for s in spans):
+                continue
+            if normalized_word in NAME_LIKE_COMMON_WORDS:
+                if word[0].isupper() and normalized_word in self.names_words:
+                    unresolved_words.append(word)
+                continue
+            if normalized_word in COMMON_WORDS:
+                continue
+            if word[0].isupper() and not is_sentence_start(text, match.start()):
+                unresolved_words.append(word)
+            else:
+                candidate_words.append(word)
+
+        if candidate_words and len(self.names_words_index):
+            words_matches = self.names_words_index.match_batch(candidate_words)
+            unresolved_words.extend(
+                word
+                for word, word_matches in zip(candidate_words, words_matches, strict=True)
+                if word_matches[0].score >= MIN_UNRESOLVED_WORD_SIMILARITY
+            )
+        return unresolved_words
@@ -0,0 +1,147 @@
+"""
+Routing of the SQL generation between the light and heavy LLMs, from the complexity of the question.
+
+The complexity is estimated from local features only (no LLM call): the tables the question refers to, the players and
+teams it names, and its temporal and aggregation keywords. Simple questions, e.g. a single-table lookup, go to the
+light LLM, complex ones to the heavy LLM.
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import functools
+import re
+from typing import Literal, Optional
+
+from pydantic import BaseModel, computed_field
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+# Keywords making a question harder to translate to SQL: time windows (filters, e.g. on seasons, dates or careers)
+TEMPORAL_KEYWORDS = {
+    "season", "seasons", "year", "years", "calendar", "month", "months", "date", "dates", "during", "between",
+    "before", "after", "since", "rookie", "career", "first", "last", "consecutive", "streak",
+}  # fmt: skip
+# Aggregations, a single one being simple (e.g. a max), several ones nested or combined being complex
+AGGREGATION_KEYWORDS = {
+    "average", "avg", "mean", "total", "sum", "cumulated", "count", "many", "number", "most", "highest", "lowest",
+    "maximum", "minimum", "max", "min", "top",
+}  # fmt: skip
+# Groupings and derived statistics, computed with window functions, several group by or self joins
+DERIVED_KEYWORDS = {
+    "per", "each", "every", "difference", "ratio", "compared", "both", "triple", "double", "rank", "ranking",
+}  # fmt: skip
+
+YEAR_PATTERN = re.compile(r"^(19|20)\d\d$")
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class RoutingFeatures(BaseModel):
+    """Local features of a question, estimating how complex its SQL query is."""
+
+    num_tables: int  # Tables the question refers to, directly or through the players and teams it names
+    num_entities: int  # Players and teams named
+    # Distinct keywords of each kind
+    num_temporal_keywords: int  # Including years, e.g. "2022"
+    num_aggregation_keywords: int
+    num_derived_keywords: int
+
+    @computed_field
+    def complexity(self) -> int:
+        """
+        Complexity score, 0 for a lookup with a single aggregation. A question usually matches a table more than its
+        query needs (e.g. `player` for a `player_id`), and needs two aggregation words for a single aggregation (e.g.
+        "highest number"), so the first ones are free.
+        """
+        return (
+            max(0, self.num_tables - 2)
+            + 2 * self.num_entities
+            + self.num_temporal_keywords
+            + max(0, self.num_aggregation_keywords - 2)
+            + self.num_derived_keywords
+        )
+
+
+class RoutingDecision(BaseModel):
+    model_kind: Literal["light", "heavy"]
+    features: RoutingFeatures
+
+
+class RoutingStats(BaseModel):
+    """Counters of the routing decisions, with the latency of the SQL generations of each model."""
+
+    routed_light: int = 0
+    routed_heavy: int = 0
+    escalations: int = 0  # Light generations which failed or were invalid, generated again by the heavy LLM
+    light_generations: int = 0
+    light_seconds: float = 0.0  # Latency of the valid light generations, including their validation
+    escalation_seconds: float = 0.0  # Latency lost on the light generations escalated
+    heavy_generations: int = 0
+    heavy_seconds: float = 0.0
+
+    @property
+    def avg_heavy_seconds(self) -> Optional[float]:
+        return self.heavy_seconds / self.heavy_generations if self.heavy_generations else None
+
+    @property
+    def saved_seconds(self) -> Optional[float]:
+        """
+        Latency saved by the light generations, compared to the average heavy generation, minus the latency lost on
+        escalations. None until a heavy generation was measured.
+        """
+        if self.avg_heavy_seconds is None:
+            return None
+        return self.light_generations * self.avg_heavy_seconds - self.light_seconds - self.escalation_seconds
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+@functools.cache
+def get_routing_stats() -> RoutingStats:
+    """Retrieve the process-wide counters of the routing."""
+    return RoutingStats()
+
+
+def record_routing_decision(routing_decision: RoutingDecision) -> None:
+    routing_stats = get_routing_stats()
+    if routing_decision.model_kind == "light":
+        routing_stats.routed_light += 1
+    else:
+        routing_stats.routed_heavy += 1
+
+
+def record_sql_generation(outcome: Literal["light", "escalation", "heavy"], seconds: float) -> None:
+    """Record the latency of a SQL generation by the light LLM (valid or escalated), or by the heavy LLM."""
+    routing_stats = get_routing_stats()
+    if outcome == "light":
+        routing_stats.light_generations += 1
+        routing_stats.light_seconds += seconds
+    elif outcome == "escalation":
+        routing_stats.escalations += 1
+        routing_stats.escalation_seconds += seconds
+    else:
+        routing_stats.heavy_generations += 1
+        routing_stats.heavy_seconds += seconds
+
+
+def extract_routing_features(question: str, num_tables: int, num_entities: int) -> RoutingFeatures:
+    """Extract the features of a question, given the number of tables and of players and teams it refers to."""
+    words = set(re.findall(r"[a-z0-9]+", question.lower()))
+    return RoutingFeatures(
+        num_tables=num_tables,
+        num_entities=num_entities,
+        num_temporal_keywords=sum(word in TEMPORAL_KEYWORDS or bool(YEAR_PATTERN.match(word)) for word in words),
+        num_aggregation_keywords=len(words & AGGREGATION_KEYWORDS),
+        num_derived_keywords=len(words & DERIVED_KEYWORDS),
+    )
+
+
+def route_question(routing_features: RoutingFeatures, max_light_complexity: int) -> RoutingDecision:
+    """Route a question to the light LLM if its complexity is at most `max_light_complexity`, else the heavy one."""
+    model_kind = "light" if routing_features.complexity <= max_light_complexity else "heavy"
+    return RoutingDecision(model_kind=model_kind, features=routing_features)
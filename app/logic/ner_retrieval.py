@@ -2,13 +2,22 @@
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
-import difflib
+import asyncio
+import functools
+import re
+from typing import Optional
 
+from loguru import logger
 from pydantic import BaseModel
 
+from app.configuration import get_config
+from app.db.connection import get_db_fingerprint
 from app.db.dao import get_players_names, get_teams_names
-from app.llm import query_llm
+from app.llm import aquery_llm, query_llm
+from app.logic.entity_index import EntityIndex
+from app.logic.gazetteer import Gazetteer, NameSpan, rewrite_spans, select_non_overlapping_spans
 from app.prompts import NER_RETRIEVAL
+from app.tracing import set_span_attributes, traced
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Models
@@ -21,6 +30,14 @@ class PlayersAndTeams(BaseModel):
     teams: list[str]
 
 
+class ResolvedNames(BaseModel):
+    """A text whose players and teams names were replaced with the ones available in the db."""
+
+    text: str
+    spans: list[NameSpan]  # Spans of the names in the original text
+    used_llm: bool
+
+
 # -------------------------------------------------------------------------------------------------------------------- #
 # Functions
 
@@ -30,54 +47,146 @@ def get_ner_prompt(text: str) -> str:
     return NER_RETRIEVAL.format(text=text, expected_json_schema=PlayersAndTeams.model_json_schema())
 
 
+@functools.lru_cache(maxsize=8)
+def build_entity_index(names: tuple[str, ...]) -> EntityIndex:
+    """Build the index of a list of names, reused as long as the same names are given."""
+    return EntityIndex(list(names))
+
+
+@functools.lru_cache(maxsize=1)
+def load_players_index(db_fingerprint: str) -> EntityIndex:
+    """Build the index of the players names of a database version."""
+    logger.debug(f"Building players index of database {db_fingerprint}")
+    return EntityIndex(get_players_names())
+
+
+@functools.lru_cache(maxsize=1)
+def load_teams_index(db_fingerprint: str) -> EntityIndex:
+    """Build the index of the teams names of a database version."""
+    logger.debug(f"Building teams index of database {db_fingerprint}")
+    return EntityIndex(get_teams_names())
+
+
+@functools.lru_cache(maxsize=1)
+def load_gazetteer(db_fingerprint: str) -> Gazetteer:
+    """Build the gazetteer of the players and teams names of a database version."""
+    logger.debug(f"Building gazetteer of database {db_fingerprint}")
+    return Gazetteer(get_players_names(), get_teams_names())
+
+
+def get_players_index() -> EntityIndex:
+    """Get the index of the players names available in the database, rebuilt only when the database changes."""
+    return load_players_index(get_db_fingerprint())
+
+
+def get_teams_index() -> EntityIndex:
+    """Get the index of the teams names available in the database, rebuilt only when the database changes."""
+    return load_teams_index(get_db_fingerprint())
+
+
+def get_gazetteer() -> Gazetteer:
+    """Get the gazetteer of the players and teams names available in the database, rebuilt when the database changes."""
+    return load_gazetteer(get_db_fingerprint())
+
+
 def get_closest_player_name(player_name: str, players_names: list[str]) -> str:
     """Find the closest player name in the database from an input given name."""
-    players_names_lowercase_to_original_case = {p.lower(): p for p in players_names}
-
-    # Find the closest match, use lowercase to make the search case insensitive.
-    closest_match_lower_case = difflib.get_close_matches(
-        word=player_name.lower(), possibilities=[p.lower() for p in players_names], n=1, cutoff=0
-    )[0]
-    return players_names_lowercase_to_original_case[closest_match_lower_case]
+    return build_entity_index(tuple(players_names)).find_closest(player_name)
 
 
 def get_closest_team_name(team_name: str, teams_names: list[str]) -> str:
     """Find the closest team name in the database from an input given name."""
-    teams_names = get_teams_names()
-    teams_name_lowercase_to_original_cases = {p.lower(): p for p in teams_names}
-
-    # Find the closest match, use lowercase to make the search case insensitive.
-    closest_match_lower_case = difflib.get_close_matches(
-        word=team_name.lower(), possibilities=[p.lower() for p in teams_names], n=1, cutoff=0
-    )[0]
-    return teams_name_lowercase_to_original_cases[closest_match_lower_case]
+    return build_entity_index(tuple(teams_names)).find_closest(team_name)
+
+
+@traced("ner.gazetteer")
+def find_gazetteer_spans(text: str) -> tuple[list[NameSpan], bool]:
+    """
+    Find the names of the text available in the gazetteer, and whether some other names may remain unresolved.
+
+    When some remain, the text must go through the LLM NER.
+    """
+    config = get_config()
+    if not config.ner_gazetteer_enabled:
+        return [], True
+
+    gazetteer = get_gazetteer()
+    spans = gazetteer.find_spans(text)
+    unresolved_words = gazetteer.find_unresolved_words(text, spans)
+    set_span_attributes({"ner.num_names": len(spans), "ner.num_unresolved_words": len(unresolved_words)})
+    if unresolved_words:
+        logger.debug(f"Unresolved words {unresolved_words}, falling back to the LLM NER")
+    return spans, bool(unresolved_words)
+
+
+def find_ner_result_spans(text: str, ner_result: PlayersAndTeams, resolved_spans: list[NameSpan]) -> list[NameSpan]:
+    """
+    Find the names returned by the LLM NER in the text, and match them with the ones available in the db.
+
+    Names are searched case insensitively, as the LLM sometimes doesn't return the original case. Occurrences
+    overlapping a name already resolved are skipped.
+    """
+    mentions_spans: list[tuple[int, int, str]] = []
+    for kind, mentions in (("player", ner_result.players), ("team", ner_result.teams)):
+        for mention in dict.fromkeys(m for m in mentions if m.strip()):
+            for match in re.finditer(re.escape(mention), text, flags=re.IGNORECASE):
+                if not any(s.start < match.end() and match.start() < s.end for s in resolved_spans):
+                    mentions_spans.append((match.start(), match.end(), kind))
+
+    spans = []
+    for kind, index in (("player", get_players_index()), ("team", get_teams_index())):
+        kind_spans = [(start, end) for start, end, span_kind in mentions_spans if span_kind == kind]
+        # All the names of a kind are matched in a single batch
+        matches = index.match_batch([text[start:end] for start, end in kind_spans])
+        spans.extend(
+            NameSpan(start=start, end=end, kind=kind, name=span_matches[0].name)
+            for (start, end), span_matches in zip(kind_spans, matches, strict=True)
+        )
+    return spans
+
+
+@traced("ner.entity_matching")
+def build_resolved_names(
+    text: str, gazetteer_spans: list[NameSpan], ner_result: Optional[PlayersAndTeams]
+) -> ResolvedNames:
+    """Rewrite the text with the names found by the gazetteer, and by the LLM NER if it was queried."""
+    spans = gazetteer_spans
+    if ner_result is not None:
+        spans = select_non_overlapping_spans(spans + find_ner_result_spans(text, ner_result, gazetteer_spans))
+    return ResolvedNames(text=rewrite_spans(text, spans), spans=spans, used_llm=ner_result is not None)
+
+
+@traced("ner")
+def resolve_names_in_text(text: str) -> ResolvedNames:
+    """
+    Replace the players and teams names of the text with the ones available in the db.
+
+    The LLM NER is skipped when the gazetteer finds all the names of the text.
+    """
+    gazetteer_spans, needs_llm = find_gazetteer_spans(text)
+    ner_result = None
+    if needs_llm:
+        ner_result = query_llm(prompt=get_ner_prompt(text), model_kind="light", structured_output=PlayersAndTeams)
+    return build_resolved_names(text, gazetteer_spans, ner_result)
+
+
+@traced("ner")
+async def aresolve_names_in_text(text: str) -> ResolvedNames:
+    """Async version of `resolve_names_in_text`, the database lookups being run in worker threads."""
+    gazetteer_spans, needs_llm = await asyncio.to_thread(find_gazetteer_spans, text)
+    ner_result = None
+    if needs_llm:
+        ner_result = await aquery_llm(
+            prompt=get_ner_prompt(text), model_kind="light", structured_output=PlayersAndTeams
+        )
+    return await asyncio.to_thread(build_resolved_names, text, gazetteer_spans, ner_result)
 
 
 def replace_names_in_text(text: str) -> str:
     """Clean the text by replacing the players and teams names with the ones available in the db."""
-    prompt_ner_players_teams = get_ner_prompt(text)
-    ner_players_teams = query_llm(
-        prompt=prompt_ner_players_teams, model_kind="light", structured_output=PlayersAndTeams
-    )
-
-    # Find exact name value in text because the LLM sometimes doesn't return the original case.
-    q = text
-    ner_result = PlayersAndTeams(
-        players=[q[q.lower().find(p.lower()) : q.lower().find(p.lower()) + len(p)] for p in ner_players_teams.players],
-        teams=[q[q.lower().find(p.lower()) : q.lower().find(p.lower()) + len(p)] for p in ner_players_teams.teams],
-    )
-
-    # Replace the names in the text with the ones available in the db.
-    for player_name in ner_result.players:
-        text = text.replace(
-            player_name,
-            get_closest_player_name(player_name=player_name, players_names=get_players_names()),
-        )
+    return resolve_names_in_text(text).text
 
-    for team_name in ner_result.teams:
-        text = text.replace(
-            team_name,
-            get_closest_team_name(team_name=team_name, teams_names=get_teams_names()),
-        )
 
-    return text
+async def areplace_names_in_text(text: str) -> str:
+    """Async version of `replace_names_in_text`."""
+    return (await aresolve_names_in_text(text)).text
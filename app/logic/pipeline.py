@@ -0,0 +1,220 @@
+"""Asynchronous orchestration of the whole pipeline, from a question in natural language to its answer."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+import contextvars
+import functools
+import threading
+from collections.abc import Coroutine
+from typing import Any, Literal, Optional, TypeVar
+
+import pyarrow as pa
+from loguru import logger
+from pydantic import BaseModel, ConfigDict
+
+from app.configuration import get_config
+from app.constants import MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD
+from app.db.dao import sql_to_arrow
+from app.db.query_guard import SqlExecutionError
+from app.logic.ner_retrieval import areplace_names_in_text
+from app.logic.question_to_sql import (
+    SqlGeneration,
+    agenerate_sql_query,
+    cache_sql_query,
+    get_db_description,
+    get_question_db_description,
+)
+from app.logic.results_display import agenerate_question_response_md, render_question_response_md
+from app.singleflight import SingleFlight
+from app.tracing import start_trace, traced
+
+T = TypeVar("T")
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class QuestionAnswer(BaseModel):
+    """Answer to a question, along with the intermediate results of the pipeline."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    question: str
+    clean_question: str
+    sql_query: str
+    sql_source: Literal["llm", "template", "cache"]
+    result: pa.Table
+    response_md: Optional[str]  # None when the result is large and its summary disabled
+    response_source: Optional[Literal["template", "llm"]]
+
+
+class SpeculationStats(BaseModel):
+    """Outcomes of the SQL queries generated speculatively on the raw questions, while their NER runs."""
+
+    hits: int = 0  # The NER left the question unchanged: the speculative SQL query is used
+    misses: int = 0  # The NER changed the question: the speculative SQL query is discarded
+    cancellations: int = 0  # Misses whose speculative generation was cancelled before the LLM answered
+
+    @property
+    def hit_rate(self) -> float:
+        speculations = self.hits + self.misses
+        return self.hits / speculations if speculations else 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+@functools.cache
+def get_speculation_stats() -> SpeculationStats:
+    return SpeculationStats()
+
+
+@functools.cache
+def get_background_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Retrieve the process-wide event loop, running forever in a daemon thread, on which the app runs the pipeline.
+
+    The async LLM clients are bound to the loop they were created in: a single long-lived loop keeps reusing them across
+    Streamlit reruns, whereas `asyncio.run` would create a new loop, hence new clients left open, on each rerun.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="pipeline-event-loop", daemon=True).start()
+    return loop
+
+
+def run_in_background_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the background event loop, in the context of the caller, and wait for its result."""
+    context = contextvars.copy_context()
+
+    async def run_in_context() -> T:
+        return await asyncio.create_task(coroutine, context=context)
+
+    return asyncio.run_coroutine_threadsafe(run_in_context(), get_background_event_loop()).result()
+
+
+@functools.cache
+def get_question_single_flight() -> Optional[SingleFlight]:
+    """Retrieve the process-wide group deduplicating identical questions being answered, None if disabled."""
+    if not get_config().single_flight_enabled:
+        return None
+    return SingleFlight(name="questions")
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so that the same question typed with another case or spacing is identified as identical."""
+    return " ".join(question.casefold().split())
+
+
+@traced("generation")
+async def aclean_question_and_generate_sql_query(
+    question: str, thinking_mode: bool, speculative: bool
+) -> tuple[str, SqlGeneration]:
+    """
+    Clean a question with the NER and retrieval pipeline, then generate its SQL query.
+
+    The db schema is loaded while the NER runs, then pruned to the part relevant to the clean question. In speculative
+    mode, the SQL query of the raw question is generated while the NER runs: it is used if the NER leaves the question
+    unchanged (e.g. names typed exactly), saving a LLM round trip, else it is cancelled and generated again.
+    """
+    speculative_sql_generation = (
+        asyncio.create_task(agenerate_sql_query(question, thinking_mode)) if speculative else None
+    )
+    try:
+        clean_question, _ = await asyncio.gather(
+            areplace_names_in_text(question),
+            asyncio.to_thread(get_db_description),
+        )
+    except BaseException:
+        if speculative_sql_generation is not None:
+            speculative_sql_generation.cancel()
+        raise
+
+    if speculative_sql_generation is not None:
+        speculation_stats = get_speculation_stats()
+        if clean_question == question:
+            speculation_stats.hits += 1
+            logger.info(f"Speculative SQL generation hit, hit rate: {speculation_stats.hit_rate:.0%}")
+            return clean_question, await speculative_sql_generation
+
+        speculation_stats.misses += 1
+        speculation_stats.cancellations += speculative_sql_generation.cancel()
+        await asyncio.gather(speculative_sql_generation, return_exceptions=True)
+        logger.info(f"Speculative SQL generation miss, hit rate: {speculation_stats.hit_rate:.0%}")
+
+    db_description = await asyncio.to_thread(get_question_db_description, clean_question)
+    return clean_question, await agenerate_sql_query(clean_question, thinking_mode, db_description=db_description)
+
+
+@traced("execution")
+async def aexecute_sql_query(clean_question: str, sql_generation: SqlGeneration) -> pa.Table:
+    """Run the SQL query of a question in a worker thread. A query generated by the LLM is cached once it ran."""
+    result = await asyncio.to_thread(sql_to_arrow, sql_generation.sql_query)
+    if sql_generation.source == "llm":
+        # The query ran without error, it can be reused for similar questions
+        await asyncio.to_thread(cache_sql_query, clean_question, sql_generation.sql_query)
+    return result
+
+
+@traced("summary")
+async def asummarize_result(
+    clean_question: str, result: pa.Table
+) -> tuple[Optional[str], Optional[Literal["template", "llm"]]]:
+    """Summarize the result of a question in markdown, from a template when possible. None if disabled."""
+    config = get_config()
+    if result.num_rows * result.num_columns < MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD:
+        if not config.result_summary_llm_enabled:
+            response_md = render_question_response_md(result)
+            if response_md is not None:
+                return response_md, "template"
+    elif not config.large_result_summary_enabled:
+        return None, None
+    return await agenerate_question_response_md(question=clean_question, result=result), "llm"
+
+
+async def arun_pipeline(question: str, thinking_mode: bool, speculative: bool) -> QuestionAnswer:
+    """Run the whole pipeline on a question, see `answer_question`."""
+    clean_question, sql_generation = await aclean_question_and_generate_sql_query(question, thinking_mode, speculative)
+    try:
+        result = await aexecute_sql_query(clean_question, sql_generation)
+    except SqlExecutionError as e:
+        if sql_generation.source != "cache":
+            raise
+        # The query of a similar question may not fit this one
+        logger.warning(f"Cached SQL query failed, generating it with the LLM: {e}")
+        sql_generation = await agenerate_sql_query(clean_question, thinking_mode, use_local_generation=False)
+        result = await aexecute_sql_query(clean_question, sql_generation)
+    response_md, response_source = await asummarize_result(clean_question, result)
+
+    return QuestionAnswer(
+        question=question,
+        clean_question=clean_question,
+        sql_query=sql_generation.sql_query,
+        sql_source=sql_generation.source,
+        result=result,
+        response_md=response_md,
+        response_source=response_source,
+    )
+
+
+async def answer_question(
+    question: str, thinking_mode: bool = False, speculative: Optional[bool] = None
+) -> QuestionAnswer:
+    """
+    Answer a question by running the whole pipeline: NER and retrieval, SQL generation, SQL execution and summary.
+
+    Blocking database calls are run in worker threads, so several questions can be answered concurrently by the same
+    event loop. The speculative SQL generation defaults to the configured one. The stages are traced, see `app.tracing`.
+    The same question asked again while it is being answered (whatever its case or spacing) waits for the same answer.
+    """
+    if speculative is None:
+        speculative = get_config().speculative_sql_generation_enabled
+    with start_trace("answer_question", {"question": question}):
+        single_flight = get_question_single_flight()
+        if single_flight is None:
+            return await arun_pipeline(question, thinking_mode, speculative)
+        key = f"{thinking_mode}\n{speculative}\n{normalize_question(question)}"
+        question_answer = await single_flight.acall(key, arun_pipeline, question, thinking_mode, speculative)
+        return question_answer.model_copy(update={"question": question})
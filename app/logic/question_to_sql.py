@@ -2,30 +2,120 @@
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
 
+import asyncio
+import functools
+import time
+from collections.abc import Iterator
+from contextlib import closing
+from typing import Literal, Optional
+
 from loguru import logger
+from pydantic import BaseModel
 
-from app.db.dao import get_table_columns, get_tables
-from app.llm import query_llm
+from app.configuration import get_config
+from app.db.connection import get_db_fingerprint
+from app.db.dao import get_tables_columns, validate_sql_query
+from app.db.query_guard import SqlExecutionError
+from app.llm import LLMQueryError, aquery_llm, query_llm, stream_query_llm
+from app.logic.model_routing import (
+    RoutingDecision,
+    extract_routing_features,
+    record_routing_decision,
+    record_sql_generation,
+    route_question,
+)
+from app.logic.ner_retrieval import get_gazetteer
+from app.logic.schema_selection import SchemaIndex, SchemaSelection, estimate_num_tokens, tokenize_question
+from app.logic.sql_cache import CanonicalQuestion, SemanticSqlCache, canonicalize_question
+from app.logic.sql_templates import SqlTemplateMatch, get_sql_template_stats, match_sql_template
 from app.prompts import QUESTION_TO_SQL
+from app.tracing import set_span_attributes, span, traced
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class SqlGeneration(BaseModel):
+    """A SQL query answering a question: generated by the LLM, filled from a template or retrieved from the cache."""
+
+    sql_query: str
+    source: Literal["llm", "template", "cache"]
+    model_kind: Optional[Literal["light", "heavy"]] = None  # LLM which generated the query
+    template_intent: Optional[str] = None  # Intent of the template which gave the query
+
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Functions
 
 
-def get_table_description(table_name: str) -> str:
+def get_table_description(table_name: str, columns: list[tuple[str, str]]) -> str:
     """Generate the description of a table in natural language to be used by the LLM."""
     table_description = f"Table: {table_name}"
-    for column_name, data_type in get_table_columns(table_name):
+    for column_name, data_type in columns:
         table_description += f"\n  - {column_name}: {data_type}"
 
     return table_description
 
 
+def build_db_description(tables_columns: dict[str, list[tuple[str, str]]]) -> str:
+    """Generate the description of tables in natural language to be used by the LLM."""
+    return "\n\n".join(get_table_description(table, columns) for table, columns in tables_columns.items())
+
+
+@functools.lru_cache(maxsize=1)
+def load_tables_columns(db_fingerprint: str) -> dict[str, list[tuple[str, str]]]:
+    """Retrieve the columns of the tables of a database version."""
+    logger.debug(f"Loading schema of database {db_fingerprint}")
+    return get_tables_columns()
+
+
+@functools.lru_cache(maxsize=1)
+def load_db_description(db_fingerprint: str) -> str:
+    """Generate the description of a database version in natural language to be used by the LLM."""
+    return build_db_description(load_tables_columns(db_fingerprint))
+
+
+@functools.lru_cache(maxsize=1)
+def load_schema_index(db_fingerprint: str) -> SchemaIndex:
+    """Build the index of the tables and columns names of a database version."""
+    return SchemaIndex(load_tables_columns(db_fingerprint))
+
+
+@traced("schema.introspection")
 def get_db_description() -> str:
-    """Generate the description of a database in natural language to be used by the LLM."""
-    tables_names = get_tables()
-    tables_desc = {table: get_table_description(table) for table in tables_names}
-    return "\n\n".join(tables_desc.values())
+    """Get the description of the database, only generated again when the database changes."""
+    return load_db_description(get_db_fingerprint())
+
+
+def select_schema(question: str) -> SchemaSelection:
+    """Select the part of the database relevant to a question, the players and teams it names being taken as hints."""
+    db_fingerprint = get_db_fingerprint()
+    entity_kinds = {span.kind for span in get_gazetteer().find_spans(question)}
+    tables_columns = load_schema_index(db_fingerprint).select(question, entity_kinds)
+    description = build_db_description(tables_columns)
+    schema_selection = SchemaSelection(
+        tables=list(tables_columns),
+        description=description,
+        num_tokens=estimate_num_tokens(description),
+        full_num_tokens=estimate_num_tokens(load_db_description(db_fingerprint)),
+    )
+    set_span_attributes(
+        {"schema.num_tables": len(schema_selection.tables), "schema.num_tokens": schema_selection.num_tokens}
+    )
+    logger.info(
+        f"Schema pruning kept tables {schema_selection.tables}, "
+        f"saving ~{schema_selection.saved_num_tokens}/{schema_selection.full_num_tokens} prompt tokens"
+    )
+    return schema_selection
+
+
+@traced("schema.selection")
+def get_question_db_description(question: str) -> str:
+    """Get the description of the database to answer a question: the relevant part only, if pruning is enabled."""
+    config = get_config()
+    if not config.sql_schema_pruning_enabled:
+        return get_db_description()
+    return select_schema(question).description
 
 
 def build_prompt(question: str, db_description: str, thinking_mode: bool) -> str:
@@ -44,11 +134,226 @@ def extract_sql_query(text: str) -> str:
     return text[start_index + len(sql_identifier) :].split("```")[0]
 
 
-def generate_sql_query(question: str, thinking_mode: bool) -> str:
-    """Generate SQL query from a question."""
-    db_description = get_db_description()
+def is_sql_query_complete(text: str) -> bool:
+    """Check if a text, e.g. a LLM response being streamed, contains a SQL query with its closing backticks."""
+    sql_identifier = "```sql"
+    start_index = text.find(sql_identifier)
+    return start_index != -1 and text.find("```", start_index + len(sql_identifier)) != -1
+
+
+@functools.cache
+def get_sql_cache() -> Optional[SemanticSqlCache]:
+    """Retrieve the process-wide cache of validated SQL queries, None if caching is disabled."""
+    config = get_config()
+    if not config.sql_cache_enabled:
+        return None
+    return SemanticSqlCache(path=config.sql_cache_path, min_similarity=config.sql_cache_min_similarity)
+
+
+def canonicalize(question: str) -> CanonicalQuestion:
+    """Canonicalize a question whose players and teams names were replaced with the ones of the db."""
+    return canonicalize_question(question, get_gazetteer().find_spans(question))
+
+
+@traced("sql.cache_lookup")
+def get_cached_sql_query(question: str) -> Optional[str]:
+    """Retrieve the SQL query of the same or of a similar question from the cache, None if there is none."""
+    sql_cache = get_sql_cache()
+    if sql_cache is None:
+        return None
+    sql_cache_match = sql_cache.get(canonicalize(question))
+    set_span_attributes({"sql.cache_hit": sql_cache_match is not None})
+    if sql_cache_match is None:
+        return None
+    logger.info(
+        f"SQL query retrieved from cache, cached question '{sql_cache_match.cached_question}' "
+        f"({sql_cache_match.similarity:.0%} similar)"
+    )
+    return sql_cache_match.sql_query
+
+
+@traced("sql.cache_store")
+def cache_sql_query(question: str, sql_query: str) -> None:
+    """Store the SQL query of a question in the cache. It must have been validated, e.g. executed without error."""
+    sql_cache = get_sql_cache()
+    if sql_cache is not None:
+        sql_cache.set(canonicalize(question), sql_query)
+
+
+@traced("sql.template_match")
+def get_sql_template_match(question: str) -> Optional[SqlTemplateMatch]:
+    """Match a question with the vetted SQL templates, see `app.logic.sql_templates`. None if disabled or no match."""
+    if not get_config().sql_templates_enabled:
+        return None
+    sql_template_match = match_sql_template(question, get_gazetteer().find_spans(question))
+    sql_template_stats = get_sql_template_stats()
+    if sql_template_match is None:
+        sql_template_stats.misses += 1
+        set_span_attributes({"sql.template_hit": False})
+        return None
+    sql_template_stats.hits += 1
+    set_span_attributes({"sql.template_hit": True, "sql.template_intent": sql_template_match.intent})
+    logger.info(f"SQL query filled from template '{sql_template_match.intent}' with {sql_template_match.slots}")
+    return sql_template_match
+
+
+def get_local_sql_generation(question: str) -> Optional[SqlGeneration]:
+    """
+    Get the SQL query of a question without LLM call: from a vetted template, else from the cache of validated queries.
+    None if there is none.
+    """
+    sql_template_match = get_sql_template_match(question)
+    if sql_template_match is not None:
+        return SqlGeneration(
+            sql_query=sql_template_match.sql_query, source="template", template_intent=sql_template_match.intent
+        )
+    cached_sql_query = get_cached_sql_query(question)
+    if cached_sql_query is not None:
+        return SqlGeneration(sql_query=cached_sql_query, source="cache")
+    return None
+
+
+@traced("sql.routing")
+def get_routing_decision(question: str) -> RoutingDecision:
+    """Route the SQL generation of a question to the light or heavy LLM, from its complexity."""
+    spans = get_gazetteer().find_spans(question)
+    question_tokens = tokenize_question(question, {span.kind for span in spans})
+    num_tables = len(load_schema_index(get_db_fingerprint()).match_tables(question_tokens))
+    routing_features = extract_routing_features(question, num_tables=num_tables, num_entities=len(spans))
+    routing_decision = route_question(
+        routing_features, max_light_complexity=get_config().sql_routing_max_light_complexity
+    )
+    set_span_attributes(
+        {"routing.model_kind": routing_decision.model_kind, "routing.complexity": routing_features.complexity}
+    )
+    return routing_decision
+
+
+def route_sql_generation(question: str) -> Literal["light", "heavy"]:
+    """
+    Choose the LLM generating the SQL query of a question: the light one if model routing is enabled and the question
+    is simple, see `app.logic.model_routing`, else the heavy one.
+    """
+    if not get_config().sql_model_routing_enabled:
+        return "heavy"
+    routing_decision = get_routing_decision(question)
+    record_routing_decision(routing_decision)
+    logger.info(
+        f"SQL generation routed to the {routing_decision.model_kind} LLM, "
+        f"complexity {routing_decision.features.complexity}"
+    )
+    return routing_decision.model_kind
+
+
+def check_light_llm_response(llm_response: str) -> bool:
+    """Check that the response of the light LLM contains a valid SQL query, with `EXPLAIN`."""
+    try:
+        validate_sql_query(extract_sql_query(llm_response))
+    except (ValueError, SqlExecutionError) as e:
+        logger.info(f"Invalid SQL query generated by the light LLM, escalating to the heavy LLM: {e}")
+        return False
+    return True
+
+
+def generate_light_llm_response(prompt: str) -> Optional[str]:
+    """Query the light LLM for a SQL query. None if it failed or its query is invalid, to escalate to the heavy LLM."""
+    start_time = time.perf_counter()
+    try:
+        llm_response = query_llm(prompt=prompt, model_kind="light")
+    except LLMQueryError as e:
+        logger.info(f"Light LLM query failed, escalating to the heavy LLM: {e}")
+        llm_response = None
+    is_valid = llm_response is not None and check_light_llm_response(llm_response)
+    record_sql_generation("light" if is_valid else "escalation", time.perf_counter() - start_time)
+    set_span_attributes({"routing.escalated": not is_valid})
+    return llm_response if is_valid else None
+
+
+async def agenerate_light_llm_response(prompt: str) -> Optional[str]:
+    """Async version of `generate_light_llm_response`."""
+    start_time = time.perf_counter()
+    try:
+        llm_response = await aquery_llm(prompt=prompt, model_kind="light")
+    except LLMQueryError as e:
+        logger.info(f"Light LLM query failed, escalating to the heavy LLM: {e}")
+        llm_response = None
+    is_valid = llm_response is not None and await asyncio.to_thread(check_light_llm_response, llm_response)
+    record_sql_generation("light" if is_valid else "escalation", time.perf_counter() - start_time)
+    set_span_attributes({"routing.escalated": not is_valid})
+    return llm_response if is_valid else None
+
+
+@traced("sql.generation")
+def generate_sql_query(question: str, thinking_mode: bool) -> SqlGeneration:
+    """
+    Generate SQL query from a question, unless it matches a template or the query of a similar question is cached, see
+    `get_local_sql_generation`. Simple questions are routed to the light LLM if enabled, see `route_sql_generation`.
+    """
+    local_sql_generation = get_local_sql_generation(question)
+    if local_sql_generation is not None:
+        return local_sql_generation
+
+    db_description = get_question_db_description(question)
+    prompt = build_prompt(question=question, db_description=db_description, thinking_mode=thinking_mode)
+    model_kind = route_sql_generation(question)
+    llm_response = generate_light_llm_response(prompt) if model_kind == "light" else None
+    if llm_response is None:
+        start_time = time.perf_counter()
+        model_kind, llm_response = "heavy", query_llm(prompt=prompt, model_kind="heavy")
+        record_sql_generation("heavy", time.perf_counter() - start_time)
+    logger.debug(f"llm_response: {llm_response}")
+    return SqlGeneration(sql_query=extract_sql_query(llm_response), source="llm", model_kind=model_kind)
+
+
+@traced("sql.generation")
+async def agenerate_sql_query(
+    question: str, thinking_mode: bool, db_description: Optional[str] = None, use_local_generation: bool = True
+) -> SqlGeneration:
+    """
+    Async version of `generate_sql_query`. The db description can be given when it was loaded beforehand. Without local
+    generation, the SQL query is always generated by the LLM, e.g. when the cached one failed.
+    """
+    if use_local_generation:
+        local_sql_generation = await asyncio.to_thread(get_local_sql_generation, question)
+        if local_sql_generation is not None:
+            return local_sql_generation
+
+    if db_description is None:
+        db_description = await asyncio.to_thread(get_question_db_description, question)
     prompt = build_prompt(question=question, db_description=db_description, thinking_mode=thinking_mode)
-    llm_response = query_llm(prompt=prompt, model_kind="heavy")
+    model_kind = await asyncio.to_thread(route_sql_generation, question)
+    llm_response = await agenerate_light_llm_response(prompt) if model_kind == "light" else None
+    if llm_response is None:
+        start_time = time.perf_counter()
+        model_kind, llm_response = "heavy", await aquery_llm(prompt=prompt, model_kind="heavy")
+        record_sql_generation("heavy", time.perf_counter() - start_time)
+    logger.debug(f"llm_response: {llm_response}")
+    return SqlGeneration(sql_query=extract_sql_query(llm_response), source="llm", model_kind=model_kind)
+
+
+def stream_sql_query_generation(question: str, thinking_mode: bool) -> Iterator[str]:
+    """
+    Stream the LLM response generating the SQL query of a question.
+
+    The stream stops as soon as the SQL query block is complete, so the query can be extracted from the concatenated
+    tokens with `extract_sql_query` without waiting for the rest of the response. The response is cached at that point,
+    see `stream_query_llm`. A question routed to the light LLM gets its validated response at once, see
+    `route_sql_generation`.
+    """
+    with span("sql.generation"):
+        db_description = get_question_db_description(question)
+        prompt = build_prompt(question=question, db_description=db_description, thinking_mode=thinking_mode)
+        if route_sql_generation(question) == "light":
+            llm_response = generate_light_llm_response(prompt)
+            if llm_response is not None:
+                yield llm_response
+                return
+
+        start_time = time.perf_counter()
+        llm_response = ""
+        with closing(stream_query_llm(prompt=prompt, model_kind="heavy", is_complete=is_sql_query_complete)) as tokens:
+            for token in tokens:
+                llm_response += token
+                yield token
+        record_sql_generation("heavy", time.perf_counter() - start_time)
     logger.debug(f"llm_response: {llm_response}")
-    sql_query = extract_sql_query(llm_response)
-    return sql_query
@@ -0,0 +1,149 @@
+"""Statistical profile of a SQL result, giving the LLM a digest of bounded size whatever the number of rows."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from typing import Any, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from pydantic import BaseModel
+
+from app.constants import (
+    RESULT_DIGEST_MAX_COLUMNS,
+    RESULT_DIGEST_MAX_LEADING_ROWS,
+    RESULT_DIGEST_MAX_VALUE_CHARS,
+    RESULT_DIGEST_TOP_K,
+)
+from app.logic.schema_selection import estimate_num_tokens
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class ColumnProfile(BaseModel):
+    """Statistics of a column, computed with vectorized Arrow kernels. Those not applying to its type are None."""
+
+    name: str
+    data_type: str
+    num_nulls: int
+    min: Any = None  # Numbers and dates
+    max: Any = None
+    mean: Optional[float] = None  # Numbers
+    num_distinct: Optional[int] = None  # Other types, e.g. strings
+    top_values: list[tuple[Any, int]] = []  # Most frequent values, with their count
+
+
+class ResultProfile(BaseModel):
+    num_rows: int
+    num_columns: int
+    columns: list[ColumnProfile]  # The first `RESULT_DIGEST_MAX_COLUMNS` columns
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def profile_column(name: str, column: pa.ChunkedArray, top_k: int) -> ColumnProfile:
+    """Compute the statistics of a column, in a few passes over its values whatever its length."""
+    column_profile = ColumnProfile(name=name, data_type=str(column.type), num_nulls=column.null_count)
+    if pa.types.is_nested(column.type) or column.null_count == len(column):
+        return column_profile
+
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_decimal(column.type):
+        min_max = pc.min_max(column)
+        column_profile.min, column_profile.max = min_max["min"].as_py(), min_max["max"].as_py()
+        column_profile.mean = pc.mean(column).as_py()
+    elif pa.types.is_temporal(column.type):
+        min_max = pc.min_max(column)
+        column_profile.min, column_profile.max = min_max["min"].as_py(), min_max["max"].as_py()
+    else:
+        value_counts = pc.value_counts(column)
+        counts = pa.table({"value": value_counts.field("values"), "count": value_counts.field("counts")}).drop_null()
+        column_profile.num_distinct = counts.num_rows
+        top_counts = counts.sort_by([("count", "descending")]).slice(0, top_k)
+        column_profile.top_values = list(zip(*top_counts.to_pydict().values(), strict=True))
+    return column_profile
+
+
+def profile_result(result: pa.Table, top_k: int = RESULT_DIGEST_TOP_K) -> ResultProfile:
+    """Profile the first `RESULT_DIGEST_MAX_COLUMNS` columns of a result."""
+    columns = zip(
+        result.column_names[:RESULT_DIGEST_MAX_COLUMNS], result.columns[:RESULT_DIGEST_MAX_COLUMNS], strict=True
+    )
+    return ResultProfile(
+        num_rows=result.num_rows,
+        num_columns=result.num_columns,
+        columns=[profile_column(name, column, top_k) for name, column in columns],
+    )
+
+
+def format_digest_value(value: Any) -> str:
+    """Format a value for the digest, truncating long ones (e.g. long strings) so that its size stays bounded."""
+    text = str(value)
+    if isinstance(value, float):
+        text = str(round(value, 2)) if abs(value) >= 1 else f"{value:.3g}"
+    return text if len(text) <= RESULT_DIGEST_MAX_VALUE_CHARS else f"{text[: RESULT_DIGEST_MAX_VALUE_CHARS - 3]}..."
+
+
+def describe_column(column_profile: ColumnProfile, top_k: int) -> str:
+    """Describe the statistics of a column in a single line, with at most `top_k` of its most frequent values."""
+    stats = []
+    if column_profile.min is not None:
+        stats.append(f"min {format_digest_value(column_profile.min)}, max {format_digest_value(column_profile.max)}")
+    if column_profile.mean is not None:
+        stats.append(f"mean {format_digest_value(column_profile.mean)}")
+    if column_profile.num_distinct is not None:
+        stats.append(f"{column_profile.num_distinct} distinct values")
+        if top_k and column_profile.top_values:
+            top_values = column_profile.top_values[:top_k]
+            stats[-1] += ", most frequent: " + ", ".join(f"{format_digest_value(v)} ({c})" for v, c in top_values)
+    if column_profile.num_nulls:
+        stats.append(f"{column_profile.num_nulls} nulls")
+    name = format_digest_value(column_profile.name)
+    return f"- `{name}` ({column_profile.data_type}): {'; '.join(stats) or 'no statistics'}"
+
+
+def describe_result(result_profile: ResultProfile, top_k: int, num_columns: int) -> str:
+    """Describe the number of rows of a result and the statistics of its first `num_columns` columns."""
+    columns_lines = [describe_column(column_profile, top_k) for column_profile in result_profile.columns[:num_columns]]
+    if result_profile.num_columns > num_columns:
+        columns_lines.append(f"- ... and {result_profile.num_columns - num_columns} more columns")
+    return f"Number of rows: {result_profile.num_rows}\n\nColumns:\n" + "\n".join(columns_lines)
+
+
+def build_result_digest(result: pa.Table, max_num_tokens: int) -> str:
+    """
+    Build a markdown digest of a result: its number of rows, the statistics of its columns and its leading rows.
+
+    Its size doesn't depend on the number of rows: the columns and values described are capped, then leading rows,
+    most frequent values and column statistics are dropped in this order until the digest fits in `max_num_tokens`
+    (only the number of rows is always kept).
+    """
+    result_profile = profile_result(result)
+    statistics = describe_result(result_profile, RESULT_DIGEST_TOP_K, len(result_profile.columns))
+
+    column_names = result.column_names[:RESULT_DIGEST_MAX_COLUMNS]
+    leading_rows = result.slice(0, RESULT_DIGEST_MAX_LEADING_ROWS).columns[:RESULT_DIGEST_MAX_COLUMNS]
+    table_lines = [
+        "| " + " | ".join(format_digest_value(name) for name in column_names) + " |",
+        "|" + "---|" * len(column_names),
+    ] + [
+        "| " + " | ".join(format_digest_value(value) for value in row) + " |"
+        for row in zip(*(column.to_pylist() for column in leading_rows), strict=True)
+    ]
+    for num_leading_rows in range(len(table_lines) - 2, 0, -1):
+        table = "\n".join(table_lines[: num_leading_rows + 2])
+        digest = f"{statistics}\n\nFirst {num_leading_rows} rows:\n\n{table}"
+        if estimate_num_tokens(digest) <= max_num_tokens:
+            return digest
+
+    # The statistics alone may exceed the budget, e.g. for wide tables of long strings
+    max_num_columns = len(result_profile.columns)
+    trimmings = [(top_k, max_num_columns) for top_k in range(RESULT_DIGEST_TOP_K, -1, -1)]
+    trimmings += [(0, num_columns) for num_columns in range(max_num_columns - 1, -1, -1)]
+    for top_k, num_columns in trimmings:
+        statistics = describe_result(result_profile, top_k, num_columns)
+        if estimate_num_tokens(statistics) <= max_num_tokens:
+            break
+    return statistics
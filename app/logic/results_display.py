@@ -3,28 +3,152 @@
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
 
-import pandas as pd
+import functools
+import time
+from collections.abc import Iterator
+from typing import Any, Optional
+
+import pyarrow as pa
+from pydantic import BaseModel
+
+from app.configuration import get_config
+from app.constants import MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD
+from app.llm import aquery_llm, query_llm, stream_query_llm
+from app.logic.result_profile import build_result_digest
+from app.tracing import set_span_attributes, span, traced
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class ResponseStats(BaseModel):
+    """Counters of the answers rendered from a template or summarized by the LLM, with the latency of the latter."""
+
+    template_responses: int = 0
+    llm_responses: int = 0
+    llm_total_seconds: float = 0.0
+
+    @property
+    def avg_llm_seconds(self) -> Optional[float]:
+        """Average latency of the LLM summaries, None until one was generated."""
+        return self.llm_total_seconds / self.llm_responses if self.llm_responses else None
 
-from app.llm import query_llm
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Functions
 
 
-def generate_question_response_md(question: str, result: pd.DataFrame) -> str:
-    """Generate a markdown summary of a question based on its result."""
+@functools.cache
+def get_response_stats() -> ResponseStats:
+    """Retrieve the process-wide counters of the answers."""
+    return ResponseStats()
+
+
+def record_llm_response(start_time: float) -> None:
+    response_stats = get_response_stats()
+    response_stats.llm_responses += 1
+    response_stats.llm_total_seconds += time.perf_counter() - start_time
+
+
+def format_label(column_name: str) -> str:
+    """Turn a column name into a label, e.g. `max_points` into `Max points`."""
+    label = column_name.replace("_", " ").strip()
+    return label[:1].upper() + label[1:]
+
 
-    prompt = f"""
+def format_value(value: Any) -> str:
+    if value is None:
+        return "*no value*"
+    if isinstance(value, float):
+        return str(round(value, 2)) if abs(value) >= 1 else f"{value:.3g}"
+    return str(value)
+
+
+def render_template_response_md(result: pa.Table) -> Optional[str]:
+    """
+    Render the markdown answer of a tiny result from its columns names and values, without LLM. None if its shape isn't
+    supported: a single value, a single row, or a ranking (two columns, e.g. a name and a value).
+    """
+    labels = [format_label(column_name) for column_name in result.column_names]
+    columns = [column.to_pylist() for column in result.columns]
+    if result.num_columns == 0:
+        return None
+    if result.num_rows == 0:
+        return "No result matches the question."
+    if result.num_rows == 1 and result.num_columns == 1:
+        return f"**{labels[0]}**: {format_value(columns[0][0])}"
+    if result.num_rows == 1:
+        return "\n".join(
+            f"- **{label}**: {format_value(values[0])}" for label, values in zip(labels, columns, strict=True)
+        )
+    if result.num_columns == 2:  # noqa: PLR2004
+        return "\n".join(
+            f"{rank}. **{format_value(key)}**: {format_value(value)} {labels[1].lower()}"
+            for rank, (key, value) in enumerate(zip(*columns, strict=True), start=1)
+        )
+    return None
+
+
+@traced("summary.template")
+def render_question_response_md(result: pa.Table) -> Optional[str]:
+    """Render the markdown answer of a tiny result from a template, see `render_template_response_md`."""
+    response_md = render_template_response_md(result)
+    set_span_attributes({"summary.rendered": response_md is not None})
+    if response_md is not None:
+        get_response_stats().template_responses += 1
+    return response_md
+
+
+def build_question_response_prompt(question: str, result: pa.Table) -> str:
+    """
+    Build prompt to summarize the result of a question. A small result is given as is (only converted to pandas to be
+    rendered), a large one as a digest of its statistics and leading rows, whose size doesn't depend on its rows.
+    """
+    if result.num_rows * result.num_columns < MAX_NUM_VALUES_NATURAL_LANGUAGE_TO_TABLE_THRESHOLD:
+        result_intro = "The result of the query is the following table:"
+        result_md = result.to_pandas().to_markdown(index=False)
+    else:
+        result_intro = "The result of the query is too large to be shown, here is a digest of it:"
+        result_md = build_result_digest(result, max_num_tokens=get_config().result_digest_max_tokens)
+    return f"""
 You are an expert in NBA statistics. Someone asked you this question:
 {question}
 
 You generated a SQL query on a database with NBA data in order to respond to the question.
-The result of the query is the following table:
+{result_intro}
 
-{result.to_markdown(index=False)}
+{result_md}
 
 Write a summary of the result in markdown format.
 
 Be concise. Do not write the question again. Do not write the SQL query. Do not write the table.
 """
-    return query_llm(prompt=prompt, model_kind="light")
+
+
+@traced("summary.llm")
+def generate_question_response_md(question: str, result: pa.Table) -> str:
+    """Generate a markdown summary of a question based on its result."""
+    start_time = time.perf_counter()
+    prompt = build_question_response_prompt(question=question, result=result)
+    response_md = query_llm(prompt=prompt, model_kind="light")
+    record_llm_response(start_time)
+    return response_md
+
+
+@traced("summary.llm")
+async def agenerate_question_response_md(question: str, result: pa.Table) -> str:
+    """Async version of `generate_question_response_md`."""
+    start_time = time.perf_counter()
+    prompt = build_question_response_prompt(question=question, result=result)
+    response_md = await aquery_llm(prompt=prompt, model_kind="light")
+    record_llm_response(start_time)
+    return response_md
+
+
+def stream_question_response_md(question: str, result: pa.Table) -> Iterator[str]:
+    """Streaming version of `generate_question_response_md`, yielding the summary tokens as they are generated."""
+    with span("summary.llm"):
+        start_time = time.perf_counter()
+        prompt = build_question_response_prompt(question=question, result=result)
+        yield from stream_query_llm(prompt=prompt, model_kind="light")
+        record_llm_response(start_time)
@@ -0,0 +1,221 @@
+"""Selection of the tables and columns of the database relevant to a question, to shorten the SQL generation prompt."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import math
+import re
+from collections.abc import Iterable
+
+from pydantic import BaseModel, computed_field
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+CHARS_PER_TOKEN = 4  # Rough average for English text and SQL identifiers
+
+# Tokens of the columns names too common to tell which column a question refers to
+GENERIC_COLUMN_TOKENS = {"id", "name", "is", "nb", "num", "total", "played"}
+
+# Question words (stemmed) mapped to the tokens of the columns names they refer to
+SYNONYMS = {
+    "score": {"point"},
+    "scored": {"point"},
+    "scoring": {"point"},
+    "pt": {"point"},
+    "pts": {"point"},
+    "point": {"pt"},
+    "triple": {"point", "rebound", "assist", "steal", "block"},
+    "double": {"point", "rebound", "assist", "steal", "block"},
+    "3pt": {"three", "pt", "attempt"},
+    "threes": {"three", "pt", "attempt"},
+    "win": {"win", "pct", "home", "away"},
+    "winning": {"win", "pct"},
+    "won": {"win", "pct", "home", "away"},
+    "lost": {"win", "pct", "home", "away"},
+    "loss": {"win", "pct", "home", "away"},
+    "record": {"win", "pct"},
+    "percentage": {"pct"},
+    "born": {"birth", "date"},
+    "birthday": {"birth"},
+    "age": {"birth", "date"},
+    "old": {"birth", "date"},
+    "rookie": {"start", "year", "date"},
+    "first": {"start", "year", "date"},
+    "year": {"year", "date"},
+    "calendar": {"date"},
+    "when": {"date"},
+    "day": {"date"},
+    "month": {"date"},
+    "playoff": {"regular"},
+    "average": {"avg"},
+    "avg": {"avg"},
+    "mean": {"avg"},
+    "minute": {"minute"},
+    "match": {"game"},
+    "opponent": {"home", "away"},
+    "against": {"home", "away"},
+    "who": {"player"},
+    "rebounding": {"rebound"},
+    "blocked": {"block"},
+}
+
+YEAR_PATTERN = re.compile(r"^(19|20)\d\d$")
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class SchemaSelection(BaseModel):
+    """Part of the database relevant to a question, with the number of prompt tokens saved by leaving the rest out."""
+
+    tables: list[str]
+    description: str
+    num_tokens: int
+    full_num_tokens: int
+
+    @computed_field
+    def saved_num_tokens(self) -> int:
+        return self.full_num_tokens - self.num_tokens
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def estimate_num_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text, without depending on the tokenizer of a given LLM."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def stem(word: str) -> str:
+    """Crude stemming of a lowercase word, removing the plural mark."""
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word  # noqa: PLR2004
+
+
+def tokenize_identifier(identifier: str) -> set[str]:
+    """Split a table or column name into its stemmed words."""
+    return {stem(token) for token in identifier.lower().split("_") if token}
+
+
+def tokenize_question(question: str, entity_kinds: Iterable[str] = ()) -> set[str]:
+    """
+    Get the stemmed words of a question, expanded with their synonyms in the schema.
+
+    Years refer to seasons and dates. The kinds of the entities named in the question (e.g. "player") are added.
+    """
+    tokens = set(entity_kinds)
+    for word in re.findall(r"[a-z0-9]+", question.lower()):
+        token = stem(word)
+        tokens.add(token)
+        tokens.update(SYNONYMS.get(word, ()), SYNONYMS.get(token, ()))
+        if YEAR_PATTERN.match(word):
+            tokens.update(("season", "year", "date"))
+    return tokens
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Index
+
+
+class SchemaIndex:
+    """
+    Lexical index of the tables and columns names of a database, built once.
+
+    A table is selected when a question contains all the words of its name, or all the specific words of one of
+    its columns (e.g. "rebounds" for `total_rebounds`). The tables referenced by the `*_id` columns of the selected
+    tables are added, and so are the tables joining selected tables which are not connected otherwise. Tables only
+    kept for their keys are reduced to their key and name columns.
+    """
+
+    def __init__(self, tables_columns: dict[str, list[tuple[str, str]]]) -> None:
+        self.tables_columns = tables_columns
+        self.tables_tokens = {table: tokenize_identifier(table) for table in tables_columns}
+        generic_tokens = GENERIC_COLUMN_TOKENS.union(*self.tables_tokens.values())
+        self.columns_tokens = {
+            table: {column: tokenize_identifier(column) - generic_tokens for column, _ in columns}
+            for table, columns in tables_columns.items()
+        }
+        self.foreign_keys = {table: self._find_foreign_keys(table) for table in tables_columns}
+
+    def _find_foreign_keys(self, table: str) -> dict[str, str]:
+        """Find the table referenced by each `*_id` column of a table, e.g. `home_team_id` references `team`."""
+        referenceable_tables = [t for t, columns in self.tables_columns.items() if "id" in {c for c, _ in columns}]
+        foreign_keys = {}
+        for column, _ in self.tables_columns[table]:
+            if not column.endswith("_id"):
+                continue
+            words = column.removesuffix("_id").split("_")
+            for i in range(len(words)):
+                prefix = "_".join(words[i:])
+                referenced_tables = [t for t in referenceable_tables if t == prefix or t.startswith(f"{prefix}_")]
+                if len(referenced_tables) == 1:
+                    foreign_keys[column] = referenced_tables[0]
+                    break
+        return foreign_keys
+
+    def match_tables(self, question_tokens: set[str]) -> set[str]:
+        """Find the tables whose name or one of its columns is mentioned by a question."""
+        return {
+            table
+            for table, table_tokens in self.tables_tokens.items()
+            if table_tokens <= question_tokens
+            or any(
+                column_tokens and column_tokens <= question_tokens
+                for column_tokens in self.columns_tokens[table].values()
+            )
+        }
+
+    def close_over_joins(self, tables: set[str]) -> set[str]:
+        """Add the tables referenced by the given ones, and the tables joining the ones which are not connected."""
+        tables = self._add_referenced_tables(tables)
+        components = self._get_connected_components(tables)
+        if len(components) > 1:
+            table_to_component = {table: i for i, component in enumerate(components) for table in component}
+            joining_tables = {
+                table
+                for table, foreign_keys in self.foreign_keys.items()
+                if table not in tables
+                and len({table_to_component[t] for t in foreign_keys.values() if t in table_to_component}) > 1
+            }
+            tables = self._add_referenced_tables(tables | joining_tables)
+        return tables
+
+    def _add_referenced_tables(self, tables: set[str]) -> set[str]:
+        tables = set(tables)
+        to_visit = list(tables)
+        while to_visit:
+            for referenced_table in self.foreign_keys[to_visit.pop()].values():
+                if referenced_table not in tables:
+                    tables.add(referenced_table)
+                    to_visit.append(referenced_table)
+        return tables
+
+    def _get_connected_components(self, tables: set[str]) -> list[set[str]]:
+        components: list[set[str]] = []
+        for table in sorted(tables):
+            linked_tables = {t for t in self.foreign_keys[table].values() if t in tables} | {
+                t for t in tables if table in self.foreign_keys[t].values()
+            }
+            merged_components = [c for c in components if c & (linked_tables | {table})]
+            components = [c for c in components if c not in merged_components]
+            components.append({table}.union(linked_tables, *merged_components))
+        return components
+
+    def select(self, question: str, entity_kinds: Iterable[str] = ()) -> dict[str, list[tuple[str, str]]]:
+        """Select the tables and columns relevant to a question. The whole schema is returned if none is found."""
+        question_tokens = tokenize_question(question, entity_kinds)
+        matched_tables = self.match_tables(question_tokens)
+        if not matched_tables:
+            return self.tables_columns
+
+        selected_tables = self.close_over_joins(matched_tables)
+        return {
+            table: [
+                (column, data_type)
+                for column, data_type in columns
+                if table in matched_tables or column == "id" or column.endswith(("_id", "_name"))
+            ]
+            for table, columns in self.tables_columns.items()
+            if table in selected_tables
+        }
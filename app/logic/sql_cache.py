@@ -0,0 +1,293 @@
+"""Cache of validated SQL queries, looked up by canonicalized questions so that paraphrases hit the same entry."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.logic.gazetteer import NameSpan
+from app.logic.schema_selection import stem
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+# Words which don't change the SQL query answering a question
+STOP_WORDS = {
+    *("a", "an", "the", "of", "in", "on", "at", "for", "by", "to", "did", "does", "do", "is", "are", "was", "were"),
+    *("what", "which", "how", "please", "me", "give", "show", "tell", "retrieve", "return", "get", "find", "list"),
+    *("can", "you", "could", "would", "i", "want", "know", "s", "has", "have", "had", "there", "that", "be"),
+}
+
+# Words with the same meaning in a question, mapped to a single one
+SYNONYMS = {"maximum": "max", "highest": "max", "minimum": "min", "lowest": "min", "average": "avg", "mean": "avg"}
+
+# Words changing the SQL query of a question whatever the similarity of the rest of the question: aggregations and their
+# direction, home or away, negations, comparisons and kinds of games. An approximate hit must have the same ones
+MEANING_WORDS = {
+    *("max", "min", "avg", "most", "least", "fewest", "top", "bottom", "best", "worst", "first", "last", "total"),
+    *("sum", "count", "home", "away", "not", "no", "never", "without", "except", "more", "less", "fewer", "greater"),
+    *("above", "below", "over", "under", "than", "before", "after", "win", "won", "wins", "lose", "lost", "losses"),
+    *("regular", "playoff", "playoffs", "only"),
+}
+
+NUMBER_PATTERN = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+TOKEN_PATTERN = re.compile(r"<\w+>|[a-z]+|\d+")
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class CanonicalQuestion(BaseModel):
+    """
+    A question reduced to the words which matter, its named entities and numbers being replaced with slots.
+
+    E.g. "How many points did LeBron James score in 2018?" gives the text "many point <player_0> score <number_0>",
+    with the slots {"player_0": "LeBron James", "number_0": "2018"}.
+    """
+
+    text: str
+    slots: dict[str, str]
+
+    @property
+    def tokens(self) -> set[str]:
+        return set(self.text.split())
+
+
+class SqlCacheEntry(BaseModel):
+    """A validated SQL query, whose slot values are replaced with placeholders to be reused by similar questions."""
+
+    canonical_question: str
+    slots_names: list[str]
+    sql_template: str
+    fixed_slots: dict[str, str]  # Slot values which couldn't be located in the SQL query: a hit requires the same ones
+
+
+class SqlCacheMatch(BaseModel):
+    """A SQL query retrieved from the cache, with the similarity between the question and the cached one."""
+
+    sql_query: str
+    cached_question: str
+    similarity: float
+
+
+class SqlCacheStats(BaseModel):
+    """Hit and miss counters of the SQL queries cache."""
+
+    exact_hits: int = 0
+    approximate_hits: int = 0
+    misses: int = 0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def canonicalize_question(question: str, spans: list[NameSpan]) -> CanonicalQuestion:
+    """Canonicalize a question whose names, located by the given spans, were resolved to the ones of the db."""
+    slots: dict[str, str] = {}
+    slots_counts: dict[str, int] = defaultdict(int)
+    parts = []
+    position = 0
+    for span in sorted(spans, key=lambda s: s.start):
+        slot = f"{span.kind}_{slots_counts[span.kind]}"
+        slots_counts[span.kind] += 1
+        slots[slot] = span.name
+        parts.extend((question[position : span.start], f" <{slot}> "))
+        position = span.end
+    parts.append(question[position:])
+
+    def replace_number(match: re.Match) -> str:
+        slot = f"number_{slots_counts['number']}"
+        slots_counts["number"] += 1
+        slots[slot] = match.group()
+        return f" <{slot}> "
+
+    text = NUMBER_PATTERN.sub(replace_number, "".join(parts).lower())
+    tokens = [
+        token if token.startswith("<") else stem(SYNONYMS.get(token, token)) for token in TOKEN_PATTERN.findall(text)
+    ]
+    return CanonicalQuestion(text=" ".join(t for t in tokens if t not in STOP_WORDS), slots=slots)
+
+
+def get_slot_placeholder(slot: str) -> str:
+    return f"<<{slot}>>"
+
+
+def templatize_sql_query(sql_query: str, slots: dict[str, str]) -> tuple[str, dict[str, str]]:
+    """
+    Replace the slot values found in a SQL query with placeholders.
+
+    A value is only replaced when it is found once and is not shared with another slot. The other values are returned
+    as fixed: the query can't be reused with different ones.
+    """
+    fixed_slots = {}
+    values_counts = defaultdict(int)
+    for value in slots.values():
+        values_counts[value] += 1
+
+    for slot, value in slots.items():
+        pattern = re.compile(rf"(?<![\w.]){re.escape(value)}(?![\w.])")
+        if values_counts[value] == 1 and len(pattern.findall(sql_query)) == 1:
+            sql_query = pattern.sub(lambda _, slot=slot: get_slot_placeholder(slot), sql_query)
+        else:
+            fixed_slots[slot] = value
+    return sql_query, fixed_slots
+
+
+def fill_sql_template(sql_template: str, slots: dict[str, str]) -> str:
+    """
+    Replace the placeholders of a SQL query template with the slot values. Quotes are escaped in the values filling a
+    string literal, e.g. "Shaquille O'Neal" in `player_name = '<<player_0>>'`.
+    """
+    for slot, value in slots.items():
+        escaped_value = value.replace("'", "''")
+
+        def replace_placeholder(match: re.Match, value: str = value, escaped_value: str = escaped_value) -> str:
+            is_in_string_literal = match.string.count("'", 0, match.start()) % 2 == 1
+            return escaped_value if is_in_string_literal else value
+
+        sql_template = re.sub(re.escape(get_slot_placeholder(slot)), replace_placeholder, sql_template)
+    return sql_template
+
+
+def get_fixed_slots_key(fixed_slots: dict[str, str]) -> str:
+    return json.dumps(fixed_slots, sort_keys=True)
+
+
+@functools.cache
+def get_meaning_tokens() -> frozenset[str]:
+    """Tokens of the words changing the SQL query of a question, as canonicalized, see `MEANING_WORDS`."""
+    return frozenset(stem(SYNONYMS.get(word, word)) for word in MEANING_WORDS)
+
+
+def jaccard_similarity(tokens: set[str], other_tokens: set[str]) -> float:
+    return len(tokens & other_tokens) / len(tokens | other_tokens) if tokens or other_tokens else 1.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Cache
+
+
+class SemanticSqlCache:
+    """
+    Cache of validated SQL queries, persisted in a SQLite file.
+
+    A question hits an entry if their canonical forms are equal, or if they have the same slots and the Jaccard
+    similarity of their tokens is at least `min_similarity`. Near-duplicate candidates are found with an inverted
+    index of the tokens of the cached questions. An approximate hit requires the same words changing the meaning of
+    the question (e.g. "highest" and "lowest", or "home" and "away", are not near duplicates, see `MEANING_WORDS`).
+    Names and numbers are slots: the SQL query is filled with the question's ones, or requires the same fixed ones.
+    """
+
+    def __init__(self, path: Optional[Path], min_similarity: float) -> None:
+        self.min_similarity = min_similarity
+        self.stats = SqlCacheStats()
+
+        self._lock = threading.Lock()
+        # Questions with the same canonical form may have entries with different fixed slots
+        self._entries: dict[str, list[SqlCacheEntry]] = defaultdict(list)
+        self._token_to_questions: dict[str, set[str]] = defaultdict(set)
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "create table if not exists sql_query ("
+                "canonical_question text not null, fixed_slots text not null, entry text not null, "
+                "created_at real not null, primary key (canonical_question, fixed_slots))"
+            )
+            self._db.commit()
+            for (entry,) in self._db.execute("select entry from sql_query").fetchall():
+                self._index(SqlCacheEntry.model_validate_json(entry))
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def get(self, question: CanonicalQuestion) -> Optional[SqlCacheMatch]:
+        """Retrieve the SQL query of the same or of the most similar cached question, None if there is none."""
+        with self._lock:
+            for entry in self._entries.get(question.text, ()):
+                if self._is_compatible(entry, question):
+                    self.stats.exact_hits += 1
+                    return self._build_match(entry, question, similarity=1.0)
+
+            tokens = question.tokens
+            meaning_tokens = tokens & get_meaning_tokens()
+            candidates = set().union(*(self._token_to_questions.get(token, ()) for token in tokens))
+            best_similarity, best_entry = 0.0, None
+            for candidate in sorted(candidates):
+                candidate_tokens = set(candidate.split())
+                similarity = jaccard_similarity(tokens, candidate_tokens)
+                if similarity <= best_similarity or candidate_tokens & get_meaning_tokens() != meaning_tokens:
+                    continue
+                compatible_entry = next((e for e in self._entries[candidate] if self._is_compatible(e, question)), None)
+                if compatible_entry is not None:
+                    best_similarity, best_entry = similarity, compatible_entry
+
+            if best_entry is not None and best_similarity >= self.min_similarity:
+                self.stats.approximate_hits += 1
+                return self._build_match(best_entry, question, similarity=best_similarity)
+
+            self.stats.misses += 1
+            return None
+
+    def set(self, question: CanonicalQuestion, sql_query: str) -> None:
+        """Store the validated SQL query of a question."""
+        sql_template, fixed_slots = templatize_sql_query(sql_query, question.slots)
+        entry = SqlCacheEntry(
+            canonical_question=question.text,
+            slots_names=sorted(question.slots),
+            sql_template=sql_template,
+            fixed_slots=fixed_slots,
+        )
+        with self._lock:
+            self._index(entry)
+            if self._db is not None:
+                self._db.execute(
+                    "insert or replace into sql_query values (?, ?, ?, ?)",
+                    (entry.canonical_question, get_fixed_slots_key(fixed_slots), entry.model_dump_json(), time.time()),
+                )
+                self._db.commit()
+        logger.debug(f"Cached SQL query of question '{question.text}', fixed slots: {fixed_slots}")
+
+    def clear(self) -> None:
+        """Remove all the entries of the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._token_to_questions.clear()
+            if self._db is not None:
+                self._db.execute("delete from sql_query")
+                self._db.commit()
+
+    def _index(self, entry: SqlCacheEntry) -> None:
+        entries = self._entries[entry.canonical_question]
+        entries[:] = [e for e in entries if e.fixed_slots != entry.fixed_slots]
+        entries.append(entry)
+        for token in entry.canonical_question.split():
+            self._token_to_questions[token].add(entry.canonical_question)
+
+    @staticmethod
+    def _is_compatible(entry: SqlCacheEntry, question: CanonicalQuestion) -> bool:
+        """Check if the SQL query of an entry can be filled with the slot values of a question."""
+        return entry.slots_names == sorted(question.slots) and all(
+            question.slots[slot] == value for slot, value in entry.fixed_slots.items()
+        )
+
+    @staticmethod
+    def _build_match(entry: SqlCacheEntry, question: CanonicalQuestion, similarity: float) -> SqlCacheMatch:
+        return SqlCacheMatch(
+            sql_query=fill_sql_template(entry.sql_template, question.slots),
+            cached_question=entry.canonical_question,
+            similarity=similarity,
+        )
@@ -0,0 +1,195 @@
+"""
+Library of vetted parameterized SQL queries for the most frequent shapes of questions, e.g. the top players by a stat in
+a season, so that they get their SQL query from a local match, in milliseconds, instead of a LLM call.
+
+A question matches a template only if it is phrased exactly as one of its patterns, once its players and teams names
+(resolved by the NER, see `app.logic.ner_retrieval.replace_names_in_text`) and its season are replaced with slots: any
+other constraint, e.g. "at home", makes the question go to the LLM. Slot values are checked before filling the query:
+stats are mapped to known columns, numbers are parsed and names are db names whose quotes are escaped.
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import functools
+import re
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.logic.gazetteer import NameSpan
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+# Words of the stats of a player in a game, mapped to their `game_boxscore` column
+STAT_COLUMNS = {
+    "point": "points", "points": "points", "rebound": "total_rebounds", "rebounds": "total_rebounds",
+    "total rebounds": "total_rebounds", "assist": "assists", "assists": "assists", "steal": "steals",
+    "steals": "steals", "block": "blocks", "blocks": "blocks", "three point attempts": "three_pts_attempts",
+    "three pointers attempted": "three_pts_attempts", "3 point attempts": "three_pts_attempts",
+    "minutes": "minute_played", "minutes played": "minute_played",
+}  # fmt: skip
+
+# Fragments of the patterns, the longest stat words first so that they win over their prefixes
+PATTERN_FRAGMENTS = {
+    "prefix": r"(?:(?:who|what|which) (?:are|were|is|was|s) |list |show(?: me)? |give me |retrieve |tell me )?",
+    "stat": "(?P<stat>" + "|".join(sorted(STAT_COLUMNS, key=len, reverse=True)) + ")",
+    "average": r"(?P<average>average |avg |mean )?",
+    "per_game": r"(?P<per_game> per game)?",
+    "limit": r"(?P<limit>\d+)",
+    "season": r"<season_(?P<season>\d+)>",
+    "player": "<player>(?: s)?",  # Possessive, e.g. "LeBron James's"
+    "team": "(?:the )?<team>(?: s)?",
+    "verb": r"(?:scored|had|made|recorded|played|got)",
+}
+
+# Seasons are named by their start year, e.g. "the 2022-23 season" or "the season starting in 2022"
+SEASON_PATTERN = re.compile(
+    r"(?:the )?(?:(?P<year>\d{4})(?:-\d{2}(?:\d{2})?)? season"
+    r"|season (?:starting in |whose start year is )?(?P<start_year>\d{4}))"
+)
+NON_WORD_PATTERN = re.compile(r"[^\w<>]+")
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class SqlTemplate(BaseModel):
+    """A vetted SQL query answering an intent, with `{slot}` placeholders, and the patterns of the questions asking."""
+
+    intent: str
+    patterns: list[str]  # Regular expressions with `{fragment}` placeholders, see `PATTERN_FRAGMENTS`
+    sql: str
+
+
+class SqlTemplateMatch(BaseModel):
+    """A question matching a SQL template, with its slot values and the filled SQL query."""
+
+    intent: str
+    slots: dict[str, str]
+    sql_query: str
+
+
+class SqlTemplateStats(BaseModel):
+    """Counters of the questions matching a SQL template, or not."""
+
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Templates
+
+SQL_TEMPLATES = [
+    SqlTemplate(
+        intent="top_players_by_stat_in_season",
+        patterns=[
+            r"{prefix}(?:the )?top {limit} players (?:by|in|for) {average}{stat}{per_game} (?:in|during) {season}",
+            r"{prefix}(?:the )?{limit} players (?:with the most|who {verb} the most) {average}{stat}{per_game} "
+            r"(?:in|during) {season}",
+        ],
+        sql="""select p.player_name, round({aggregation}(gb.{stat}), 1) as {aggregation}_{stat}
+from game_boxscore gb
+inner join player p on p.id = gb.player_id
+inner join game_summary gs on gs.id = gb.game_id
+inner join season s on s.id = gs.season_id
+where s.start_year = {season}
+group by p.id, p.player_name
+order by {aggregation}_{stat} desc, p.player_name
+limit {limit}""",
+    ),
+    SqlTemplate(
+        intent="player_career_high_in_stat",
+        patterns=[
+            r"{prefix}{player} career high in {stat}",
+            r"{prefix}(?:the )?career high (?:in|of) {stat} (?:of|for|by) {player}",
+            r"{prefix}(?:the )?(?:highest|maximum|max|most) (?:number of )?{stat}(?: {verb})? by {player} in a "
+            r"(?:single )?game",
+            r"{prefix}(?:the )?(?:highest|maximum|max|most) (?:number of )?{stat} {player} (?:has |ever )?{verb} in a "
+            r"(?:single )?game",
+        ],
+        sql="""select max(gb.{stat}) as max_{stat}
+from game_boxscore gb
+inner join player p on p.id = gb.player_id
+where p.player_name = '{player}'""",
+    ),
+    SqlTemplate(
+        intent="team_record_in_season",
+        patterns=[
+            r"{prefix}(?:the )?(?:win loss )?record of {team} (?:in|during) {season}",
+            r"{prefix}{team} (?:win loss )?record (?:in|during) {season}",
+            r"how many games did {team} win and lose (?:in|during) {season}",
+        ],
+        sql="""with team_games as (
+    select (gs.home_team_id = t.id) = (gs.home_team_points > gs.away_team_points) as is_win
+    from game_summary gs
+    inner join team t on t.id in (gs.home_team_id, gs.away_team_id)
+    inner join season s on s.id = gs.season_id
+    where t.team_name = '{team}' and s.start_year = {season}
+)
+select count(*) filter (where is_win) as nb_wins, count(*) filter (where not is_win) as nb_losses
+from team_games""",
+    ),
+]
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+@functools.cache
+def get_sql_template_stats() -> SqlTemplateStats:
+    """Retrieve the process-wide counters of the SQL templates matches."""
+    return SqlTemplateStats()
+
+
+@functools.cache
+def compile_templates_patterns() -> list[tuple[SqlTemplate, re.Pattern]]:
+    """Compile the patterns of the SQL templates, their fragments being filled in."""
+    return [
+        (template, re.compile(pattern.format(**PATTERN_FRAGMENTS)))
+        for template in SQL_TEMPLATES
+        for pattern in template.patterns
+    ]
+
+
+def normalize_template_question(question: str, spans: list[NameSpan]) -> str:
+    """
+    Normalize a question to be matched with the templates patterns: its players and teams names are replaced with
+    `<player>` and `<team>`, its season with `<season_{start year}>`, and it is lowercased without punctuation.
+    """
+    text = question
+    for span in sorted(spans, key=lambda s: s.start, reverse=True):
+        text = f"{text[: span.start]} <{span.kind}> {text[span.end :]}"
+    text = SEASON_PATTERN.sub(lambda m: f" <season_{m['year'] or m['start_year']}> ", text.lower())
+    return " ".join(NON_WORD_PATTERN.sub(" ", text).split())
+
+
+def fill_template(template: SqlTemplate, match: re.Match, spans: list[NameSpan]) -> SqlTemplateMatch:
+    """Fill the SQL query of a template with the slot values of a question matching one of its patterns."""
+    groups = {name: value for name, value in match.groupdict().items() if value is not None}
+    slots = {name: str(int(groups[name])) for name in ("limit", "season") if name in groups}
+    if "stat" in groups:
+        slots["stat"] = STAT_COLUMNS[groups["stat"]]
+    if "average" in match.re.groupindex:
+        slots["aggregation"] = "avg" if "average" in groups or "per_game" in groups else "sum"
+    for span in spans:
+        slots.setdefault(span.kind, span.name.replace("'", "''"))
+    return SqlTemplateMatch(intent=template.intent, slots=slots, sql_query=template.sql.format(**slots))
+
+
+def match_sql_template(question: str, spans: list[NameSpan]) -> Optional[SqlTemplateMatch]:
+    """
+    Match a question with the SQL templates, given the spans of its players and teams names. None if it matches none.
+    """
+    normalized_question = normalize_template_question(question, spans)
+    for template, pattern in compile_templates_patterns():
+        match = pattern.fullmatch(normalized_question)
+        if match is not None:
+            return fill_template(template, match, spans)
+    return None
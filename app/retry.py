@@ -0,0 +1,297 @@
+"""Scheduling of calls to rate limited APIs: retries with backoff, rate limiting and circuit breaker."""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+import random
+import threading
+import time
+from collections.abc import Awaitable
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Literal, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Custom Exceptions
+
+
+class CircuitOpenError(Exception):
+    """Exception raised when a call is rejected because the circuit breaker of the API is open."""
+
+    pass
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class RetryPolicy(BaseModel):
+    """How many times and how long to wait before retrying a failed call."""
+
+    max_attempts: int = 3
+    base_delay_seconds: float = 1.0
+    max_delay_seconds: float = 30.0
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter, to avoid retrying all the failed calls at the same time."""
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2**attempt))  # noqa: S311
+
+
+class RetrySchedulerStats(BaseModel):
+    """Counters of a retry scheduler."""
+
+    calls: int = 0
+    attempts: int = 0
+    retries: int = 0
+    failures: int = 0
+    circuit_rejections: int = 0
+    throttled_seconds: float = 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def get_retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Get the delay requested by the `Retry-After` header of the HTTP response attached to an exception, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is None:
+        return None
+
+    if (retry_after_ms := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """Check if a call which raised an exception may succeed when retried. Client errors (e.g. 401, 404) won't."""
+    status_code = getattr(exc, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in (408, 409, 429) or status_code >= 500
+    return True
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Scheduling
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate_per_second` calls in average, with bursts of up to `capacity` calls."""
+
+    def __init__(self, rate_per_second: float, capacity: int) -> None:
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it. Reservations are served in order."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate_per_second)
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an API is down.
+
+    The circuit opens after `failure_threshold` consecutive failures, rejecting calls during `reset_timeout_seconds`.
+    A single trial call is then let through: the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout_seconds:
+            return "open"
+        return "half_open"
+
+    def allow_call(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def release_trial(self) -> None:
+        """Let a new trial call through, the current one being interrupted (e.g. cancelled) before telling anything."""
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._trial_in_progress or self._consecutive_failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_progress:
+                    logger.warning(f"Circuit opened after {self._consecutive_failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_in_progress = False
+
+
+class RetryScheduler:
+    """
+    Run calls to an API, retrying the failed ones.
+
+    Before each attempt, the scheduler fails fast if the circuit breaker is open, then waits for a token of the rate
+    limiter and for the end of any `Retry-After` delay requested by the API. Failed attempts are retried after an
+    exponential backoff with jitter, or after the `Retry-After` delay when the API gives one. A single scheduler is
+    meant to be shared by all the calls to an API, so the throttling of one call holds the others back.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        token_bucket: Optional[TokenBucket] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.policy = policy
+        self.token_bucket = token_bucket
+        self.circuit_breaker = circuit_breaker
+        self.stats = RetrySchedulerStats()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def call(self, func: Callable[..., Any], *args: Any, max_attempts: Optional[int] = None, **kwargs: Any) -> Any:
+        """Call a function until it succeeds, raising its last exception when it can't be retried anymore."""
+        max_attempts = max_attempts or self.policy.max_attempts
+        for attempt in range(max_attempts):
+            wait = self.acquire_attempt(attempt)
+            try:
+                time.sleep(wait)
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self.record_failure(e, attempt, max_attempts)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            except BaseException:
+                self.release_attempt()
+                raise
+            else:
+                self.record_success()
+                return result
+
+        return None  # Unreachable, the last failed attempt raises
+
+    async def acall(
+        self, func: Callable[..., Awaitable[Any]], *args: Any, max_attempts: Optional[int] = None, **kwargs: Any
+    ) -> Any:
+        """Async version of `call`, for coroutine functions."""
+        max_attempts = max_attempts or self.policy.max_attempts
+        for attempt in range(max_attempts):
+            wait = self.acquire_attempt(attempt)
+            try:
+                await asyncio.sleep(wait)
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self.record_failure(e, attempt, max_attempts)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            except BaseException:  # E.g. the call is cancelled
+                self.release_attempt()
+                raise
+            else:
+                self.record_success()
+                return result
+
+        return None  # Unreachable, the last failed attempt raises
+
+    def acquire_attempt(self, attempt: int) -> float:
+        """
+        Register a new attempt (the first one of a call being 0) and return how long to wait before making it.
+
+        Raises a `CircuitOpenError` if the API is considered down.
+        """
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_call():
+            self._count("circuit_rejections")
+            error_msg = "Circuit breaker is open, the API is considered unavailable"
+            raise CircuitOpenError(error_msg)
+
+        wait = self.token_bucket.reserve() if self.token_bucket is not None else 0.0
+        with self._lock:
+            wait = max(wait, self._blocked_until - time.monotonic())
+            self.stats.calls += attempt == 0
+            self.stats.attempts += 1
+            self.stats.throttled_seconds += max(0.0, wait)
+        return max(0.0, wait)
+
+    def record_success(self) -> None:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+
+    def release_attempt(self) -> None:
+        """Register an attempt interrupted (e.g. cancelled) before its outcome, which tells nothing of the API."""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.release_trial()
+
+    def record_failure(self, exc: Exception, attempt: int, max_attempts: int) -> Optional[float]:
+        """Register a failed attempt and return the delay before retrying it, None if it must not be retried."""
+        logger.warning(f"Attempt {attempt + 1}/{max_attempts} failed: {exc}")
+        retryable = is_retryable_error(exc)
+        if self.circuit_breaker is not None:
+            # A client error (e.g. bad request) still shows that the API is up
+            if retryable:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+        retry_after = get_retry_after_seconds(exc)
+        if retry_after is not None:
+            # The API asks every client to slow down, not only this call
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+        if not retryable or attempt >= max_attempts - 1:
+            self._count("failures")
+            return None
+        if retry_after is not None and retry_after > self.policy.max_delay_seconds:
+            logger.warning(f"Retry-After of {retry_after:.0f}s exceeds the maximum delay, not retrying")
+            self._count("failures")
+            return None
+
+        self._count("retries")
+        return retry_after if retry_after is not None else self.policy.backoff_delay(attempt)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
@@ -0,0 +1,124 @@
+"""
+Single-flight deduplication of identical calls: concurrent calls with the same key wait for a single shared execution
+instead of running it again, e.g. when many sessions ask the same trending question within seconds.
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+import concurrent.futures
+import threading
+from collections.abc import Awaitable
+from typing import Any, Callable
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.tracing import set_span_attributes
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class SingleFlightStats(BaseModel):
+    """Counters of a single-flight group."""
+
+    calls: int = 0
+    executions: int = 0  # Calls which ran the function
+    coalesced: int = 0  # Calls which got the result (or the exception) of a call already in flight
+
+    @property
+    def coalesced_rate(self) -> float:
+        return self.coalesced / self.calls if self.calls else 0.0
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Single flight
+
+
+class SingleFlight:
+    """
+    Group of calls deduplicated by key, across threads and event loops.
+
+    The first call of a key (the leader) runs the function, the calls of the same key made while it is in flight wait
+    for it and get its result, or raise its exception. The key is released once the leader is done, so the next calls
+    run the function again: results are not cached. If the leader is cancelled (e.g. a speculative task), the calls
+    waiting for it don't fail, one of them runs the function instead.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name  # What is called, e.g. "SQL queries"
+        self.stats = SingleFlightStats()
+        self._in_flight: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def call(self, key: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call a function, unless a call of the same key is in flight, in which case its result is returned."""
+        self._count("calls")
+        while True:
+            future, is_leader = self._join(key)
+            if is_leader:
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    self._release(key)
+                future.set_result(result)
+                return result
+
+            concurrent.futures.wait([future])
+            if not future.cancelled():
+                self._record_coalesced()
+                return future.result()
+
+    async def acall(self, key: str, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Async version of `call`, for coroutine functions. Waiting calls don't block their event loop."""
+        self._count("calls")
+        while True:
+            future, is_leader = self._join(key)
+            if is_leader:
+                try:
+                    result = await func(*args, **kwargs)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    self._release(key)
+                future.set_result(result)
+                return result
+
+            # Unlike awaiting it, waiting for the shared future doesn't cancel it if this call is cancelled
+            waiter = asyncio.wrap_future(future)
+            await asyncio.wait([waiter])
+            if not waiter.cancelled():
+                self._record_coalesced()
+                return waiter.result()
+
+    def _join(self, key: str) -> tuple[concurrent.futures.Future, bool]:
+        """Get the future of the call of a key in flight, or register a new one. Returns whether it is a new one."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, False
+            future = self._in_flight[key] = concurrent.futures.Future()
+            self.stats.executions += 1
+            return future, True
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            del self._in_flight[key]
+
+    def _record_coalesced(self) -> None:
+        self._count("coalesced")
+        logger.debug(f"{self.name.capitalize()}: call coalesced with an identical call in flight")
+        set_span_attributes({"single_flight.coalesced": True})
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
@@ -0,0 +1,260 @@
+"""
+Lightweight tracing of the requests: the stages of a request are timed as nested spans, with their attributes (e.g. LLM
+tokens and retries, rows of a result), and exported as JSON lines in the OpenTelemetry (OTLP JSON) format.
+
+Spans are only recorded within a trace started with `start_trace`, elsewhere they are no-ops. The current trace and
+span are held in context variables, so that spans are nested across asyncio tasks and worker threads (`to_thread`).
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Literal, Optional, TypeVar
+
+from loguru import logger
+from pydantic import BaseModel
+
+from app.configuration import get_config
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+SERVICE_NAME = "nba-insights-engine"
+
+OTLP_SPAN_KIND_INTERNAL = 1
+OTLP_STATUS_CODES = {"ok": 1, "error": 2}
+
+CallableT = TypeVar("CallableT", bound=Callable[..., Any])
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class Span(BaseModel):
+    """A timed stage of a request, with its attributes. Times are in nanoseconds since the epoch, as in OTLP."""
+
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str] = None
+    name: str
+    start_time_unix_nano: int
+    end_time_unix_nano: Optional[int] = None  # None until the stage ends
+    attributes: dict[str, Any] = {}
+    status: Literal["ok", "error"] = "ok"
+    status_message: Optional[str] = None
+
+    @property
+    def duration_seconds(self) -> Optional[float]:
+        if self.end_time_unix_nano is None:
+            return None
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e9
+
+    def to_otlp_json(self) -> dict[str, Any]:
+        """Convert the span to the OTLP JSON format, e.g. for an OpenTelemetry collector `otlpjsonfile` receiver."""
+        otlp_span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": OTLP_SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_time_unix_nano),
+            "endTimeUnixNano": str(self.end_time_unix_nano or self.start_time_unix_nano),
+            "attributes": [{"key": key, "value": to_otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": OTLP_STATUS_CODES[self.status]},
+        }
+        if self.status_message is not None:
+            otlp_span["status"]["message"] = self.status_message
+        return otlp_span
+
+
+class Trace:
+    """The spans of a request, in their start order. Spans can be added from several threads."""
+
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    def to_otlp_json(self) -> dict[str, Any]:
+        """Convert the trace to an OTLP JSON export request, as written by the OpenTelemetry file exporters."""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": to_otlp_value(SERVICE_NAME)}]},
+                    "scopeSpans": [
+                        {"scope": {"name": __name__}, "spans": [span.to_otlp_json() for span in self.spans]}
+                    ],
+                }
+            ]
+        }
+
+    def to_waterfall_rows(self) -> list[dict[str, Any]]:
+        """
+        Describe each span as a row of a latency waterfall chart: its start and end relative to the start of the
+        trace, in milliseconds, and its label indented by its depth.
+        """
+        depths: dict[str, int] = {}
+        rows = []
+        for index, span in enumerate(self.spans, start=1):
+            depth = depths.get(span.parent_span_id, -1) + 1
+            depths[span.span_id] = depth
+            end_time_unix_nano = span.end_time_unix_nano or span.start_time_unix_nano
+            rows.append(
+                {
+                    "label": f"{index:>2}. {'  ' * depth}{span.name}",
+                    "start_ms": (span.start_time_unix_nano - self.root.start_time_unix_nano) / 1e6,
+                    "end_ms": (end_time_unix_nano - self.root.start_time_unix_nano) / 1e6,
+                    "duration_ms": (end_time_unix_nano - span.start_time_unix_nano) / 1e6,
+                    "status": span.status,
+                    "attributes": json.dumps(span.attributes, default=str),
+                }
+            )
+        return rows
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Context
+
+CURRENT_TRACE: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+EXPORT_LOCK = threading.Lock()  # Traces of concurrent requests are appended to the same file
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def to_otlp_value(value: Any) -> dict[str, Any]:
+    """Convert an attribute value to an OTLP `AnyValue`, values of other types than bool, int and float as strings."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # 64 bits integers are strings in OTLP JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+@contextmanager
+def span(name: str, attributes: Optional[dict[str, Any]] = None) -> Iterator[Optional[Span]]:
+    """
+    Time a stage of the current request as a child of the current span. The span is marked as failed if the stage
+    raises. Outside of a trace, nothing is recorded and None is yielded.
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        yield None
+        return
+
+    parent_span = CURRENT_SPAN.get()
+    current_span = Span(
+        trace_id=trace.trace_id,
+        span_id=os.urandom(8).hex(),
+        parent_span_id=parent_span.span_id if parent_span is not None else None,
+        name=name,
+        start_time_unix_nano=time.time_ns(),
+        attributes=attributes or {},
+    )
+    trace.add_span(current_span)
+    token = CURRENT_SPAN.set(current_span)
+    try:
+        yield current_span
+    except GeneratorExit:
+        raise  # A generator closed early, e.g. a LLM stream stopped once the SQL query is complete
+    except BaseException as e:
+        current_span.status, current_span.status_message = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current_span.end_time_unix_nano = time.time_ns()
+        # A generator closed from another context than its own (e.g. garbage collected) can't reset the latter
+        with suppress(ValueError):
+            CURRENT_SPAN.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, attributes: Optional[dict[str, Any]] = None) -> Iterator[Trace]:
+    """
+    Trace a request, its stages being recorded as spans of the trace. The trace is exported to the configured JSONL
+    file once the request ends. Within a trace, e.g. a question answered by a batch, it is only a span of the latter.
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        with span(name, attributes):
+            yield trace
+        return
+
+    trace = Trace()
+    token = CURRENT_TRACE.set(trace)
+    try:
+        with span(name, attributes):
+            yield trace
+    finally:
+        CURRENT_TRACE.reset(token)
+        trace_export_path = get_config().trace_export_path
+        if trace_export_path is not None:
+            export_trace(trace, trace_export_path)
+
+
+def traced(name: str) -> Callable[[CallableT], CallableT]:
+    """Decorator timing each call of a function, sync or async, as a span named `name`."""
+
+    def decorator(function: CallableT) -> CallableT:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def set_span_attributes(attributes: dict[str, Any]) -> None:
+    """Set attributes of the current span, e.g. the number of rows of a result. Nothing is done outside of a trace."""
+    current_span = CURRENT_SPAN.get()
+    if current_span is not None:
+        current_span.attributes.update(attributes)
+
+
+def increment_span_attribute(key: str, value: int = 1) -> None:
+    """Increment a counter attribute of the current span, e.g. the number of attempts of a LLM query."""
+    current_span = CURRENT_SPAN.get()
+    if current_span is not None:
+        current_span.attributes[key] = current_span.attributes.get(key, 0) + value
+
+
+def export_trace(trace: Trace, path: Path) -> None:
+    """Append a trace to a JSONL file, as a line in the OTLP JSON format. Export errors are logged, not raised."""
+    line = json.dumps(trace.to_otlp_json()) + "\n"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with EXPORT_LOCK, path.open("a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning(f"Failed to export trace {trace.trace_id} to {path}: {e}")
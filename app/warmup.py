@@ -0,0 +1,153 @@
+"""
+Warm-up of a process before it answers questions: the first questions would otherwise page in the database from disk
+and build the names indexes and the schema description.
+
+It can also be run in a separate process with `python -m app.warmup`, which warms the page cache of the OS up and
+exits with an error if the database couldn't be read.
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import functools
+import json
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+import duckdb
+from loguru import logger
+from pydantic import BaseModel
+
+from app.configuration import get_config
+from app.db.connection import get_db_fingerprint
+from app.db.dao import scan_table, sql_to_arrow
+from app.db.query_guard import SqlExecutionError
+from app.logic.ner_retrieval import get_gazetteer, get_players_index, get_teams_index
+from app.logic.question_to_sql import get_db_description, load_schema_index, load_tables_columns
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class WarmupReport(BaseModel):
+    """Outcome of the warm-up of a process."""
+
+    ready: bool = False  # Whether the process is warm: the database was read and the indexes built
+    error: Optional[str] = None
+    duration_seconds: float = 0.0
+    steps_seconds: dict[str, float] = {}
+    num_scanned_rows: int = 0
+    num_queries: int = 0
+    num_failed_queries: int = 0  # Representative queries which failed, they don't prevent readiness
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def parse_hot_columns(hot_columns: list[str], tables_columns: dict[str, list[tuple[str, str]]]) -> dict[str, list[str]]:
+    """Group hot columns by table. A table name alone stands for all its columns. Unknown ones are skipped."""
+    columns_by_table: dict[str, list[str]] = {}
+    for hot_column in hot_columns:
+        table_name, _, column_name = hot_column.partition(".")
+        known_column_names = [name for name, _ in tables_columns.get(table_name, [])]
+        column_names = [column_name] if column_name else known_column_names
+        if not column_names or not set(column_names).issubset(known_column_names):
+            logger.warning(f"Hot column {hot_column} not found in the database, it isn't warmed up")
+            continue
+        selected_column_names = columns_by_table.setdefault(table_name, [])
+        selected_column_names.extend(name for name in column_names if name not in selected_column_names)
+    return columns_by_table
+
+
+def load_warmup_queries(path: Optional[Path]) -> list[str]:
+    """Load the representative SQL queries of a JSON list of objects with a `sql_query`, e.g. a benchmark dataset."""
+    if path is None:
+        return []
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Failed to load warm-up queries from {path}: {e}")
+        return []
+    return [entry["sql_query"] for entry in entries if isinstance(entry, dict) and entry.get("sql_query")]
+
+
+@contextmanager
+def timed_step(report: WarmupReport, step_name: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    yield
+    report.steps_seconds[step_name] = time.perf_counter() - start_time
+
+
+@functools.cache
+def warm_up() -> WarmupReport:
+    """
+    Warm the process up, once: read the hot columns of the database, build the indexes and the schema description, and
+    run the representative queries. Once warm, the report is written to the configured readiness file.
+    """
+    config = get_config()
+    report = WarmupReport()
+    start_time = time.perf_counter()
+    if config.warmup_ready_path is not None:
+        config.warmup_ready_path.unlink(missing_ok=True)
+
+    try:
+        with timed_step(report, "scan_hot_columns"):
+            tables_columns = load_tables_columns(get_db_fingerprint())
+            for table_name, column_names in parse_hot_columns(config.warmup_hot_columns, tables_columns).items():
+                report.num_scanned_rows += scan_table(table_name, column_names)
+
+        with timed_step(report, "build_indexes"):
+            get_players_index()
+            get_teams_index()
+            get_gazetteer()
+            get_db_description()
+            load_schema_index(get_db_fingerprint())
+    except (duckdb.Error, OSError) as e:
+        report.error = str(e)
+        report.duration_seconds = time.perf_counter() - start_time
+        logger.error(f"Warm-up failed after {report.duration_seconds:.2f}s: {e}")
+        return report
+
+    with timed_step(report, "run_queries"):
+        for sql_query in load_warmup_queries(config.warmup_queries_path):
+            report.num_queries += 1
+            try:
+                sql_to_arrow(sql_query)
+            except SqlExecutionError as e:
+                report.num_failed_queries += 1
+                logger.warning(f"Warm-up query failed: {e}")
+
+    report.ready = True
+    report.duration_seconds = time.perf_counter() - start_time
+    logger.info(
+        f"Warm-up done in {report.duration_seconds:.2f}s: {report.num_scanned_rows} rows scanned, "
+        f"{report.num_queries - report.num_failed_queries}/{report.num_queries} queries run"
+    )
+    if config.warmup_ready_path is not None:
+        config.warmup_ready_path.parent.mkdir(parents=True, exist_ok=True)
+        config.warmup_ready_path.write_text(report.model_dump_json(indent=4))
+    return report
+
+
+@functools.cache
+def start_warmup() -> threading.Thread:
+    """Warm the process up in a background thread, started once per process, so that the app renders meanwhile."""
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Main
+
+if __name__ == "__main__":
+    warmup_report = warm_up()
+    logger.info(f"Warm-up report:\n{warmup_report.model_dump_json(indent=4)}")
+    sys.exit(0 if warmup_report.ready else 1)
@@ -1,17 +1,22 @@
-"""Simple benchmark of the NER and Retrieval pipeline. Can test different models and save the results."""
+"""
+Simple benchmark of the NER and Retrieval pipeline. Can test different models and save the results.
+
+Run from the root of the repository with: `python -m benchmark.benchmark_ner_retrieval_pipeline`
+"""
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
 
-import difflib
 import json
 from pathlib import Path
 
-import duckdb
 from loguru import logger
 from openai import OpenAI
 from pydantic import BaseModel, computed_field
 
+from app.db.dao import get_players_names, get_teams_names
+from app.logic.entity_index import EntityIndex
+
 # -------------------------------------------------------------------------------------------------------------------- #
 # Models
 
@@ -75,8 +80,6 @@ class BenchmarkTestResults(BaseModel):
 
 
 DATA_FOLDER = Path("data")
-DB_PATH = DATA_FOLDER / "db" / "nba_dwh.duckdb"
-DB_CONNECTOR = duckdb.connect(DB_PATH)
 LLM_CLIENT = OpenAI(base_url="http://localhost:11434/v1", api_key="ollama")
 
 
@@ -84,15 +87,8 @@ INPUT_BENCHMARK_PATH = DATA_FOLDER / "benchmark" / "test_dataset" / "dataset_ner
 OUTPUT_BENCHMARK_PATH = DATA_FOLDER / "benchmark" / "results" / "dataset_ner_retrieval_results.json"
 
 
-RAW_PLAYER_NAMES = [e[0] for e in DB_CONNECTOR.sql("select distinct player_name from player").fetchall()]
-PLAYER_NAMES = [p.lower() for p in RAW_PLAYER_NAMES]
-PLAYER_NAMES_LOWERCASE = [p.lower() for p in RAW_PLAYER_NAMES]
-PLAYER_NAMES_LOWERCASE_TO_NORMAL_CASE = {p.lower(): p for p in RAW_PLAYER_NAMES}
-
-RAW_TEAM_NAMES = [e[0] for e in DB_CONNECTOR.sql("select distinct team_name from team").fetchall()]
-TEAM_NAMES = [p.lower() for p in RAW_TEAM_NAMES]
-TEAM_NAMES_LOWERCASE = [p.lower() for p in RAW_TEAM_NAMES]
-TEAM_NAMES_LOWERCASE_TO_NORMAL_CASE = {p.lower(): p for p in RAW_TEAM_NAMES}
+PLAYERS_INDEX = EntityIndex(get_players_names())
+TEAMS_INDEX = EntityIndex(get_teams_names())
 
 LLM_MODELS = [
     "smollm2:360m",
@@ -144,25 +140,8 @@ def query_llm(ner_prompt: str, llm_model: str) -> PlayersAndTeams:
     return llm_response.parsed
 
 
-def get_closest_player(player_name: str) -> str:
-    """Find the closest player name in the database from an input given name."""
-    closest_match = difflib.get_close_matches(
-        word=player_name.lower(), possibilities=PLAYER_NAMES_LOWERCASE, n=1, cutoff=0
-    )[0]
-    return PLAYER_NAMES_LOWERCASE_TO_NORMAL_CASE[closest_match]
-
-
-def get_closest_team(team_name: str) -> str:
-    """Find the closest team name in the database from an input given name."""
-    closest_match = difflib.get_close_matches(
-        word=team_name.lower(), possibilities=TEAM_NAMES_LOWERCASE, n=1, cutoff=0
-    )[0]
-    return TEAM_NAMES_LOWERCASE_TO_NORMAL_CASE[closest_match]
-
-
-def test_single_case(test_case: TestCase, llm_model: str) -> TestCaseResult:
-    """Take a single test case, run it though the NER and retrieval pipeline. Then return the result."""
-
+def run_ner(test_case: TestCase, llm_model: str) -> PlayersAndTeams:
+    """Extract the raw players and teams names of a test case with the LLM."""
     ner_result = query_llm(
         ner_prompt=make_ner_prompt(text=test_case.request),
         llm_model=llm_model,
@@ -170,25 +149,39 @@ def test_single_case(test_case: TestCase, llm_model: str) -> TestCaseResult:
 
     # Find exact name value in text as the LLM sometimes doesn't return the original case.
     r = test_case.request
-    ner_result = PlayersAndTeams(
+    return PlayersAndTeams(
         players=[r[r.lower().find(p.lower()) : r.lower().find(p.lower()) + len(p)] for p in ner_result.players],
         teams=[r[r.lower().find(p.lower()) : r.lower().find(p.lower()) + len(p)] for p in ner_result.teams],
     )
 
-    ner_db_result_players = {player_name: get_closest_player(player_name) for player_name in ner_result.players}
-    ner_db_result_teams = {team_name: get_closest_team(team_name) for team_name in ner_result.teams}
-
-    return TestCaseResult(
-        request=test_case.request,
-        expected_raw_teams=test_case.expected_raw_teams,
-        expected_raw_players=test_case.expected_raw_players,
-        expected_db_teams=test_case.expected_db_teams,
-        expected_db_players=test_case.expected_db_players,
-        computed_raw_teams=ner_result.teams,
-        computed_raw_players=ner_result.players,
-        computed_db_teams=ner_db_result_teams,
-        computed_db_players=ner_db_result_players,
-    )
+
+def test_all_cases(test_cases: list[TestCase], llm_model: str) -> list[TestCaseResult]:
+    """
+    Run the test cases though the NER and retrieval pipeline. Then return the results.
+
+    The names extracted from all the test cases are retrieved from the db in a single batch per kind of entity.
+    """
+    ner_results = [run_ner(test_case=test_case, llm_model=llm_model) for test_case in test_cases]
+
+    players_matches = iter(PLAYERS_INDEX.match_batch([p for ner_result in ner_results for p in ner_result.players]))
+    teams_matches = iter(TEAMS_INDEX.match_batch([t for ner_result in ner_results for t in ner_result.teams]))
+
+    test_results = []
+    for test_case, ner_result in zip(test_cases, ner_results, strict=True):
+        test_results.append(
+            TestCaseResult(
+                request=test_case.request,
+                expected_raw_teams=test_case.expected_raw_teams,
+                expected_raw_players=test_case.expected_raw_players,
+                expected_db_teams=test_case.expected_db_teams,
+                expected_db_players=test_case.expected_db_players,
+                computed_raw_teams=ner_result.teams,
+                computed_raw_players=ner_result.players,
+                computed_db_teams={team: next(teams_matches)[0].name for team in ner_result.teams},
+                computed_db_players={player: next(players_matches)[0].name for player in ner_result.players},
+            )
+        )
+    return test_results
 
 
 # -------------------------------------------------------------------------------------------------------------------- #
@@ -204,9 +197,7 @@ if __name__ == "__main__":
 
         benchmark_result = BenchmarkTestResults(
             llm_model=llm_model,
-            test_results=[
-                test_single_case(test_case=test_case, llm_model=llm_model) for test_case in benchmark_test_set
-            ],
+            test_results=test_all_cases(test_cases=benchmark_test_set, llm_model=llm_model),
         )
         llm_models_results[llm_model] = benchmark_result
         logger.info(f"    Accuracy: {benchmark_result.accuracy:.1%}")
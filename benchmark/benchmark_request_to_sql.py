@@ -1,19 +1,34 @@
-"""Simple benchmark of the request to SQL pipeline. Can test different models and save the results."""
+"""
+Simple benchmark of the request to SQL pipeline. Can test different models and save the results.
+
+Run from the repo's root with: `python -m benchmark.benchmark_request_to_sql`
+Add `--compare-schema-pruning` to run each model with and without the pruning of the schema given in the prompt.
+Add `--compare-model-routing` to run the app's SQL generation (LLMs of the `.env`) with and without the routing of
+simple questions to the light LLM, the routing decisions being compared to the number of tables involved in each query.
+"""
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
 
+import argparse
 import functools
 import json
 import os
+import sys
 import time
+from collections import Counter
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, Callable, Literal, Optional
 
-import duckdb
 from loguru import logger
 from openai import OpenAI
-from pydantic import BaseModel, computed_field, field_serializer
+from pydantic import BaseModel, computed_field, field_serializer, field_validator
+
+from app.configuration import get_config
+from app.db.dao import sql_to_df
+from app.logic.question_to_sql import generate_sql_query, get_db_description, get_routing_decision, select_schema
+from app.logic.schema_selection import estimate_num_tokens
+from app.retry import CircuitBreaker, RetryPolicy, RetryScheduler, TokenBucket
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Models
@@ -22,6 +37,13 @@ from pydantic import BaseModel, computed_field, field_serializer
 class TestCase(BaseModel):
     question: str
     expected_result: Any
+    num_tables_involved: Optional[int] = None
+
+    @field_validator("num_tables_involved", mode="before")
+    @classmethod
+    def validate_num_tables_involved(cls, num_tables_involved: Any) -> Optional[int]:
+        # Some test cases are not annotated yet, e.g. "TODO"
+        return int(num_tables_involved) if isinstance(num_tables_involved, (int, float)) else None
 
 
 class TestCaseResult(BaseModel):
@@ -30,6 +52,8 @@ class TestCaseResult(BaseModel):
     llm_response: str
     computed_sql_query: str
     computed_result: Any
+    prompt_num_tokens: int
+    latency_seconds: float  # Time to generate the SQL query, from the schema selection to the LLM response
 
     @computed_field
     def is_correct(self) -> bool:
@@ -47,12 +71,62 @@ class TestCaseResult(BaseModel):
 
 class BenchmarkTestResults(BaseModel):
     llm_model: str
+    schema_pruning: bool = False
     test_cases_results: list[TestCaseResult]
 
     @computed_field
     def accuracy(self) -> float:
         return sum([result.is_correct for result in self.test_cases_results]) / len(self.test_cases_results)
 
+    @computed_field
+    def avg_latency_seconds(self) -> float:
+        return sum([result.latency_seconds for result in self.test_cases_results]) / len(self.test_cases_results)
+
+    @computed_field
+    def avg_prompt_num_tokens(self) -> float:
+        return sum([result.prompt_num_tokens for result in self.test_cases_results]) / len(self.test_cases_results)
+
+
+class RoutingTestCaseResult(TestCaseResult):
+    num_tables_involved: Optional[int]
+    complexity: int
+    routed_model_kind: Literal["light", "heavy"]  # Routing decision, whether the routing is enabled or not
+    model_kind: Optional[Literal["light", "heavy"]]  # LLM which generated the query, None if it failed
+
+    @computed_field
+    def is_escalated(self) -> bool:
+        return self.routed_model_kind == "light" and self.model_kind == "heavy"
+
+
+class RoutingBenchmarkResults(BaseModel):
+    model_routing: bool
+    test_cases_results: list[RoutingTestCaseResult]
+
+    @computed_field
+    def accuracy(self) -> float:
+        return sum([result.is_correct for result in self.test_cases_results]) / len(self.test_cases_results)
+
+    @computed_field
+    def avg_latency_seconds(self) -> float:
+        return sum([result.latency_seconds for result in self.test_cases_results]) / len(self.test_cases_results)
+
+    @computed_field
+    def num_light_generations(self) -> int:
+        return sum([result.model_kind == "light" for result in self.test_cases_results])
+
+    @computed_field
+    def num_escalations(self) -> int:
+        return sum([result.is_escalated for result in self.test_cases_results])
+
+    @computed_field
+    def routing_by_num_tables_involved(self) -> dict[str, dict[str, int]]:
+        """Number of questions routed to each LLM, by number of tables involved in their expected query."""
+        counts = Counter((result.num_tables_involved, result.routed_model_kind) for result in self.test_cases_results)
+        return {
+            str(num_tables): {model_kind: counts[(num_tables, model_kind)] for model_kind in ("light", "heavy")}
+            for num_tables in sorted({num_tables for num_tables, _ in counts}, key=lambda n: (n is None, n))
+        }
+
 
 class LLMConnection(BaseModel):
     model_id: str
@@ -67,13 +141,17 @@ PROMPT_ID = "THINKING"
 
 # Paths
 DATA_FOLDER = Path("data")
-DB_PATH = DATA_FOLDER / "db" / "nba_dwh.duckdb"
-DB_CONNECTOR = duckdb.connect(DB_PATH)
 
 INPUT_BENCHMARK_PATH = DATA_FOLDER / "benchmark" / "test_dataset" / "dataset_request_to_sql.json"
 OUTPUT_BENCHMARK_PATH = (
     DATA_FOLDER / "benchmark" / "results" / f"dataset_request_to_sql_results_prompt_{PROMPT_ID.lower()}.json"
 )
+OUTPUT_SCHEMA_PRUNING_BENCHMARK_PATH = OUTPUT_BENCHMARK_PATH.with_name(
+    f"{OUTPUT_BENCHMARK_PATH.stem}_schema_pruning_comparison.json"
+)
+OUTPUT_MODEL_ROUTING_BENCHMARK_PATH = OUTPUT_BENCHMARK_PATH.with_name(
+    f"{OUTPUT_BENCHMARK_PATH.stem}_model_routing_comparison.json"
+)
 
 
 # Credentials
@@ -143,7 +221,8 @@ LLM_MODELS = [
 # Other
 NB_RETRY = 3
 DELAY_BETWEEN_RETRY = 25
-DELAY_BETWEEN_REQUESTS = 5
+MAX_DELAY_BETWEEN_RETRY = 120
+REQUESTS_PER_MINUTE = 12
 
 
 # -------------------------------------------------------------------------------------------------------------------- #
@@ -246,75 +325,60 @@ The SQL request that you'll generate will need to work effectively with the datb
 def retry(
     nb_retry: int,
     delay: int = 1,
+    scheduler_key: Optional[Callable[..., str]] = None,
 ) -> Callable:
-    """Retries a function if it returns None, an empty string or raise an error."""
+    """
+    Retries a function if it returns None, an empty string or raise an error.
+
+    Attempts are scheduled by a retry scheduler shared by the calls with the same `scheduler_key(*args, **kwargs)`,
+    e.g. the same LLM: exponential backoff with jitter starting from `delay`, Retry-After headers, rate limit of
+    `REQUESTS_PER_MINUTE` and circuit breaker.
+    """
 
     def decorator(func: Callable) -> Callable:
+        schedulers: dict[str, RetryScheduler] = {}
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):  # noqa: ANN002, ANN003, ANN202
-            attempts = 0
-            while attempts < nb_retry:
-                try:
-                    result = func(*args, **kwargs)
-
-                except Exception as exc:
-                    logger.warning(f"Function: {func.__name__} retrieved exception: {exc}")
-                    attempts += 1
-
-                else:
-                    if result not in (None, ""):
-                        return result
-
-                    attempts += 1
-                    logger.warning(f"Function: {func.__name__} retrieved None or empty string")
-
-                logger.warning(f"Retrying ({attempts}/{nb_retry})...")
-                time.sleep(delay)
-            logger.error(f"Function: {func.__name__} still retrieved None after {nb_retry} attempts. Returning None.")
-
-            error_msg = f"Function: {func.__name__} to retrieve a correct value"
-            raise ValueError(error_msg)
+            key = scheduler_key(*args, **kwargs) if scheduler_key is not None else func.__name__
+            if key not in schedulers:
+                schedulers[key] = RetryScheduler(
+                    policy=RetryPolicy(
+                        max_attempts=nb_retry, base_delay_seconds=delay, max_delay_seconds=MAX_DELAY_BETWEEN_RETRY
+                    ),
+                    token_bucket=TokenBucket(rate_per_second=REQUESTS_PER_MINUTE / 60, capacity=1),
+                    circuit_breaker=CircuitBreaker(failure_threshold=2 * nb_retry, reset_timeout_seconds=60),
+                )
+
+            def call_func() -> Any:
+                result = func(*args, **kwargs)
+                if result in (None, ""):
+                    error_msg = f"Function: {func.__name__} retrieved None or empty string"
+                    raise ValueError(error_msg)
+                return result
+
+            try:
+                return schedulers[key].call(call_func)
+            except Exception as exc:
+                logger.error(f"Function: {func.__name__} still failed after {nb_retry} attempts: {exc}")
+                error_msg = f"Function: {func.__name__} to retrieve a correct value"
+                raise ValueError(error_msg) from exc
 
         return wrapper
 
     return decorator
 
 
-def get_table_columns(table_name: str) -> list[tuple[str, str]]:
-    return DB_CONNECTOR.sql(
-        f"select column_name, data_type from information_schema.columns where table_name = '{table_name}'"
-    ).fetchall()
-
-
-def get_table_description(table_name: str) -> str:
-    table_description = f"Table: {table_name}"
-
-    for column_name, data_type in DB_CONNECTOR.sql(
-        f"select column_name, data_type from information_schema.columns where table_name = '{table_name}'"
-    ).fetchall():
-        table_description += f"\n  - {column_name}: {data_type}"
-
-    return table_description
-
-
-def get_db_description() -> str:
-    """Database description in natural language to be used by the LLM."""
-    tables_names = [
-        e[0]
-        for e in DB_CONNECTOR.sql("select table_name from information_schema.tables").fetchall()
-        if not e[0].startswith("base_")  # These tables should not be in the final db
-    ]
-    tables_desc = {table: get_table_description(table) for table in tables_names}
-    return "\n\n".join(tables_desc.values())
+@functools.cache
+def get_llm_client(base_url: str, api_key: str) -> OpenAI:
+    """Get a LLM client, reused by all the queries to the same API. Retries are handled by the `retry` decorator."""
+    return OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
 
 
-@retry(nb_retry=NB_RETRY, delay=DELAY_BETWEEN_RETRY)
+@retry(nb_retry=NB_RETRY, delay=DELAY_BETWEEN_RETRY, scheduler_key=lambda prompt, llm_model: llm_model.model_id)  # noqa: ARG005
 def query_llm(prompt: str, llm_model: LLMConnection) -> str:
     """Send query to the LLM."""
-    llm_client = OpenAI(
-        base_url=llm_model.base_url,
-        api_key=llm_model.api_key,
-    )
+    llm_client = get_llm_client(base_url=llm_model.base_url, api_key=llm_model.api_key)
 
     completion = llm_client.chat.completions.create(
         model=llm_model.model_id,
@@ -341,13 +405,20 @@ def build_prompt(prompt_id: str, nba_data_query: str, db_description: str) -> st
 
 
 def execute_query(query: str) -> list[Any]:
-    return DB_CONNECTOR.sql(query).df().to_dict(orient="records")
+    return sql_to_df(query).to_dict(orient="records")
 
 
-def test_single_case(test_case: TestCase, llm_model: LLMConnection, db_description: str) -> TestCaseResult:
+def test_single_case(
+    test_case: TestCase, llm_model: LLMConnection, db_description: str, schema_pruning: bool
+) -> TestCaseResult:
+    prompt = ""
+    start_time = time.perf_counter()
     try:
+        if schema_pruning:
+            db_description = select_schema(test_case.question).description
         prompt = build_prompt(nba_data_query=test_case.question, db_description=db_description, prompt_id=PROMPT_ID)
         llm_response = query_llm(prompt=prompt, llm_model=llm_model)
+        latency_seconds = time.perf_counter() - start_time
         sql_query = extract_sql_query_from_response(response=llm_response)
         sql_result = execute_query(query=sql_query)
         result = TestCaseResult(
@@ -356,6 +427,8 @@ def test_single_case(test_case: TestCase, llm_model: LLMConnection, db_descripti
             computed_result=sql_result,
             llm_response=llm_response,
             computed_sql_query=sql_query,
+            prompt_num_tokens=estimate_num_tokens(prompt),
+            latency_seconds=latency_seconds,
         )
     except Exception as exc:
         logger.error(f"Error: {exc}")
@@ -365,15 +438,110 @@ def test_single_case(test_case: TestCase, llm_model: LLMConnection, db_descripti
             computed_result=f"ERROR: {exc}",
             llm_response=f"ERROR: {exc}",
             computed_sql_query="",
+            prompt_num_tokens=estimate_num_tokens(prompt),
+            latency_seconds=time.perf_counter() - start_time,
         )
 
     return result
 
 
+def test_model(
+    llm_model: LLMConnection, test_cases: list[TestCase], db_description: str, schema_pruning: bool
+) -> BenchmarkTestResults:
+    """Test each test case for a given LLM."""
+    logger.info(f"Test: {llm_model.model_id} - Schema pruning: {schema_pruning}")
+
+    test_cases_results = []
+    for i, test_case in enumerate(test_cases):
+        test_case_result = test_single_case(
+            test_case=test_case, llm_model=llm_model, db_description=db_description, schema_pruning=schema_pruning
+        )
+        test_cases_results.append(test_case_result)
+        logger.debug(f"{i + 1} / {len(test_cases)} - Correct: {test_case_result.is_correct}")
+
+    benchmark_results = BenchmarkTestResults(
+        llm_model=llm_model.model_id,
+        schema_pruning=schema_pruning,
+        test_cases_results=test_cases_results,
+    )
+    logger.info(
+        f"Accuracy: {benchmark_results.accuracy:.1%} - Avg latency: {benchmark_results.avg_latency_seconds:.2f}s "
+        f"- Avg prompt tokens: {benchmark_results.avg_prompt_num_tokens:.0f}"
+    )
+    return benchmark_results
+
+
+def test_routed_single_case(test_case: TestCase) -> RoutingTestCaseResult:
+    """Test a test case with the app's SQL generation, routed to the light or heavy LLM if the routing is enabled."""
+    routing_decision = get_routing_decision(test_case.question)
+    sql_generation = None
+    start_time = time.perf_counter()
+    try:
+        sql_generation = generate_sql_query(test_case.question, thinking_mode=PROMPT_ID == "THINKING")
+        latency_seconds = time.perf_counter() - start_time
+        sql_result = execute_query(query=sql_generation.sql_query)
+    except Exception as exc:
+        logger.error(f"Error: {exc}")
+        latency_seconds = time.perf_counter() - start_time
+        sql_result = f"ERROR: {exc}"
+
+    return RoutingTestCaseResult(
+        question=test_case.question,
+        expected_result=test_case.expected_result,
+        computed_result=sql_result,
+        llm_response="",  # Not returned by the app's SQL generation
+        computed_sql_query=sql_generation.sql_query if sql_generation is not None else "",
+        prompt_num_tokens=0,
+        latency_seconds=latency_seconds,
+        num_tables_involved=test_case.num_tables_involved,
+        complexity=routing_decision.features.complexity,
+        routed_model_kind=routing_decision.model_kind,
+        model_kind=sql_generation.model_kind if sql_generation is not None else None,
+    )
+
+
+def test_model_routing(test_cases: list[TestCase], model_routing: bool) -> RoutingBenchmarkResults:
+    """Test each test case with the app's SQL generation, with or without model routing."""
+    logger.info(f"Test: model routing: {model_routing}")
+    get_config().sql_model_routing_enabled = model_routing
+
+    test_cases_results = []
+    for i, test_case in enumerate(test_cases):
+        test_case_result = test_routed_single_case(test_case=test_case)
+        test_cases_results.append(test_case_result)
+        logger.debug(
+            f"{i + 1} / {len(test_cases)} - Correct: {test_case_result.is_correct} "
+            f"- Model: {test_case_result.model_kind}"
+        )
+
+    benchmark_results = RoutingBenchmarkResults(model_routing=model_routing, test_cases_results=test_cases_results)
+    logger.info(
+        f"Accuracy: {benchmark_results.accuracy:.1%} - Avg latency: {benchmark_results.avg_latency_seconds:.2f}s "
+        f"- Light generations: {benchmark_results.num_light_generations} - Escalations: "
+        f"{benchmark_results.num_escalations} - Routing by number of tables involved: "
+        f"{benchmark_results.routing_by_num_tables_involved}"
+    )
+    return benchmark_results
+
+
 # -------------------------------------------------------------------------------------------------------------------- #
 # Main
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--compare-schema-pruning",
+        action="store_true",
+        help="Run each model with and without the pruning of the schema, to compare their accuracy and latency.",
+    )
+    parser.add_argument(
+        "--compare-model-routing",
+        action="store_true",
+        help="Run the app's SQL generation with and without model routing, to compare their accuracy and latency.",
+    )
+    args = parser.parse_args()
+    schema_pruning_modes = [False, True] if args.compare_schema_pruning else [False]
+
     # Retrieve db description
     db_description = get_db_description()
 
@@ -381,25 +549,28 @@ if __name__ == "__main__":
     with INPUT_BENCHMARK_PATH.open("r", encoding="utf-8") as f:
         benchmark_test_cases = [TestCase(**e) for e in json.load(f)]
 
-    llm_models_results = {}
-    for llm_model in LLM_MODELS:
-        logger.info(f"Test: {llm_model.model_id}")
-
-        # Test each test case for a given LLM
-        test_cases_results = []
-        for i, test_case in enumerate(benchmark_test_cases):
-            test_case_result = test_single_case(test_case=test_case, llm_model=llm_model, db_description=db_description)
-            test_cases_results.append(test_case_result)
-            logger.debug(f"{i + 1} / {len(benchmark_test_cases)} - Correct: {test_case_result.is_correct}")
-            time.sleep(DELAY_BETWEEN_REQUESTS)
-
-        benchmark_results = BenchmarkTestResults(
-            llm_model=llm_model.model_id,
-            test_cases_results=test_cases_results,
+    if args.compare_model_routing:
+        # Caches would answer the second run from the first one
+        get_config().llm_cache_enabled = False
+        get_config().sql_cache_enabled = False
+        routing_results = [test_model_routing(benchmark_test_cases, model_routing) for model_routing in (False, True)]
+        with OUTPUT_MODEL_ROUTING_BENCHMARK_PATH.open("w") as f:
+            json.dump([routing_result.model_dump() for routing_result in routing_results], f, indent=4)
+        logger.info("Done")
+        sys.exit(0)
+
+    llm_models_results = [
+        test_model(
+            llm_model=llm_model,
+            test_cases=benchmark_test_cases,
+            db_description=db_description,
+            schema_pruning=schema_pruning,
         )
-        llm_models_results[llm_model.model_id] = benchmark_results
-        logger.info(f"Accuracy: {benchmark_results.accuracy:.1%}")
+        for llm_model in LLM_MODELS
+        for schema_pruning in schema_pruning_modes
+    ]
 
-    with OUTPUT_BENCHMARK_PATH.open("w") as f:
-        json.dump([llm_model_result.model_dump() for llm_model_result in llm_models_results.values()], f, indent=4)
+    output_path = OUTPUT_SCHEMA_PRUNING_BENCHMARK_PATH if args.compare_schema_pruning else OUTPUT_BENCHMARK_PATH
+    with output_path.open("w") as f:
+        json.dump([llm_model_result.model_dump() for llm_model_result in llm_models_results], f, indent=4)
     logger.info("Done")
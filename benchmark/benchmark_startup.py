@@ -0,0 +1,111 @@
+"""
+Startup time benchmark of the app: time to import the pipeline modules, and time to the first render of the app.
+
+Each measure is taken in a fresh Python process, so that no module is already imported, and the median of several runs
+is compared to its budget. The benchmark exits with an error if a budget is exceeded, to catch startup regressions
+(e.g. a heavy module imported at the top of a module instead of on first use).
+
+Run from the repo's root with: `python -m benchmark.benchmark_startup`
+The app configuration (`.env`) must be set, the database and the LLM APIs are not queried.
+"""
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import argparse
+import statistics
+import subprocess  # noqa: S404
+import sys
+
+from loguru import logger
+from pydantic import BaseModel, computed_field
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Models
+
+
+class StartupMeasure(BaseModel):
+    name: str
+    budget_seconds: float
+    durations_seconds: list[float]
+
+    @computed_field
+    def median_seconds(self) -> float:
+        return statistics.median(self.durations_seconds)
+
+    @computed_field
+    def within_budget(self) -> bool:
+        return self.median_seconds <= self.budget_seconds
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Constants
+
+DEFAULT_NUM_RUNS = 5
+
+# Each script prints the duration of its measure, in seconds
+IMPORT_SCRIPT = """
+import time
+start_time = time.perf_counter()
+import app.logic.pipeline
+print(time.perf_counter() - start_time)
+"""
+
+FIRST_RENDER_SCRIPT = """
+import time
+from streamlit.testing.v1 import AppTest
+start_time = time.perf_counter()
+app_test = AppTest.from_file("app/insights_app.py", default_timeout=60).run()
+assert not app_test.exception, app_test.exception
+print(time.perf_counter() - start_time)
+"""
+
+# Budgets, about twice the durations measured on a laptop, once the pipeline modules were imported lazily (resp. about
+# 0.6s and 0.3s, against 1.4s and 1.9s when they were imported eagerly)
+IMPORT_BUDGET_SECONDS = 1.0
+FIRST_RENDER_BUDGET_SECONDS = 0.8
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Functions
+
+
+def run_script(script: str) -> float:
+    """Run a measure script in a fresh Python process and return the duration it printed."""
+    command = [sys.executable, "-c", script]
+    completed_process = subprocess.run(command, capture_output=True, text=True, check=False)  # noqa: S603
+    if completed_process.returncode != 0:
+        error_msg = f"Startup benchmark script failed:\n{completed_process.stderr}"
+        raise RuntimeError(error_msg)
+    return float(completed_process.stdout.strip().splitlines()[-1])
+
+
+def measure(name: str, script: str, budget_seconds: float, num_runs: int) -> StartupMeasure:
+    startup_measure = StartupMeasure(
+        name=name,
+        budget_seconds=budget_seconds,
+        durations_seconds=[run_script(script) for _ in range(num_runs)],
+    )
+    logger.info(
+        f"{name}: {startup_measure.median_seconds:.3f}s (median of {num_runs} runs), "
+        f"budget {budget_seconds:.3f}s{'' if startup_measure.within_budget else ' EXCEEDED'}"
+    )
+    return startup_measure
+
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-runs", type=int, default=DEFAULT_NUM_RUNS, help="Number of runs of each measure.")
+    args = parser.parse_args()
+
+    startup_measures = [
+        measure("Import of the pipeline modules", IMPORT_SCRIPT, IMPORT_BUDGET_SECONDS, args.num_runs),
+        measure("First render of the app", FIRST_RENDER_SCRIPT, FIRST_RENDER_BUDGET_SECONDS, args.num_runs),
+    ]
+    if not all(startup_measure.within_budget for startup_measure in startup_measures):
+        logger.error("Startup time regression: a budget is exceeded")
+        sys.exit(1)
+    logger.info("Done")
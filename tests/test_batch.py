@@ -0,0 +1,100 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import json
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app import batch
+from app.logic.question_to_sql import SqlGeneration
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+@pytest.fixture
+def answered_questions(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    answered_questions = []
+
+    async def fake_aclean_question_and_generate_sql_query(
+        question: str,
+        thinking_mode: bool,  # noqa: ARG001
+        speculative: bool,  # noqa: ARG001
+    ) -> tuple[str, SqlGeneration]:
+        answered_questions.append(question)
+        if "fail" in question:
+            error_msg = "LLM API unavailable"
+            raise RuntimeError(error_msg)
+        return question, SqlGeneration(sql_query="select 61 max_points", source="llm")
+
+    async def fake_aexecute_sql_query(clean_question: str, sql_generation: SqlGeneration) -> pa.Table:  # noqa: ARG001
+        return pa.table({"max_points": [61]})
+
+    async def fake_asummarize_result(clean_question: str, result: pa.Table) -> tuple[str, str]:
+        return f"{clean_question} {result['max_points'][0]}", "template"
+
+    monkeypatch.setattr(batch, "aclean_question_and_generate_sql_query", fake_aclean_question_and_generate_sql_query)
+    monkeypatch.setattr(batch, "aexecute_sql_query", fake_aexecute_sql_query)
+    monkeypatch.setattr(batch, "asummarize_result", fake_asummarize_result)
+    return answered_questions
+
+
+def write_questions(path: Path, questions: list[dict]) -> None:
+    path.write_text("".join(json.dumps(question) + "\n" for question in questions))
+
+
+def test_run_batch(answered_questions: list[str], tmp_path: Path) -> None:
+    input_path, output_path = tmp_path / "questions.jsonl", tmp_path / "answers.jsonl"
+    write_questions(input_path, [{"question": "Max points?"}, {"id": "q2", "question": "Max points? "}])
+
+    stats = batch.run_batch(input_path, output_path)
+
+    # Identical questions are answered once
+    assert answered_questions == ["Max points?"]
+    assert (stats.num_questions, stats.num_unique_questions, stats.num_answered) == (2, 1, 1)
+    answers = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [answer["id"] for answer in answers] == ["1", "q2"]
+    assert answers[0]["response_md"] == "Max points? 61"
+    assert json.loads(answers[0]["result"]) == [{"max_points": 61}]
+
+
+def test_run_batch_resume(answered_questions: list[str], tmp_path: Path) -> None:
+    input_path, output_path = tmp_path / "questions.jsonl", tmp_path / "answers.parquet"
+    write_questions(input_path, [{"question": "Max points?"}, {"question": "Max assists?"}, {"question": "fail"}])
+    # Run interrupted after its first answer, while writing the second one
+    previous_answer = batch.BatchAnswer(id="1", question="Max points?", response_md="61")
+    (tmp_path / "answers.parquet.partial.jsonl").write_text(previous_answer.model_dump_json() + '\n{"id": "2", "qu')
+
+    stats = batch.run_batch(input_path, output_path)
+
+    assert sorted(answered_questions) == ["Max assists?", "fail"]
+    assert (stats.num_resumed, stats.num_answered, stats.num_failed) == (1, 1, 1)
+    answers = pq.read_table(output_path).to_pylist()
+    assert [answer["response_md"] for answer in sorted(answers, key=lambda answer: answer["id"])] == [
+        "61",
+        "Max assists? 61",
+        None,
+    ]
+    assert not (tmp_path / "answers.parquet.partial.jsonl").exists()
+
+
+def test_run_batch_resume_finished_parquet(answered_questions: list[str], tmp_path: Path) -> None:
+    input_path, output_path = tmp_path / "questions.jsonl", tmp_path / "answers.parquet"
+    write_questions(input_path, [{"question": "Max points?"}, {"question": "fail"}])
+    batch.run_batch(input_path, output_path)
+    write_questions(input_path, [{"question": "Max points?"}, {"question": "fail"}, {"question": "Max assists?"}])
+
+    stats = batch.run_batch(input_path, output_path)
+
+    # Only the failed and new questions are answered again, the output keeping the previous answers
+    assert answered_questions == ["Max points?", "fail", "fail", "Max assists?"]
+    assert (stats.num_resumed, stats.num_answered, stats.num_failed) == (1, 1, 1)
+    answers = pq.read_table(output_path).to_pylist()
+    assert [answer["response_md"] for answer in sorted(answers, key=lambda answer: answer["id"])] == [
+        "Max points? 61",
+        None,
+        "Max assists? 61",
+    ]
@@ -0,0 +1,88 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import threading
+import time
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from app.db.connection import DBConnectionPool
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> Path:
+    db_path = tmp_path / "db.duckdb"
+    with duckdb.connect(db_path) as connection:
+        connection.execute("create table player as select 'LeBron James' player_name")
+    return db_path
+
+
+def test_db_connection_pool(db_path: Path) -> None:
+    pool = DBConnectionPool(db_path, pool_size=2, settings={"threads": 1, "memory_limit": "256MB"})
+
+    with pool.cursor() as cursor:
+        assert cursor.sql("select current_setting('threads')").fetchone() == (1,)
+    with pool.cursor() as cursor:
+        assert cursor.sql("select player_name from player").fetchall() == [("LeBron James",)]
+
+    # A released cursor is reused, one raising an error is dropped
+    assert pool.stats.cursors_created == 1
+    with pytest.raises(duckdb.CatalogException), pool.cursor() as cursor:
+        cursor.sql("select * from team")
+    with pool.cursor():
+        pass
+    assert pool.stats.cursors_created == 2
+    pool.close()
+
+
+def test_db_connection_pool_bounded(db_path: Path) -> None:
+    pool = DBConnectionPool(db_path, pool_size=1)
+    results = []
+
+    def query() -> None:
+        with pool.cursor() as cursor:
+            results.append(cursor.sql("select count(*) from player").fetchone()[0])
+
+    # The only cursor is checked out: the query of the other thread waits for its release
+    with pool.cursor():
+        thread = threading.Thread(target=query)
+        thread.start()
+        time.sleep(0.05)
+        assert not results
+    thread.join(timeout=5)
+
+    assert results == [1]
+    assert (pool.stats.checkouts, pool.stats.waits, pool.stats.cursors_created) == (2, 1, 1)
+    assert pool.stats.max_wait_seconds >= 0.05
+    pool.close()
+
+
+def test_db_connection_pool_reopens_replaced_db(db_path: Path, tmp_path: Path) -> None:
+    pool = DBConnectionPool(db_path, pool_size=2)
+    new_db_path = tmp_path / "new_db.duckdb"
+    with duckdb.connect(new_db_path) as connection:
+        connection.execute("create table player as select 'Victor Wembanyama' player_name")
+    results = []
+
+    def query() -> None:
+        with pool.cursor() as cursor:
+            results.append(cursor.sql("select player_name from player").fetchall())
+
+    # The database is replaced while a cursor is in use: it is reopened once the cursor is released
+    with pool.cursor() as cursor:
+        new_db_path.replace(db_path)
+        thread = threading.Thread(target=query)
+        thread.start()
+        time.sleep(0.05)
+        assert not results
+        assert cursor.sql("select player_name from player").fetchall() == [("LeBron James",)]
+    thread.join(timeout=5)
+
+    assert results == [[("Victor Wembanyama",)]]
+    assert pool.stats.reopens == 1
+    pool.close()
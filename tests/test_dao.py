@@ -0,0 +1,85 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from app.configuration import get_config
+from app.db import dao
+from app.db.connection import DBConnectionPool, compute_db_fingerprint
+from app.db.result_cache import ResultCache
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+@pytest.fixture
+def db_pool(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> DBConnectionPool:
+    db_path = tmp_path / "db.duckdb"
+    with duckdb.connect(db_path) as connection:
+        connection.execute("create table game_boxscore as select range points from range(25000)")
+
+    db_pool = DBConnectionPool(db_path, pool_size=1)
+    monkeypatch.setattr(dao, "get_db_pool", lambda: db_pool)
+    monkeypatch.setattr(dao, "get_db_fingerprint", lambda: "db_v1")
+    monkeypatch.setattr(get_config(), "sql_max_result_rows", 20000)
+    return db_pool
+
+
+@pytest.mark.parametrize("result_cache_enabled", [True, False])
+def test_sql_to_arrow(
+    db_pool: DBConnectionPool, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, result_cache_enabled: bool
+) -> None:
+    result_cache = ResultCache(tmp_path / "results", 2**20, 2**20) if result_cache_enabled else None
+    monkeypatch.setattr(dao, "get_result_cache", lambda: result_cache)
+    sql_query = "select points from game_boxscore order by points desc"
+
+    # The result is capped, and its pages are sliced from it
+    result = dao.sql_to_arrow(sql_query)
+    assert result.num_rows == 20000
+    assert result["points"][0].as_py() == 24999
+    page = dao.get_sql_result_page(sql_query, offset=1000, num_rows=10)
+    assert page["points"].to_pylist() == list(range(23999, 23989, -1))
+
+    if result_cache_enabled:
+        assert result_cache.stats.misses == 1
+        assert result_cache.stats.memory_hits == 1
+    assert db_pool.stats.checkouts == (1 if result_cache_enabled else 2)
+
+
+def test_sql_to_arrow_after_db_replaced(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    db_path, new_db_path = tmp_path / "db.duckdb", tmp_path / "new_db.duckdb"
+    for path, player_name in ((db_path, "Old Guy"), (new_db_path, "New Guy")):
+        with duckdb.connect(path) as connection:
+            connection.execute(f"create table player as select '{player_name}' player_name")
+    db_pool = DBConnectionPool(db_path, pool_size=1)
+    monkeypatch.setattr(dao, "get_db_pool", lambda: db_pool)
+    monkeypatch.setattr(dao, "get_db_fingerprint", lambda: compute_db_fingerprint(db_path))
+    result_cache = ResultCache(tmp_path / "results", 2**20, 2**20)
+    monkeypatch.setattr(dao, "get_result_cache", lambda: result_cache)
+    sql_query = "select player_name from player"
+
+    assert dao.sql_to_arrow(sql_query).to_pylist() == [{"player_name": "Old Guy"}]
+    new_db_path.replace(db_path)
+    assert dao.sql_to_arrow(sql_query).to_pylist() == [{"player_name": "New Guy"}]
+    assert dao.sql_to_arrow(sql_query).to_pylist() == [{"player_name": "New Guy"}]
+    assert result_cache.stats.memory_hits == 1
+    db_pool.close()
+
+
+@pytest.mark.usefixtures("db_pool")
+def test_sql_to_arrow_auto_limited(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    result_cache = ResultCache(tmp_path / "results", max_memory_size_bytes=0, max_disk_size_bytes=2**20)
+    monkeypatch.setattr(dao, "get_result_cache", lambda: result_cache)
+    monkeypatch.setattr(get_config(), "sql_auto_limit_rows", 1000)
+
+    result = dao.sql_to_arrow("select points from game_boxscore")
+    assert result.num_rows == 1000
+    assert dao.is_auto_limited(result)
+    assert not dao.is_auto_limited(dao.sql_to_arrow("select max(points) from game_boxscore"))
+
+    # The flag is kept by the results spilled to disk
+    assert dao.is_auto_limited(dao.sql_to_arrow("select points from game_boxscore"))
+    assert result_cache.stats.disk_hits == 1
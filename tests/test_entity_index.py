@@ -0,0 +1,61 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import difflib
+
+from app.logic.entity_index import EntityIndex, get_ngrams
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+PLAYERS_NAMES = [
+    "LeBron James",
+    "Stephen Curry",
+    "Kevin Durant",
+    "James Harden",
+    "Kobe Bryant",
+    "Paul Pierce",
+    "Rajon Rondo",
+    "Carmelo Anthony",
+    "Anthony Davis",
+    "Dwight Howard",
+    "Chris Paul",
+    "Russell Westbrook",
+    "Kevin Love",
+    "Jaylen Brown",
+    "Bruce Brown",
+]
+
+
+def test_get_ngrams() -> None:
+    assert get_ngrams("heat") == {" he", "hea", "eat", "at "}
+
+
+def test_entity_index_matches_difflib() -> None:
+    entity_index = EntityIndex(PLAYERS_NAMES, max_candidates=3)
+    players_names_lowercase = [p.lower() for p in PLAYERS_NAMES]
+    mentions = ["Pierce", "Rondo", "westbrook", "lebron jame", "kevin duran", "carmelo", "brown", "Chris Paul"]
+
+    for mention in mentions:
+        expected_match = difflib.get_close_matches(mention.lower(), players_names_lowercase, n=1, cutoff=0)[0]
+        assert entity_index.find_closest(mention).lower() == expected_match
+
+
+def test_entity_index_candidates() -> None:
+    entity_index = EntityIndex(PLAYERS_NAMES, max_candidates=2)
+
+    assert entity_index.get_candidates("kevin") == ["kevin durant", "kevin love"]
+    assert len(entity_index.get_candidates("xyz")) == len(PLAYERS_NAMES)
+
+
+def test_entity_index_match_batch() -> None:
+    entity_index = EntityIndex(PLAYERS_NAMES, max_candidates=3)
+    mentions = ["Pierce", "kevin duran", "brown"]
+
+    matches = entity_index.match_batch(mentions, k=2)
+
+    assert [mention_matches[0].name for mention_matches in matches] == [entity_index.find_closest(m) for m in mentions]
+    assert all(len(mention_matches) == 2 for mention_matches in matches)
+    assert matches[1][0].score > matches[1][1].score
+    assert {match.name for match in matches[2]} == {"Jaylen Brown", "Bruce Brown"}
+    assert entity_index.match_batch([]) == []
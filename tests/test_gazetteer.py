@@ -0,0 +1,78 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from app.logic.gazetteer import AhoCorasick, Gazetteer, rewrite_spans
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+PLAYERS_NAMES = ["LeBron James", "James Harden", "Paul Pierce", "Chris Paul", "Kevin Durant", "Stephen Curry"]
+TEAMS_NAMES = ["Boston Celtics", "Los Angeles Lakers", "Los Angeles Clippers", "Miami Heat", "Portland Trail Blazers"]
+
+
+def test_aho_corasick_finds_overlapping_patterns() -> None:
+    automaton = AhoCorasick(["he", "she", "hers", "his"])
+
+    assert sorted(automaton.find_all("ushers")) == [(1, 4, 1), (2, 4, 0), (2, 6, 2)]
+
+
+def test_gazetteer_aliases() -> None:
+    gazetteer = Gazetteer(PLAYERS_NAMES, TEAMS_NAMES)
+
+    assert gazetteer.alias_to_entity["celtics"] == ("team", "Boston Celtics")
+    assert gazetteer.alias_to_entity["trail blazers"] == ("team", "Portland Trail Blazers")
+    assert gazetteer.alias_to_entity["portland"] == ("team", "Portland Trail Blazers")
+    assert "portland trail" not in gazetteer.alias_to_entity
+    assert gazetteer.alias_to_entity["boston"] == ("team", "Boston Celtics")
+    assert gazetteer.alias_to_entity["pierce"] == ("player", "Paul Pierce")
+    assert "los angeles" not in gazetteer.alias_to_entity  # Shared by two teams
+    assert "james" not in gazetteer.alias_to_entity  # Also the first name of James Harden
+
+
+def test_gazetteer_find_spans() -> None:
+    gazetteer = Gazetteer(PLAYERS_NAMES, TEAMS_NAMES)
+    text = "Did pierce outscore lebron james against the Trail Blazers and the Heat? Not heated."
+
+    spans = gazetteer.find_spans(text)
+
+    assert [(text[s.start : s.end], s.name) for s in spans] == [
+        ("pierce", "Paul Pierce"),
+        ("lebron james", "LeBron James"),
+        ("Trail Blazers", "Portland Trail Blazers"),
+        ("Heat", "Miami Heat"),
+    ]
+    assert rewrite_spans(text, spans) == (
+        "Did Paul Pierce outscore LeBron James against the Portland Trail Blazers and the Miami Heat? Not heated."
+    )
+
+
+def test_gazetteer_find_unresolved_words() -> None:
+    gazetteer = Gazetteer(PLAYERS_NAMES, TEAMS_NAMES)
+
+    text = "How many points did Kevin Durant score against the Lakers?"
+    assert gazetteer.find_unresolved_words(text, gazetteer.find_spans(text)) == []
+
+    text = "How many points did Kevin Duran score with Victor Wembanyama?"
+    unresolved_words = gazetteer.find_unresolved_words(text, gazetteer.find_spans(text))
+    assert sorted(unresolved_words) == ["Duran", "Kevin", "Victor", "Wembanyama"]
+
+    text = "how many points did steph curry score?"
+    assert gazetteer.find_unresolved_words(text, gazetteer.find_spans(text)) == ["steph"]
+
+
+def test_gazetteer_surnames_which_are_common_words() -> None:
+    gazetteer = Gazetteer([*PLAYERS_NAMES, "Derrick Rose", "Kevin Love"], TEAMS_NAMES)
+
+    # "Rose" alone isn't resolved, but is reported so that the question goes through the LLM NER
+    text = "How many points did Rose score in 2011?"
+    assert gazetteer.find_spans(text) == []
+    assert gazetteer.find_unresolved_words(text, []) == ["Rose"]
+
+    text = "Did Kevin Love score more points than Derrick Rose?"
+    spans = gazetteer.find_spans(text)
+    assert [span.name for span in spans] == ["Kevin Love", "Derrick Rose"]
+    assert gazetteer.find_unresolved_words(text, spans) == []
+
+    # Not capitalized, they are the common words
+    text = "how many points rose in 2011"
+    assert gazetteer.find_unresolved_words(text, gazetteer.find_spans(text)) == []
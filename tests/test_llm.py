@@ -0,0 +1,123 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+import threading
+from collections.abc import Iterator
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+from openai import AsyncOpenAI
+from pydantic import SecretStr
+
+from app import llm
+from app.llm import LLMClientRegistry, LLMEndpoint
+from app.llm_cache import LLMResponseCache
+from app.retry import CircuitBreaker, RetryPolicy, RetryScheduler
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def make_registry() -> LLMClientRegistry:
+    return LLMClientRegistry(
+        max_connections=4, max_keepalive_connections=2, keepalive_expiry=5.0, max_concurrent_requests_per_endpoint=1
+    )
+
+
+def test_llm_client_registry_reuses_clients() -> None:
+    registry = make_registry()
+    endpoint = LLMEndpoint(base_url="http://localhost:11434/v1", model="qwen2.5:7b", api_key=SecretStr("ollama"))
+    other_model_endpoint = endpoint.model_copy(update={"model": "llama3.2:3b"})
+    other_endpoint = endpoint.model_copy(update={"base_url": "https://openrouter.ai/api/v1"})
+
+    client = registry.get_client(endpoint)
+    assert registry.get_client(endpoint) is client
+    assert registry.get_client(other_model_endpoint) is client
+    assert registry.get_client(other_endpoint) is not client
+
+    assert registry.stats.clients_created == 2
+    assert registry.stats.client_reuses == 2
+    registry.close()
+
+
+def test_llm_client_registry_concurrency_slot() -> None:
+    registry = make_registry()
+    endpoint = LLMEndpoint(base_url="http://localhost:11434/v1", model="qwen2.5:7b", api_key=SecretStr("ollama"))
+
+    with registry.concurrency_slot(endpoint):
+        semaphore = registry._semaphores[endpoint.base_url]
+        assert not semaphore.acquire(blocking=False)
+    assert semaphore.acquire(blocking=False)
+
+
+def test_stream_query_llm_closed_trial(monkeypatch: pytest.MonkeyPatch) -> None:
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout_seconds=0)
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=1), circuit_breaker=circuit_breaker)
+    circuit_breaker.record_failure()
+
+    def fake_stream_llm_request(client: object, model: str, prompt: str, temperature: float) -> Iterator[str]:  # noqa: ARG001
+        yield from ["Some ", "long ", "response"]
+
+    monkeypatch.setattr(llm, "get_llm_retry_scheduler", lambda base_url: scheduler)  # noqa: ARG005
+    monkeypatch.setattr(llm, "get_llm_response_cache", lambda: None)
+    monkeypatch.setattr(llm, "stream_llm_request", fake_stream_llm_request)
+
+    # The half open circuit lets a trial through, whose stream is closed after its first token
+    with closing(llm.stream_query_llm("prompt", model_kind="heavy")) as tokens:
+        assert next(tokens) == "Some "
+    assert circuit_breaker.state == "half_open"
+    assert "".join(llm.stream_query_llm("prompt", model_kind="heavy")) == "Some long response"
+    assert circuit_breaker.state == "closed"
+
+
+def test_stream_query_llm_caches_stopped_response_apart(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    llm_response_cache = LLMResponseCache(
+        tmp_path / "cache.sqlite", ttl_seconds=60, max_memory_entries=10, max_disk_size_bytes=10**6
+    )
+
+    def fake_stream_llm_request(client: object, model: str, prompt: str, temperature: float) -> Iterator[str]:  # noqa: ARG001
+        yield from ["SELECT 1;", " Some explanation"]
+
+    def is_complete(text: str) -> bool:
+        return text.endswith(";")
+
+    monkeypatch.setattr(llm, "get_llm_response_cache", lambda: llm_response_cache)
+    monkeypatch.setattr(llm, "stream_llm_request", fake_stream_llm_request)
+
+    assert "".join(llm.stream_query_llm("prompt", model_kind="heavy", is_complete=is_complete)) == "SELECT 1;"
+    assert "".join(llm.stream_query_llm("prompt", model_kind="heavy", is_complete=is_complete)) == "SELECT 1;"
+    assert llm_response_cache.stats.memory_hits == 1
+
+    # The response cut short isn't served to the queries of the full response
+    assert "".join(llm.stream_query_llm("prompt", model_kind="heavy")) == "SELECT 1; Some explanation"
+    endpoint = llm.get_llm_endpoint("heavy")
+    assert llm_response_cache.get(llm.get_llm_cache_key(endpoint, "prompt", 0.0, None)) == "SELECT 1; Some explanation"
+
+
+def test_llm_client_registry_closes_async_clients() -> None:
+    registry = make_registry()
+    endpoint = LLMEndpoint(base_url="http://localhost:11434/v1", model="qwen2.5:7b", api_key=SecretStr("ollama"))
+
+    async def get_async_client() -> AsyncOpenAI:
+        return registry.get_async_client(endpoint)
+
+    async def use_and_close_async_client() -> AsyncOpenAI:
+        client = await get_async_client()
+        await registry.aclose()
+        return client
+
+    # Closed by the owner of the loop before it stops
+    assert asyncio.run(use_and_close_async_client()).is_closed()
+
+    # Closed on its loop, still running in another thread
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    client = asyncio.run_coroutine_threadsafe(get_async_client(), loop).result()
+    registry.close()
+    assert client.is_closed()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
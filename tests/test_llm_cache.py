@@ -0,0 +1,70 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from pathlib import Path
+
+import pytest
+from pydantic import BaseModel
+
+from app.llm_cache import LLMResponseCache, make_llm_cache_key
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+class PlayersAndTeams(BaseModel):
+    players: list[str]
+    teams: list[str]
+
+
+def test_make_llm_cache_key() -> None:
+    key = make_llm_cache_key("qwen2.5:7b", "http://localhost:11434/v1", "prompt", 0.0, None)
+
+    assert key == make_llm_cache_key("qwen2.5:7b", "http://localhost:11434/v1", "prompt", 0.0, None)
+    assert key != make_llm_cache_key("qwen2.5:7b", "http://localhost:11434/v1", "other prompt", 0.0, None)
+    assert key != make_llm_cache_key("mistral:7b", "http://localhost:11434/v1", "prompt", 0.0, None)
+    assert key != make_llm_cache_key("qwen2.5:7b", "http://localhost:11434/v1", "prompt", 0.5, None)
+    assert key != make_llm_cache_key("qwen2.5:7b", "http://localhost:11434/v1", "prompt", 0.0, PlayersAndTeams)
+    assert key != make_llm_cache_key("qwen2.5:7b", "http://localhost:11434/v1", "prompt", 0.0, None, "is_complete")
+
+
+def test_llm_response_cache_round_trip(tmp_path: Path) -> None:
+    cache = LLMResponseCache(
+        tmp_path / "cache.sqlite", ttl_seconds=60, max_memory_entries=10, max_disk_size_bytes=10**6
+    )
+    cache.set("text", "Some **markdown**")
+    cache.set("structured", PlayersAndTeams(players=["LeBron James"], teams=[]))
+
+    assert cache.get("text") == "Some **markdown**"
+    assert cache.get("structured", PlayersAndTeams) == PlayersAndTeams(players=["LeBron James"], teams=[])
+    assert cache.get("missing") is None
+    assert (cache.stats.memory_hits, cache.stats.disk_hits, cache.stats.misses) == (2, 0, 1)
+
+    # A new cache on the same file reads the responses from disk
+    cache = LLMResponseCache(
+        tmp_path / "cache.sqlite", ttl_seconds=60, max_memory_entries=10, max_disk_size_bytes=10**6
+    )
+    assert cache.get("structured", PlayersAndTeams) == PlayersAndTeams(players=["LeBron James"], teams=[])
+    assert cache.stats.disk_hits == 1
+
+
+def test_llm_response_cache_ttl(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = LLMResponseCache(
+        tmp_path / "cache.sqlite", ttl_seconds=60, max_memory_entries=10, max_disk_size_bytes=10**6
+    )
+    monkeypatch.setattr("app.llm_cache.time.time", lambda: 1000.0)
+    cache.set("text", "response")
+
+    monkeypatch.setattr("app.llm_cache.time.time", lambda: 1061.0)
+    assert cache.get("text") is None
+
+
+def test_llm_response_cache_eviction(tmp_path: Path) -> None:
+    cache = LLMResponseCache(tmp_path / "cache.sqlite", ttl_seconds=60, max_memory_entries=2, max_disk_size_bytes=200)
+    for i in range(5):
+        cache.set(f"key-{i}", "x" * 50)
+
+    assert len(cache._memory) == 2
+    assert cache.get("key-0") is None
+    assert cache.get("key-4") == "x" * 50
+    assert cache.stats.evictions > 0
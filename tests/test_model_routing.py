@@ -0,0 +1,72 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import pytest
+
+from app.configuration import get_config
+from app.db.query_guard import SqlExecutionError
+from app.logic import question_to_sql
+from app.logic.model_routing import RoutingStats, extract_routing_features, route_question
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def test_simple_question_is_less_complex() -> None:
+    simple_features = extract_routing_features("Which player scored the most points?", num_tables=2, num_entities=0)
+    complex_features = extract_routing_features(
+        "What is the average number of points per game of LeBron James in each season since 2015?",
+        num_tables=4,
+        num_entities=1,
+    )
+
+    assert simple_features.num_aggregation_keywords == 1
+    assert simple_features.complexity == 0
+    assert complex_features.num_temporal_keywords == 3  # "season", "since" and "2015"  # noqa: PLR2004
+    assert complex_features.num_derived_keywords == 2  # noqa: PLR2004
+    assert complex_features.complexity > simple_features.complexity
+
+
+def test_route_question_threshold() -> None:
+    features = extract_routing_features("How many games were played in 2020?", num_tables=1, num_entities=0)
+
+    assert features.complexity == 1
+    assert route_question(features, max_light_complexity=1).model_kind == "light"
+    assert route_question(features, max_light_complexity=0).model_kind == "heavy"
+
+
+def test_saved_seconds() -> None:
+    routing_stats = RoutingStats(light_generations=2, light_seconds=2.0, escalation_seconds=1.0)
+    assert routing_stats.saved_seconds is None
+
+    routing_stats.heavy_generations, routing_stats.heavy_seconds = 2, 6.0
+    assert routing_stats.saved_seconds == pytest.approx(2 * 3.0 - 2.0 - 1.0)
+
+
+@pytest.mark.parametrize(
+    ("light_llm_response", "is_escalated"),
+    [("```sql\nSELECT 1\n```", False), ("```sql\nSELEC 1\n```", True), ("No query", True)],
+)
+def test_light_generation_is_escalated_if_invalid(
+    monkeypatch: pytest.MonkeyPatch, light_llm_response: str, is_escalated: bool
+) -> None:
+    def fake_query_llm(prompt: str, model_kind: str) -> str:  # noqa: ARG001
+        return light_llm_response if model_kind == "light" else "```sql\nSELECT 2\n```"
+
+    def fake_validate_sql_query(sql_query: str) -> None:
+        if "SELEC " in sql_query:
+            error_msg = "Parser Error"
+            raise SqlExecutionError(error_msg, sql_query)
+
+    monkeypatch.setattr(get_config(), "sql_model_routing_enabled", True)
+    monkeypatch.setattr(get_config(), "sql_cache_enabled", False)
+    monkeypatch.setattr(get_config(), "sql_templates_enabled", False)
+    monkeypatch.setattr(question_to_sql, "get_question_db_description", lambda question: "Table: game")  # noqa: ARG005
+    monkeypatch.setattr(question_to_sql, "route_sql_generation", lambda question: "light")  # noqa: ARG005
+    monkeypatch.setattr(question_to_sql, "query_llm", fake_query_llm)
+    monkeypatch.setattr(question_to_sql, "validate_sql_query", fake_validate_sql_query)
+
+    sql_generation = question_to_sql.generate_sql_query("How many games?", thinking_mode=False)
+
+    assert sql_generation.model_kind == ("heavy" if is_escalated else "light")
+    assert sql_generation.sql_query.strip() == ("SELECT 2" if is_escalated else "SELECT 1")
@@ -1,4 +1,9 @@
-from app.logic.ner_retrieval import get_closest_player_name, get_closest_team_name
+import pytest
+
+from app.logic import ner_retrieval
+from app.logic.entity_index import EntityIndex
+from app.logic.gazetteer import Gazetteer
+from app.logic.ner_retrieval import PlayersAndTeams, get_closest_player_name, get_closest_team_name
 
 
 def test_get_closest_player_name() -> None:
@@ -31,3 +36,37 @@ def test_get_closest_team_name() -> None:
     assert get_closest_team_name("Warriors", teams_names) == "Golden State Warriors"
     assert get_closest_team_name("Brooklyn Net", teams_names) == "Brooklyn Nets"
     assert get_closest_team_name("Miami Hea", teams_names) == "Miami Heat"
+
+
+def test_resolve_names_in_text(monkeypatch: pytest.MonkeyPatch) -> None:
+    players_names = ["LeBron James", "Paul Pierce", "Victor Wembanyama"]
+    teams_names = ["Boston Celtics", "San Antonio Spurs"]
+    monkeypatch.setattr(ner_retrieval, "get_gazetteer", lambda: Gazetteer(players_names, teams_names))
+    monkeypatch.setattr(ner_retrieval, "get_players_index", lambda: EntityIndex(players_names))
+    monkeypatch.setattr(ner_retrieval, "get_teams_index", lambda: EntityIndex(teams_names))
+
+    def fake_query_llm(prompt: str, model_kind: str, structured_output: type) -> PlayersAndTeams:
+        assert (model_kind, structured_output) == ("light", PlayersAndTeams)
+        assert "How many points did Victor wembanyam score against the celtics?" in prompt
+        return PlayersAndTeams(players=["victor wembanyam"], teams=["Celtics"])
+
+    # All the names are in the gazetteer: the LLM is skipped
+    monkeypatch.setattr(ner_retrieval, "query_llm", None)
+    resolved_names = ner_retrieval.resolve_names_in_text("Did Pierce play for the celtics?")
+    assert resolved_names.text == "Did Paul Pierce play for the Boston Celtics?"
+    assert not resolved_names.used_llm
+
+    # A misspelled name remains: the LLM NER completes the names found by the gazetteer
+    monkeypatch.setattr(ner_retrieval, "query_llm", fake_query_llm)
+    resolved_names = ner_retrieval.resolve_names_in_text(
+        "How many points did Victor wembanyam score against the celtics?"
+    )
+    assert resolved_names.text == "How many points did Victor Wembanyama score against the Boston Celtics?"
+    assert resolved_names.used_llm
+
+
+def test_find_gazetteer_spans_with_ambiguous_surname(monkeypatch: pytest.MonkeyPatch) -> None:
+    gazetteer = Gazetteer(["Derrick Rose", "Kevin Love"], ["Chicago Bulls"])
+    monkeypatch.setattr(ner_retrieval, "get_gazetteer", lambda: gazetteer)
+
+    assert ner_retrieval.find_gazetteer_spans("How many points did Rose score in 2011?") == ([], True)
@@ -0,0 +1,153 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+from typing import Optional
+
+import pyarrow as pa
+import pytest
+from pydantic import SecretStr
+
+from app.configuration import get_config
+from app.db.query_guard import SqlExecutionError
+from app.llm import LLMClientRegistry, LLMEndpoint
+from app.logic import pipeline
+from app.logic.question_to_sql import SqlGeneration
+from app.tracing import CURRENT_TRACE, start_trace
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def test_answer_question(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def fake_areplace_names_in_text(text: str) -> str:
+        return text.replace("lebron", "LeBron James")
+
+    async def fake_agenerate_sql_query(question: str, thinking_mode: bool, db_description: str) -> SqlGeneration:
+        assert question == "Max points of LeBron James?"
+        assert not thinking_mode
+        assert db_description == "Table: player"
+        return SqlGeneration(sql_query="select 61 max_points", source="llm")
+
+    async def fake_agenerate_question_response_md(question: str, result: pa.Table) -> str:
+        return f"{question} {result['max_points'][0]}"
+
+    monkeypatch.setattr(pipeline, "areplace_names_in_text", fake_areplace_names_in_text)
+    monkeypatch.setattr(pipeline, "get_db_description", lambda: "Table: player\n\nTable: team")
+    monkeypatch.setattr(pipeline, "get_question_db_description", lambda question: "Table: player")  # noqa: ARG005
+    monkeypatch.setattr(pipeline, "agenerate_sql_query", fake_agenerate_sql_query)
+    monkeypatch.setattr(pipeline, "sql_to_arrow", lambda _: pa.table({"max_points": [61]}))
+    monkeypatch.setattr(pipeline, "agenerate_question_response_md", fake_agenerate_question_response_md)
+    cached_sql_queries = []
+    monkeypatch.setattr(pipeline, "cache_sql_query", lambda *args: cached_sql_queries.append(args))
+
+    answer = asyncio.run(pipeline.answer_question("Max points of lebron?"))
+
+    assert answer.clean_question == "Max points of LeBron James?"
+    assert answer.sql_query == "select 61 max_points"
+    assert answer.sql_source == "llm"
+    assert cached_sql_queries == [("Max points of LeBron James?", "select 61 max_points")]
+    assert answer.response_md == "**Max points**: 61"
+    assert answer.response_source == "template"
+
+    # The LLM summary is opt-in
+    monkeypatch.setattr(get_config(), "result_summary_llm_enabled", True)
+    answer = asyncio.run(pipeline.answer_question("Max points of lebron?"))
+    assert answer.response_md == "Max points of LeBron James? 61"
+    assert answer.response_source == "llm"
+
+    # Large results are summarized from their digest, unless disabled
+    monkeypatch.setattr(pipeline, "sql_to_arrow", lambda _: pa.table({"max_points": list(range(100))}))
+    answer = asyncio.run(pipeline.answer_question("Max points of lebron?"))
+    assert answer.response_source == "llm"
+    monkeypatch.setattr(get_config(), "large_result_summary_enabled", False)
+    answer = asyncio.run(pipeline.answer_question("Max points of lebron?"))
+    assert answer.response_md is None
+
+
+def test_clean_question_and_generate_sql_query_speculative(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def fake_areplace_names_in_text(text: str) -> str:
+        await asyncio.sleep(0.01)
+        return text.replace("lebron", "LeBron James")
+
+    generated_questions, cancelled_questions = [], []
+
+    async def fake_agenerate_sql_query(question: str, thinking_mode: bool, db_description: str = "") -> SqlGeneration:  # noqa: ARG001
+        generated_questions.append(question)
+        try:
+            await asyncio.sleep(0.01 if question.startswith("Max") else 1)
+        except asyncio.CancelledError:
+            cancelled_questions.append(question)
+            raise
+        return SqlGeneration(sql_query=f"select '{question}'", source="llm")
+
+    monkeypatch.setattr(pipeline, "areplace_names_in_text", fake_areplace_names_in_text)
+    monkeypatch.setattr(pipeline, "get_db_description", lambda: "Table: player")
+    monkeypatch.setattr(pipeline, "get_question_db_description", lambda question: "Table: player")  # noqa: ARG005
+    monkeypatch.setattr(pipeline, "agenerate_sql_query", fake_agenerate_sql_query)
+    pipeline.get_speculation_stats.cache_clear()
+
+    # Hit: the question is unchanged by the NER, its speculative SQL query is used
+    clean_question, sql_generation = asyncio.run(
+        pipeline.aclean_question_and_generate_sql_query("Max points of LeBron James?", False, speculative=True)
+    )
+    assert clean_question == "Max points of LeBron James?"
+    assert sql_generation.sql_query == "select 'Max points of LeBron James?'"
+    assert generated_questions == ["Max points of LeBron James?"]
+
+    # Miss: the question is changed by the NER, its speculative SQL query is cancelled
+    clean_question, sql_generation = asyncio.run(
+        pipeline.aclean_question_and_generate_sql_query("points of lebron?", False, speculative=True)
+    )
+    assert sql_generation.sql_query == "select 'points of LeBron James?'"
+    assert cancelled_questions == ["points of lebron?"]
+    assert pipeline.get_speculation_stats() == pipeline.SpeculationStats(hits=1, misses=1, cancellations=1)
+    assert pipeline.get_speculation_stats().hit_rate == 0.5
+
+
+def test_run_in_background_loop_reuses_async_clients() -> None:
+    registry = LLMClientRegistry(
+        max_connections=4, max_keepalive_connections=2, keepalive_expiry=5.0, max_concurrent_requests_per_endpoint=1
+    )
+    endpoint = LLMEndpoint(base_url="http://localhost:11434/v1", model="qwen2.5:7b", api_key=SecretStr("ollama"))
+
+    async def get_async_client_and_trace() -> tuple:
+        return registry.get_async_client(endpoint), CURRENT_TRACE.get()
+
+    # Each rerun of the app runs its coroutines on the same loop, so they share the async clients of the loop
+    with start_trace("question") as trace:
+        client, run_trace = pipeline.run_in_background_loop(get_async_client_and_trace())
+    assert run_trace is trace
+    assert pipeline.run_in_background_loop(get_async_client_and_trace()) == (client, None)
+    assert registry.stats.clients_created == 1
+    registry.close()
+
+
+def test_answer_question_cached_query_fails(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def fake_agenerate_sql_query(
+        question: str,  # noqa: ARG001
+        thinking_mode: bool,  # noqa: ARG001
+        db_description: Optional[str] = None,  # noqa: ARG001
+        use_local_generation: bool = True,
+    ) -> SqlGeneration:
+        if use_local_generation:
+            return SqlGeneration(sql_query="select max(pts) max_points", source="cache")
+        return SqlGeneration(sql_query="select 61 max_points", source="llm")
+
+    def fake_sql_to_arrow(sql_query: str) -> pa.Table:
+        if "pts" in sql_query:
+            error_msg = 'Referenced column "pts" not found'
+            raise SqlExecutionError(error_msg, sql_query)
+        return pa.table({"max_points": [61]})
+
+    monkeypatch.setattr(pipeline, "areplace_names_in_text", lambda text: asyncio.sleep(0, text))
+    monkeypatch.setattr(pipeline, "get_db_description", lambda: "Table: player")
+    monkeypatch.setattr(pipeline, "get_question_db_description", lambda question: "Table: player")  # noqa: ARG005
+    monkeypatch.setattr(pipeline, "agenerate_sql_query", fake_agenerate_sql_query)
+    monkeypatch.setattr(pipeline, "sql_to_arrow", fake_sql_to_arrow)
+    monkeypatch.setattr(pipeline, "cache_sql_query", lambda *args: None)  # noqa: ARG005
+
+    # The query of the similar cached question failed: it is generated by the LLM
+    answer = asyncio.run(pipeline.answer_question("Max points of LeBron James?", speculative=False))
+    assert (answer.sql_query, answer.sql_source) == ("select 61 max_points", "llm")
+    assert answer.result["max_points"].to_pylist() == [61]
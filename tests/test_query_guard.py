@@ -0,0 +1,57 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import time
+
+import duckdb
+import pytest
+
+from app.db.query_guard import (
+    SqlCostError,
+    SqlExecutionError,
+    SqlTimeoutError,
+    guard_sql_query,
+    limit_sql_query,
+    query_deadline,
+)
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+@pytest.fixture
+def cursor() -> duckdb.DuckDBPyConnection:
+    connection = duckdb.connect()
+    connection.execute("create table game_boxscore as select range % 100 player_id, range points from range(10000)")
+    return connection.cursor()
+
+
+def test_guard_sql_query(cursor: duckdb.DuckDBPyConnection) -> None:
+    def guard(sql_query: str) -> str:
+        return guard_sql_query(cursor, sql_query, max_estimated_cardinality=1_000_000, max_estimated_rows=1000)
+
+    sql_query = "select player_id, max(points) from game_boxscore where player_id = 1 group by 1"
+    assert guard(sql_query) == sql_query
+
+    sql_query = "select * from game_boxscore order by points desc;"
+    assert guard(sql_query) == limit_sql_query(sql_query, 1000)
+    assert len(cursor.sql(guard(sql_query)).fetchall()) == 1000
+    assert cursor.sql(guard(sql_query)).fetchone() == (99, 9999)
+
+    with pytest.raises(SqlCostError):
+        guard("select count(*) from game_boxscore a, game_boxscore b")
+    with pytest.raises(SqlExecutionError, match="invalid"):
+        guard("select * from team")
+
+
+def test_query_deadline(cursor: duckdb.DuckDBPyConnection) -> None:
+    start_time = time.perf_counter()
+    with pytest.raises(SqlTimeoutError), query_deadline(cursor, "", timeout_seconds=0.1):
+        cursor.sql("select count(*) from game_boxscore a, game_boxscore b, game_boxscore c").fetchall()
+    assert time.perf_counter() - start_time < 5
+
+    # The cursor can be reused, and isn't interrupted once its query has run
+    with query_deadline(cursor, "", timeout_seconds=0.1):
+        assert cursor.sql("select count(*) from game_boxscore").fetchone() == (10000,)
+    time.sleep(0.2)
+    assert cursor.sql("select 1").fetchone() == (1,)
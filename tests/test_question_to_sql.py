@@ -1,9 +1,19 @@
 # -------------------------------------------------------------------------------------------------------------------- #
 # Imports
 
+from collections.abc import Iterator
+from pathlib import Path
+
+import duckdb
 import pytest
 
-from app.logic.question_to_sql import extract_sql_query
+from app import llm
+from app.configuration import get_config
+from app.db import connection
+from app.llm_cache import LLMResponseCache
+from app.logic import question_to_sql
+from app.logic.ner_retrieval import get_players_index
+from app.logic.question_to_sql import extract_sql_query, is_sql_query_complete, stream_sql_query_generation
 
 # -------------------------------------------------------------------------------------------------------------------- #
 # Tests
@@ -42,3 +52,94 @@ SELECT * FROM teams WHERE wins > 50
 """
     expected_query = "\nSELECT * FROM players WHERE points_per_game > 20\n"
     assert extract_sql_query(text) == expected_query
+
+
+# test_is_sql_query_complete
+
+
+def test_is_sql_query_complete() -> None:
+    assert not is_sql_query_complete("<thinking>Use the game_boxscore table</thinking>")
+    assert not is_sql_query_complete("```sql\nSELECT max(points) FROM game_boxscore")
+    assert not is_sql_query_complete("```sql\nSELECT max(points) FROM game_boxscore\n`")
+    assert is_sql_query_complete("```sql\nSELECT max(points) FROM game_boxscore\n```")
+
+
+# test_stream_sql_query_generation
+
+
+def test_stream_sql_query_generation_stops_after_sql_query(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    tokens = ["<thinking>Max points</thinking>\n", "```sql\n", "SELECT max(points)", " FROM game_boxscore\n", "```"]
+    consumed_tokens = []
+
+    def fake_stream_llm_request(client: object, model: str, prompt: str, temperature: float) -> Iterator[str]:  # noqa: ARG001
+        assert "What is the max number of points?" in prompt
+        assert model == get_config().heavy_llm_model
+        for token in [*tokens, "\nSome explanation nobody needs", " ..."]:
+            consumed_tokens.append(token)
+            yield token
+
+    llm_response_cache = LLMResponseCache(
+        tmp_path / "cache.sqlite", ttl_seconds=60, max_memory_entries=10, max_disk_size_bytes=10**6
+    )
+    monkeypatch.setattr(question_to_sql, "get_question_db_description", lambda question: "Table: game_boxscore")  # noqa: ARG005
+    monkeypatch.setattr(llm, "stream_llm_request", fake_stream_llm_request)
+    monkeypatch.setattr(llm, "get_llm_response_cache", lambda: llm_response_cache)
+
+    llm_response = "".join(stream_sql_query_generation("What is the max number of points?", thinking_mode=True))
+
+    assert consumed_tokens == tokens
+    assert extract_sql_query(llm_response) == "\nSELECT max(points) FROM game_boxscore\n"
+
+    # The response was cached once its SQL query was complete
+    consumed_tokens.clear()
+    assert "".join(stream_sql_query_generation("What is the max number of points?", thinking_mode=True)) == llm_response
+    assert consumed_tokens == []
+    assert llm_response_cache.stats.memory_hits == 1
+
+
+def test_get_db_description_is_cached_until_db_changes(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    def fake_get_tables_columns() -> dict[str, list[tuple[str, str]]]:
+        calls.append(1)
+        return {"player": [("id", "VARCHAR"), ("player_name", "VARCHAR")], "team": [("id", "VARCHAR")]}
+
+    db_fingerprint = "v1"
+    monkeypatch.setattr(question_to_sql, "get_tables_columns", fake_get_tables_columns)
+    monkeypatch.setattr(question_to_sql, "get_db_fingerprint", lambda: db_fingerprint)
+    question_to_sql.load_tables_columns.cache_clear()
+    question_to_sql.load_db_description.cache_clear()
+
+    db_description = question_to_sql.get_db_description()
+    assert db_description == "Table: player\n  - id: VARCHAR\n  - player_name: VARCHAR\n\nTable: team\n  - id: VARCHAR"
+    assert question_to_sql.get_db_description() == db_description
+    assert len(calls) == 1
+
+    db_fingerprint = "v2"
+    question_to_sql.get_db_description()
+    assert len(calls) == 2
+    question_to_sql.load_tables_columns.cache_clear()
+    question_to_sql.load_db_description.cache_clear()
+
+
+def test_db_loaders_reload_replaced_db(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    db_path, new_db_path = tmp_path / "db.duckdb", tmp_path / "new_db.duckdb"
+    for path, player_name in ((db_path, "Old Guy"), (new_db_path, "New Guy")):
+        with duckdb.connect(path) as db_connection:
+            db_connection.execute(f"create table player as select '{player_name}' player_name")
+            if path == new_db_path:
+                db_connection.execute("create table team as select 'Miami Heat' team_name")
+    monkeypatch.setattr(connection, "DB_PATH", db_path)
+    connection.get_db_pool.cache_clear()
+
+    try:
+        assert get_players_index().normalized_to_original_name == {"old guy": "Old Guy"}
+        assert "Table: team" not in question_to_sql.get_db_description()
+
+        # The loaders are keyed on the fingerprint of the file, and read it through the connection reopened on it
+        new_db_path.replace(db_path)
+        assert get_players_index().normalized_to_original_name == {"new guy": "New Guy"}
+        assert "Table: team" in question_to_sql.get_db_description()
+    finally:
+        connection.get_db_pool().close()
+        connection.get_db_pool.cache_clear()
@@ -0,0 +1,72 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from pathlib import Path
+
+import pyarrow as pa
+
+from app.db.result_cache import ResultCache, make_result_cache_key, normalize_sql_query
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def make_result(num_rows: int) -> pa.Table:
+    return pa.table({"points": list(range(num_rows))})
+
+
+def test_normalize_sql_query() -> None:
+    sql_query = "SELECT max(points)\n  FROM game_boxscore -- Best game\nWHERE player_name = 'LeBron  James';"
+    assert normalize_sql_query(sql_query) == (
+        "select max(points) from game_boxscore where player_name = 'LeBron  James'"
+    )
+    assert normalize_sql_query("select /* all */ * from  player") == normalize_sql_query("select * from player")
+    assert normalize_sql_query("select '--' x") == "select '--' x"
+
+    key = make_result_cache_key("select 1", "db_v1", 10, 100)
+    assert key != make_result_cache_key("select 1", "db_v2", 10, 100)
+    assert key != make_result_cache_key("select 1", "db_v1", 20, 100)
+    assert key != make_result_cache_key("select 1", "db_v1", 10, 200)
+
+
+def test_result_cache(tmp_path: Path) -> None:
+    result_size = make_result(100).nbytes
+    max_memory_size_bytes = 2 * result_size + result_size // 2  # Results read from Parquet are slightly larger
+    result_cache = ResultCache(tmp_path, max_memory_size_bytes, max_disk_size_bytes=10 * result_size)
+    for key in ("a", "b", "c"):
+        result_cache.set(key, make_result(100), db_fingerprint="db_v1")
+
+    # The least recently used result was spilled to disk, and moves back to memory when read
+    assert result_cache.memory_size_bytes == 2 * result_size
+    assert result_cache.stats.spills == 1
+    assert (tmp_path / "a.parquet").exists()
+    assert result_cache.get("a") == make_result(100)
+    assert result_cache.stats.disk_hits == 1
+    assert not (tmp_path / "a.parquet").exists()
+    assert result_cache.get("c") == make_result(100)
+    assert result_cache.stats.memory_hits == 1
+
+    # A result larger than the memory budget is kept on disk
+    result_cache.set("d", make_result(1000), db_fingerprint="db_v1")
+    assert (tmp_path / "d.parquet").exists()
+    assert result_cache.get("d") == make_result(1000)
+
+    # Spilled results survive restarts
+    assert ResultCache(tmp_path, max_memory_size_bytes, 10 * result_size).get("d") == make_result(1000)
+
+    # All the results are deleted once the database changes
+    result_cache.set("e", make_result(10), db_fingerprint="db_v2")
+    assert result_cache.get("a") is None
+    assert result_cache.get("d") is None
+    assert list(tmp_path.iterdir()) == []
+    assert result_cache.get("e") == make_result(10)
+
+
+def test_result_cache_disk_eviction(tmp_path: Path) -> None:
+    result_cache = ResultCache(tmp_path, max_memory_size_bytes=0, max_disk_size_bytes=1)
+    result_cache.set("a", make_result(100), db_fingerprint="db_v1")
+    result_cache.set("b", make_result(100), db_fingerprint="db_v1")
+
+    assert result_cache.get("a") is None
+    assert result_cache.stats.evictions == 2
+    assert result_cache.disk_size_bytes == 0
@@ -0,0 +1,70 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import datetime
+
+import pyarrow as pa
+
+from app.logic.result_profile import build_result_digest, profile_result
+from app.logic.schema_selection import estimate_num_tokens
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def make_result(num_rows: int) -> pa.Table:
+    return pa.table(
+        {
+            "player_name": (["LeBron James", "Kobe Bryant", "LeBron James", None] * num_rows)[:num_rows],
+            "points": list(range(num_rows)),
+            "date": [datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 365) for i in range(num_rows)],
+        }
+    )
+
+
+def test_profile_result() -> None:
+    player_name, points, date = profile_result(make_result(8), top_k=1).columns
+
+    assert player_name.num_nulls == 2
+    assert player_name.num_distinct == 2
+    assert player_name.top_values == [("LeBron James", 4)]
+    assert (points.min, points.max, points.mean) == (0, 7, 3.5)
+    assert points.num_distinct is None
+    assert (date.min, date.max) == (datetime.date(2020, 1, 1), datetime.date(2020, 1, 8))
+
+
+def test_build_result_digest() -> None:
+    digest = build_result_digest(make_result(100), max_num_tokens=1000)
+    assert digest.startswith("Number of rows: 100\n")
+    assert "- `points` (int64): min 0, max 99; mean 49.5" in digest
+    assert "First 10 rows:" in digest
+
+    # The size of the digest doesn't depend on the number of rows, leading rows are dropped to fit in the budget
+    large_digest = build_result_digest(make_result(100_000), max_num_tokens=1000)
+    assert large_digest.startswith("Number of rows: 100000\n")
+    assert len(large_digest) < len(digest) + 100
+    small_digest = build_result_digest(make_result(100), max_num_tokens=120)
+    assert estimate_num_tokens(small_digest) <= 120
+    assert "First 10 rows:" not in small_digest
+
+
+def test_build_result_digest_of_wide_result() -> None:
+    # 30 columns of long strings: the statistics alone exceed the budget
+    values = [f"a long string value of the result, number {i}" for i in range(50)]
+    result = pa.table({f"column_with_a_long_name_{i}": values for i in range(30)})
+
+    # Fewer most frequent values are described
+    digest = build_result_digest(result, max_num_tokens=1000)
+    assert estimate_num_tokens(digest) <= 1000  # noqa: PLR2004
+    assert "First" not in digest
+    assert digest.count("- `column_with_a_long_name_") == 20  # noqa: PLR2004
+    assert 0 < digest.count("(1)") < 20 * 5
+
+    # Then fewer columns
+    digest = build_result_digest(result, max_num_tokens=200)
+    assert estimate_num_tokens(digest) <= 200  # noqa: PLR2004
+    assert "most frequent" not in digest
+    assert "- `column_with_a_long_name_0` (string): 50 distinct values\n" in digest
+    assert "more columns" in digest
+
+    assert build_result_digest(result, max_num_tokens=10) == "Number of rows: 50\n\nColumns:\n- ... and 30 more columns"
@@ -0,0 +1,25 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import pyarrow as pa
+
+from app.logic.results_display import render_template_response_md
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def test_render_template_response_md() -> None:
+    assert render_template_response_md(pa.table({"max_points": [61]})) == "**Max points**: 61"
+    assert render_template_response_md(pa.table({"player_name": ["LeBron James"], "avg_points": [27.123]})) == (
+        "- **Player name**: LeBron James\n- **Avg points**: 27.12"
+    )
+    assert render_template_response_md(pa.table({"season": ["2003", "2004"], "total_points": [1654, None]})) == (
+        "1. **2003**: 1654 total points\n2. **2004**: *no value* total points"
+    )
+    assert render_template_response_md(pa.table({"max_points": pa.array([], pa.int64())})) == (
+        "No result matches the question."
+    )
+
+    # Other shapes are summarized by the LLM
+    assert render_template_response_md(pa.table({"a": [1, 2], "b": [3, 4], "c": [5, 6]})) is None
@@ -0,0 +1,158 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+
+import httpx
+import pytest
+
+from app.retry import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    RetryScheduler,
+    TokenBucket,
+    get_retry_after_seconds,
+    is_retryable_error,
+)
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+class APIError(Exception):
+    def __init__(self, status_code: int, headers: dict[str, str] | None = None) -> None:
+        super().__init__(f"Error {status_code}")
+        self.status_code = status_code
+        self.response = httpx.Response(status_code, headers=headers or {})
+
+
+class FlakyFunction:
+    """Function raising the given errors on its first calls, then returning "ok"."""
+
+    def __init__(self, errors: list[Exception]) -> None:
+        self.errors = errors
+        self.num_calls = 0
+
+    def __call__(self) -> str:
+        self.num_calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retry_policy_backoff_delay() -> None:
+    policy = RetryPolicy(base_delay_seconds=1.0, max_delay_seconds=5.0)
+    assert all(0 <= policy.backoff_delay(attempt) <= min(5.0, 2**attempt) for attempt in range(10))
+
+
+def test_get_retry_after_seconds() -> None:
+    assert get_retry_after_seconds(APIError(429, {"retry-after": "12"})) == 12
+    assert get_retry_after_seconds(APIError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after_seconds(APIError(429, {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert get_retry_after_seconds(APIError(429)) is None
+    assert get_retry_after_seconds(ValueError("No response")) is None
+
+
+def test_is_retryable_error() -> None:
+    assert is_retryable_error(APIError(429))
+    assert is_retryable_error(APIError(503))
+    assert is_retryable_error(ConnectionError("Connection reset"))
+    assert not is_retryable_error(APIError(401))
+
+
+def test_retry_scheduler_retries_transient_errors() -> None:
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=3, base_delay_seconds=0))
+    flaky_function = FlakyFunction([APIError(503), APIError(429, {"retry-after": "0"})])
+
+    assert scheduler.call(flaky_function) == "ok"
+    assert flaky_function.num_calls == 3
+    assert (scheduler.stats.calls, scheduler.stats.attempts, scheduler.stats.retries) == (1, 3, 2)
+
+
+def test_retry_scheduler_does_not_retry_client_errors() -> None:
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=3, base_delay_seconds=0))
+    flaky_function = FlakyFunction([APIError(401)])
+
+    with pytest.raises(APIError):
+        scheduler.call(flaky_function)
+    assert flaky_function.num_calls == 1
+
+
+def test_retry_scheduler_does_not_wait_long_retry_after() -> None:
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=3, base_delay_seconds=0, max_delay_seconds=10))
+    flaky_function = FlakyFunction([APIError(429, {"retry-after": "3600"})])
+
+    with pytest.raises(APIError):
+        scheduler.call(flaky_function)
+    assert flaky_function.num_calls == 1
+
+
+def test_retry_scheduler_async() -> None:
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=2, base_delay_seconds=0))
+    flaky_function = FlakyFunction([APIError(500)])
+
+    async def async_flaky_function() -> str:
+        return flaky_function()
+
+    assert asyncio.run(scheduler.acall(async_flaky_function)) == "ok"
+    assert flaky_function.num_calls == 2
+
+
+def test_retry_scheduler_circuit_breaker() -> None:
+    circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout_seconds=60)
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=2, base_delay_seconds=0), circuit_breaker=circuit_breaker)
+    flaky_function = FlakyFunction([APIError(503), APIError(503)])
+
+    with pytest.raises(APIError):
+        scheduler.call(flaky_function)
+    assert circuit_breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        scheduler.call(flaky_function)
+    assert flaky_function.num_calls == 2
+    assert scheduler.stats.circuit_rejections == 1
+
+
+def test_circuit_breaker_half_open() -> None:
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout_seconds=0)
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state == "half_open"
+    assert circuit_breaker.allow_call()
+    assert not circuit_breaker.allow_call()  # Only a single trial call
+
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == "closed"
+
+
+def test_circuit_breaker_cancelled_trial() -> None:
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout_seconds=0)
+    scheduler = RetryScheduler(RetryPolicy(max_attempts=1), circuit_breaker=circuit_breaker)
+    circuit_breaker.record_failure()
+
+    async def slow_function() -> str:
+        await asyncio.sleep(10)
+        return "ok"
+
+    async def cancel_trial() -> None:
+        trial = asyncio.create_task(scheduler.acall(slow_function))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+    # The cancelled trial tells nothing of the API: the circuit stays half open, and lets the next trial through
+    asyncio.run(cancel_trial())
+    assert circuit_breaker.state == "half_open"
+    assert scheduler.call(lambda: "ok") == "ok"
+    assert circuit_breaker.state == "closed"
+
+
+def test_token_bucket() -> None:
+    token_bucket = TokenBucket(rate_per_second=10, capacity=2)
+
+    assert token_bucket.reserve() == 0
+    assert token_bucket.reserve() == 0
+    assert token_bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert token_bucket.reserve() == pytest.approx(0.2, abs=0.01)
@@ -0,0 +1,52 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from app.logic.schema_selection import SchemaIndex, tokenize_question
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+TABLES_COLUMNS = {
+    "game_boxscore": [("game_id", "VARCHAR"), ("player_id", "VARCHAR"), ("team_id", "VARCHAR"), ("points", "INTEGER")],
+    "game_summary": [("id", "VARCHAR"), ("season_id", "VARCHAR"), ("date", "DATE"), ("home_team_id", "VARCHAR")],
+    "player": [("id", "VARCHAR"), ("player_name", "VARCHAR"), ("birth_date", "DATE")],
+    "player_season": [("player_id", "VARCHAR"), ("season_id", "VARCHAR"), ("nb_games", "INTEGER")],
+    "season": [("id", "VARCHAR"), ("start_year", "INTEGER")],
+    "team": [("id", "VARCHAR"), ("team_name", "VARCHAR"), ("abbreviation", "VARCHAR")],
+    "team_season": [("team_id", "VARCHAR"), ("season_id", "VARCHAR"), ("pct_game_win", "DOUBLE")],
+}
+
+
+def test_tokenize_question() -> None:
+    assert {"point", "season", "year", "player"} <= tokenize_question("Points scored in 2018?", entity_kinds=["player"])
+
+
+def test_schema_index_foreign_keys() -> None:
+    schema_index = SchemaIndex(TABLES_COLUMNS)
+
+    assert schema_index.foreign_keys["game_boxscore"] == {
+        "game_id": "game_summary",
+        "player_id": "player",
+        "team_id": "team",
+    }
+    assert schema_index.foreign_keys["game_summary"] == {"season_id": "season", "home_team_id": "team"}
+
+
+def test_schema_index_select_with_join_closure() -> None:
+    schema_index = SchemaIndex(TABLES_COLUMNS)
+
+    selected_tables_columns = schema_index.select("Max points scored by LeBron James?", entity_kinds=["player"])
+
+    assert set(selected_tables_columns) == {"game_boxscore", "game_summary", "player", "season", "team"}
+    assert selected_tables_columns["game_boxscore"] == TABLES_COLUMNS["game_boxscore"]
+    assert selected_tables_columns["team"] == [("id", "VARCHAR"), ("team_name", "VARCHAR")]  # Only kept for joins
+
+
+def test_schema_index_select_joining_table() -> None:
+    schema_index = SchemaIndex(TABLES_COLUMNS)
+
+    # The player and season tables are not connected: a table joining them is needed
+    assert schema_index.close_over_joins({"player", "season"}) == {"player", "season", "player_season"}
+
+    # Nothing relevant is found: the whole schema is kept
+    assert schema_index.select("Hello there") == TABLES_COLUMNS
@@ -0,0 +1,109 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.logic.pipeline import normalize_question
+from app.singleflight import SingleFlight
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def wait_for_calls(single_flight: SingleFlight, num_calls: int) -> None:
+    """Wait until a number of calls joined the group, the last ones being given time to wait for the leader."""
+    while single_flight.stats.calls < num_calls:
+        time.sleep(0.001)
+    time.sleep(0.05)
+
+
+def test_concurrent_calls_are_coalesced() -> None:
+    single_flight = SingleFlight(name="tests")
+    release = threading.Event()
+    executions = []
+
+    def compute(value: int) -> list[int]:
+        executions.append(value)
+        release.wait()
+        return [value]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(single_flight.call, "key", compute, 1) for _ in range(4)]
+        wait_for_calls(single_flight, 4)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert executions == [1]
+    assert all(result is results[0] for result in results)
+    assert (single_flight.stats.calls, single_flight.stats.executions, single_flight.stats.coalesced) == (4, 1, 3)
+
+    # Once the call is done, the key is released: the next call runs the function again
+    assert single_flight.call("key", lambda: "new") == "new"
+    assert single_flight.stats.executions == 2  # noqa: PLR2004
+
+
+def test_failure_is_propagated_to_coalesced_calls() -> None:
+    single_flight = SingleFlight(name="tests")
+    release = threading.Event()
+
+    def fail() -> None:
+        release.wait()
+        error_msg = "boom"
+        raise ValueError(error_msg)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(single_flight.call, "key", fail) for _ in range(3)]
+        wait_for_calls(single_flight, 3)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="boom"):
+                future.result()
+
+    assert single_flight.stats.executions == 1
+    assert single_flight.stats.coalesced == 2  # noqa: PLR2004
+
+
+def test_async_calls_are_coalesced() -> None:
+    single_flight = SingleFlight(name="tests")
+    executions = []
+
+    async def compute(key: str) -> str:
+        executions.append(key)
+        await asyncio.sleep(0.05)
+        return key.upper()
+
+    async def run() -> list[str]:
+        return await asyncio.gather(*(single_flight.acall(key, compute, key) for key in ["a", "b", "a", "a"]))
+
+    assert asyncio.run(run()) == ["A", "B", "A", "A"]
+    assert executions == ["a", "b"]
+    assert single_flight.stats.coalesced == 2  # noqa: PLR2004
+
+
+def test_cancelled_leader_doesnt_fail_coalesced_calls() -> None:
+    single_flight = SingleFlight(name="tests")
+
+    async def compute() -> str:
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def run() -> str:
+        leader = asyncio.create_task(single_flight.acall("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(single_flight.acall("key", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "result"
+    assert single_flight.stats.executions == 2  # noqa: PLR2004
+    assert single_flight.stats.coalesced == 0
+
+
+def test_normalize_question() -> None:
+    assert normalize_question("  Who scored  the most\npoints ? ") == normalize_question("who scored the most points ?")
@@ -0,0 +1,106 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from app.logic.gazetteer import Gazetteer
+from app.logic.sql_cache import SemanticSqlCache, canonicalize_question, jaccard_similarity, templatize_sql_query
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+GAZETTEER = Gazetteer(["LeBron James", "Kevin Durant", "Shaquille O'Neal"], ["Boston Celtics", "Miami Heat"])
+SQL_QUERY = (
+    "select max(b.points) from game_boxscore b join player p on p.id = b.player_id "
+    "join game_summary g on g.id = b.game_id join season s on s.id = g.season_id "
+    "where p.player_name = 'LeBron James' and s.start_year = 2018"
+)
+
+
+def canonicalize(question: str) -> object:
+    return canonicalize_question(question, GAZETTEER.find_spans(question))
+
+
+def test_canonicalize_question() -> None:
+    canonical_question = canonicalize("How many points did LeBron James score in 2018?")
+
+    assert canonical_question.text == "many point <player_0> score <number_0>"
+    assert canonical_question.slots == {"player_0": "LeBron James", "number_0": "2018"}
+
+
+def test_templatize_sql_query() -> None:
+    sql_template, fixed_slots = templatize_sql_query("select round(avg(points), 1) limit 1", {"number_0": "1"})
+    assert (sql_template, fixed_slots) == ("select round(avg(points), 1) limit 1", {"number_0": "1"})
+
+    sql_template, fixed_slots = templatize_sql_query(SQL_QUERY, {"player_0": "LeBron James", "number_0": "2018"})
+    assert "p.player_name = '<<player_0>>' and s.start_year = <<number_0>>" in sql_template
+    assert fixed_slots == {}
+
+
+def test_semantic_sql_cache_escapes_quotes(tmp_path: Path) -> None:
+    sql_cache = SemanticSqlCache(path=tmp_path / "sql_cache.sqlite", min_similarity=0.8)
+    sql_cache.set(canonicalize("What is the max number of points scored by LeBron James in 2018?"), SQL_QUERY)
+
+    sql_cache_match = sql_cache.get(canonicalize("What is the max number of points of Shaquille O'Neal in 1999?"))
+    assert "p.player_name = 'Shaquille O''Neal' and s.start_year = 1999" in sql_cache_match.sql_query
+    assert len(duckdb.extract_statements(sql_cache_match.sql_query)) == 1  # The query parses
+
+
+def test_semantic_sql_cache(tmp_path: Path) -> None:
+    sql_cache = SemanticSqlCache(path=tmp_path / "sql_cache.sqlite", min_similarity=0.8)
+    sql_cache.set(canonicalize("What is the max number of points scored by LeBron James in 2018?"), SQL_QUERY)
+
+    # Paraphrase with other slot values
+    sql_cache_match = sql_cache.get(canonicalize("highest number of points scored by Kevin Durant in 2015 ?"))
+    assert sql_cache_match.similarity == 1.0
+    assert sql_cache_match.sql_query == SQL_QUERY.replace("LeBron James", "Kevin Durant").replace("2018", "2015")
+
+    # Near duplicate
+    sql_cache_match = SemanticSqlCache(path=tmp_path / "sql_cache.sqlite", min_similarity=0.8).get(
+        canonicalize("Please, what is the maximum number of points ever scored by Kevin Durant in 2015?")
+    )
+    assert 0.8 <= sql_cache_match.similarity < 1.0
+
+    # Different question, or different slots
+    assert sql_cache.get(canonicalize("What is the min number of points scored by LeBron James in 2018?")) is None
+    assert sql_cache.get(canonicalize("What is the max number of points scored by the Miami Heat in 2018?")) is None
+    assert sql_cache.stats.misses == 2
+
+
+def test_semantic_sql_cache_fixed_slots() -> None:
+    sql_cache = SemanticSqlCache(path=None, min_similarity=0.8)
+    sql_cache.set(canonicalize("Max number of points scored by LeBron James?"), "select 1")
+    sql_cache.set(canonicalize("Max number of points scored by Kevin Durant?"), "select 2")
+
+    # The values of the slots aren't in the SQL queries: each question has its own entry
+    assert len(sql_cache) == 2
+    assert sql_cache.get(canonicalize("max number of points scored by LeBron James")).sql_query == "select 1"
+    assert sql_cache.get(canonicalize("max number of points scored by Kevin Durant")).sql_query == "select 2"
+
+
+CACHED_QUESTION = (
+    "What is the highest number of points scored by the home team in a single game during the regular season?"
+)
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "What is the lowest number of points scored by the home team in a single game during the regular season?",
+        "What is the highest number of points scored by the away team in a single game during the regular season?",
+        "What is the highest number of points not scored by the home team in a single game during the regular season?",
+        "What is the highest number of points scored by the home team in a single game during the playoff season?",
+    ],
+)
+def test_semantic_sql_cache_near_duplicates_with_other_meaning(question: str) -> None:
+    sql_cache = SemanticSqlCache(path=None, min_similarity=0.8)
+    sql_cache.set(
+        canonicalize(CACHED_QUESTION), "select max(home_team_points) from game_summary where is_regular_season"
+    )
+
+    # Near duplicates, but their SQL queries differ
+    assert jaccard_similarity(canonicalize(question).tokens, canonicalize(CACHED_QUESTION).tokens) >= 0.8  # noqa: PLR2004
+    assert sql_cache.get(canonicalize(question)) is None
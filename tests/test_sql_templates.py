@@ -0,0 +1,128 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+from typing import Optional
+
+import duckdb
+import pytest
+
+from app.logic.gazetteer import Gazetteer
+from app.logic.sql_templates import SqlTemplateMatch, match_sql_template
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+GAZETTEER = Gazetteer(["LeBron James", "Kevin Durant", "D'Angelo Russell"], ["Boston Celtics", "Miami Heat"])
+
+
+def match(question: str) -> Optional[SqlTemplateMatch]:
+    return match_sql_template(question, GAZETTEER.find_spans(question))
+
+
+@pytest.mark.parametrize(
+    ("question", "intent", "slots"),
+    [
+        (
+            "Who are the top 5 players by points in the 2022 season?",
+            "top_players_by_stat_in_season",
+            {"limit": "5", "season": "2022", "stat": "points", "aggregation": "sum"},
+        ),
+        (
+            "List the top 3 players by average assists per game during the 2018-19 season",
+            "top_players_by_stat_in_season",
+            {"limit": "3", "season": "2018", "stat": "assists", "aggregation": "avg"},
+        ),
+        (
+            "Which are the 10 players with the most rebounds in the season starting in 2010?",
+            "top_players_by_stat_in_season",
+            {"limit": "10", "season": "2010", "stat": "total_rebounds", "aggregation": "sum"},
+        ),
+        (
+            "What is LeBron James's career high in points?",
+            "player_career_high_in_stat",
+            {"stat": "points", "player": "LeBron James"},
+        ),
+        (
+            "What is the highest number of blocks by Kevin Durant in a single game?",
+            "player_career_high_in_stat",
+            {"stat": "blocks", "player": "Kevin Durant"},
+        ),
+        (
+            "What is the record of the Miami Heat in the 2022 season?",
+            "team_record_in_season",
+            {"season": "2022", "team": "Miami Heat"},
+        ),
+        (
+            "Boston Celtics' win-loss record during the 2015-16 season",
+            "team_record_in_season",
+            {"season": "2015", "team": "Boston Celtics"},
+        ),
+    ],
+)
+def test_match_sql_template(question: str, intent: str, slots: dict[str, str]) -> None:
+    sql_template_match = match(question)
+
+    assert sql_template_match is not None
+    assert (sql_template_match.intent, sql_template_match.slots) == (intent, slots)
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        # Other constraints, or instructions on the result, are left to the LLM
+        "Who are the top 5 players by points at home in the 2022 season?",
+        "What is the highest number of points scored in a single game by LeBron James? Return only the number.",
+        "What is the record of the Miami Heat against the Boston Celtics in the 2022 season?",
+        "What is the career high in points of LeBron James and Kevin Durant?",
+        "Who are the top 5 players by points?",
+    ],
+)
+def test_unmatched_questions(question: str) -> None:
+    assert match(question) is None
+
+
+def test_names_are_escaped() -> None:
+    sql_template_match = match("What is D'Angelo Russell's career high in assists?")
+
+    assert sql_template_match is not None
+    assert "p.player_name = 'D''Angelo Russell'" in sql_template_match.sql_query
+
+
+def test_templates_run_on_db_schema() -> None:
+    with duckdb.connect() as connection:
+        connection.execute("create table player (id varchar, player_name varchar, birth_date date)")
+        connection.execute("create table team (id varchar, team_name varchar, abbreviation varchar)")
+        connection.execute("create table season (id varchar, start_year integer, end_year integer)")
+        connection.execute(
+            "create table game_summary (id varchar, season_id varchar, date date, is_regular_season boolean, "
+            "home_team_id varchar, away_team_id varchar, home_team_points integer, away_team_points integer)"
+        )
+        connection.execute(
+            "create table game_boxscore (game_id varchar, player_id varchar, team_id varchar, minute_played double, "
+            "points integer, total_rebounds integer, assists integer, steals integer, blocks integer, "
+            "three_pts_attempts integer)"
+        )
+        connection.execute("insert into player values ('p1', 'LeBron James', null), ('p2', 'Kevin Durant', null)")
+        connection.execute("insert into team values ('t1', 'Miami Heat', 'MIA'), ('t2', 'Boston Celtics', 'BOS')")
+        connection.execute("insert into season values ('s1', 2022, 2023)")
+        connection.execute(
+            "insert into game_summary values ('g1', 's1', null, true, 't1', 't2', 110, 100), "
+            "('g2', 's1', null, true, 't2', 't1', 120, 90), ('g3', 's1', null, true, 't2', 't1', 95, 99)"
+        )
+        connection.execute(
+            "insert into game_boxscore values ('g1', 'p1', 't1', 40, 30, 8, 9, 1, 2, 7), "
+            "('g2', 'p1', 't1', 38, 42, 6, 7, 0, 1, 9), ('g1', 'p2', 't2', 36, 35, 5, 4, 2, 3, 8)"
+        )
+
+        def run(question: str) -> list[tuple]:
+            sql_template_match = match(question)
+            assert sql_template_match is not None
+            return connection.execute(sql_template_match.sql_query).fetchall()
+
+        assert run("Who are the top 2 players by points in the 2022 season?") == [
+            ("LeBron James", 72),
+            ("Kevin Durant", 35),
+        ]
+        assert run("Top 1 players by points per game in the 2022 season") == [("LeBron James", 36.0)]
+        assert run("What is LeBron James's career high in points?") == [(42,)]
+        assert run("What is the record of the Miami Heat in the 2022 season?") == [(2, 1)]
@@ -0,0 +1,111 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from app.configuration import get_config
+from app.tracing import increment_span_attribute, set_span_attributes, span, start_trace, traced
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def test_span_outside_of_trace_is_noop() -> None:
+    with span("stage") as current_span:
+        set_span_attributes({"rows": 1})
+        assert current_span is None
+
+
+def test_spans_are_nested() -> None:
+    @traced("query")
+    def query() -> None:
+        increment_span_attribute("attempts")
+        increment_span_attribute("attempts")
+
+    with start_trace("request") as trace:
+        with span("stage", {"kind": "sql"}):
+            query()
+        query()
+
+    root, stage, nested_query, query_span = trace.spans
+    assert [s.name for s in trace.spans] == ["request", "stage", "query", "query"]
+    assert root.parent_span_id is None
+    assert stage.parent_span_id == root.span_id
+    assert nested_query.parent_span_id == stage.span_id
+    assert query_span.parent_span_id == root.span_id
+    assert stage.attributes == {"kind": "sql"}
+    assert query_span.attributes == {"attempts": 2}
+    assert all(s.trace_id == trace.trace_id and s.duration_seconds >= 0 for s in trace.spans)
+
+
+def test_spans_are_nested_across_tasks_and_threads() -> None:
+    @traced("thread_stage")
+    def thread_stage() -> None:
+        set_span_attributes({"thread": True})
+
+    @traced("task_stage")
+    async def task_stage() -> None:
+        await asyncio.to_thread(thread_stage)
+
+    async def answer() -> None:
+        with start_trace("request"):
+            await asyncio.gather(task_stage(), task_stage())
+
+    with start_trace("batch") as trace:
+        asyncio.run(answer())
+
+    spans_by_id = {s.span_id: s for s in trace.spans}
+    for thread_span in (s for s in trace.spans if s.name == "thread_stage"):
+        assert thread_span.attributes == {"thread": True}
+        assert spans_by_id[thread_span.parent_span_id].name == "task_stage"
+    assert len(trace.spans) == 6  # noqa: PLR2004
+
+
+def test_failed_span_has_error_status() -> None:
+    @traced("stage")
+    def stage() -> None:
+        error_msg = "boom"
+        raise ValueError(error_msg)
+
+    with start_trace("request") as trace, pytest.raises(ValueError, match="boom"):
+        stage()
+
+    assert [s.status for s in trace.spans] == ["ok", "error"]
+    assert trace.spans[1].status_message == "ValueError: boom"
+
+
+def test_trace_export(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    export_path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(get_config(), "trace_export_path", export_path)
+    for _ in range(2):
+        with start_trace("request", {"question": "Who?"}), span("stage"):
+            set_span_attributes({"rows": 3, "cache_hit": False, "ratio": 0.5})
+
+    lines = export_path.read_text().splitlines()
+    assert len(lines) == 2  # noqa: PLR2004
+    resource_spans = json.loads(lines[0])["resourceSpans"][0]
+    root, stage = resource_spans["scopeSpans"][0]["spans"]
+    assert not root["parentSpanId"]
+    assert stage["parentSpanId"] == root["spanId"]
+    assert root["attributes"] == [{"key": "question", "value": {"stringValue": "Who?"}}]
+    assert stage["attributes"] == [
+        {"key": "rows", "value": {"intValue": "3"}},
+        {"key": "cache_hit", "value": {"boolValue": False}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+    ]
+    assert int(stage["endTimeUnixNano"]) >= int(stage["startTimeUnixNano"])
+    assert stage["status"] == {"code": 1}
+
+
+def test_waterfall_rows() -> None:
+    with start_trace("request") as trace, span("stage"), span("query"):
+        pass
+
+    rows = trace.to_waterfall_rows()
+    assert [row["label"] for row in rows] == [" 1. request", " 2.   stage", " 3.     query"]
+    assert rows[0]["start_ms"] == 0
+    assert all(row["start_ms"] <= row["end_ms"] <= rows[0]["end_ms"] for row in rows)
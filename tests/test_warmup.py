@@ -0,0 +1,30 @@
+# -------------------------------------------------------------------------------------------------------------------- #
+# Imports
+
+import json
+from pathlib import Path
+
+from app.warmup import load_warmup_queries, parse_hot_columns
+
+# -------------------------------------------------------------------------------------------------------------------- #
+# Tests
+
+
+def test_parse_hot_columns() -> None:
+    tables_columns = {
+        "player": [("id", "VARCHAR"), ("player_name", "VARCHAR")],
+        "game_boxscore": [("player_id", "VARCHAR"), ("points", "INTEGER"), ("assists", "INTEGER")],
+    }
+    hot_columns = ["player", "game_boxscore.points", "game_boxscore.player_id", "game_boxscore.points", "team", "a.b"]
+    assert parse_hot_columns(hot_columns, tables_columns) == {
+        "player": ["id", "player_name"],
+        "game_boxscore": ["points", "player_id"],
+    }
+
+
+def test_load_warmup_queries(tmp_path: Path) -> None:
+    queries_path = tmp_path / "queries.json"
+    queries_path.write_text(json.dumps([{"question": "q1", "sql_query": "select 1"}, {"question": "q2"}]))
+    assert load_warmup_queries(queries_path) == ["select 1"]
+    assert load_warmup_queries(tmp_path / "missing.json") == []
+    assert load_warmup_queries(None) == []